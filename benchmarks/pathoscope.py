@@ -0,0 +1,393 @@
+"""
+Benchmarks for the Pathoscope functions in :mod:`virtool.pathoscope`.
+
+A synthetic sample is generated with :func:`generate_alignments` unless an existing VTA file is provided. Each
+function is timed over a number of repeats and its peak memory allocation is measured in a separate run using
+:mod:`tracemalloc`. Results are written as JSON so they can be compared between versions.
+
+Run from the repository root. Nothing is downloaded.
+
+.. code-block:: shell
+
+    # Benchmark a synthetic sample and save the results.
+    python -m benchmarks.pathoscope --reads 500000 --output before.json
+
+    # Benchmark again after making changes and compare with the saved results.
+    python -m benchmarks.pathoscope --reads 500000 --output after.json --compare before.json
+
+    # Benchmark an existing VTA file.
+    python -m benchmarks.pathoscope --vta to_isolates.vta --ref-lengths ref_lengths.json
+
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import virtool.pathoscope
+import virtool.vta
+
+#: The length of the synthetic reads.
+READ_LENGTH = 150
+
+
+def generate_alignments(path, read_count=100000, ref_count=200, isolates_per_otu=4, unique_fraction=0.3,
+                        max_fan_out=20, cross_otu_fraction=0.1, score_sd=8.0, min_length=1000, max_length=12000,
+                        seed=0):
+    """
+    Write a synthetic VTA file to ``path`` that resembles the alignment of a viral sample against isolate indexes.
+
+    References are grouped into OTUs of ``isolates_per_otu`` isolates. OTU abundances follow a Zipf-like distribution.
+    Each read belongs to an OTU. Reads are uniquely mapped with a probability of ``unique_fraction``. Otherwise they map
+    to between 2 and ``max_fan_out`` references, mostly isolates of their own OTU and sometimes
+    (``cross_otu_fraction``) a random reference. Scores are those of end-to-end Bowtie2 alignments with penalties drawn
+    from a half-normal distribution with a standard deviation of ``score_sd``.
+
+    :param path: the path to write the VTA file to
+    :param read_count: the number of reads
+    :param ref_count: the number of references
+    :param isolates_per_otu: the number of references in each OTU
+    :param unique_fraction: the fraction of reads that have one alignment
+    :param max_fan_out: the maximum number of alignments for a read
+    :param cross_otu_fraction: the fraction of multi-mapping alignments to a random reference
+    :param score_sd: the standard deviation of the alignment score penalties
+    :param min_length: the minimum reference length
+    :param max_length: the maximum reference length
+    :param seed: the random seed
+    :return: the length of each reference keyed by reference ID
+
+    """
+    random = np.random.RandomState(seed)
+
+    refs = [f"ref_{i}" for i in range(ref_count)]
+    ref_lengths = random.randint(min_length, max_length + 1, ref_count)
+
+    otu_count = -(-ref_count // isolates_per_otu)
+
+    abundances = 1 / np.arange(1, otu_count + 1)
+    read_otus = random.choice(otu_count, read_count, p=abundances / abundances.sum())
+
+    fan_outs = np.where(
+        random.random_sample(read_count) < unique_fraction,
+        1,
+        random.randint(2, max_fan_out + 1, read_count)
+    )
+
+    reads = np.repeat(np.arange(read_count), fan_outs)
+    alignment_count = len(reads)
+
+    otus = read_otus[reads]
+
+    otu_refs = np.minimum(otus * isolates_per_otu + random.randint(0, isolates_per_otu, alignment_count), ref_count - 1)
+
+    ref_indexes = np.where(
+        (random.random_sample(alignment_count) < cross_otu_fraction) & (fan_outs[reads] > 1),
+        random.randint(0, ref_count, alignment_count),
+        otu_refs
+    )
+
+    records = np.zeros(alignment_count, dtype=virtool.vta.RECORD_DTYPE)
+
+    records["read"] = reads
+    records["ref"] = ref_indexes
+    records["pos"] = 1 + (random.random_sample(alignment_count) * (ref_lengths[ref_indexes] - READ_LENGTH)).astype(int)
+    records["length"] = READ_LENGTH
+    records["score"] = READ_LENGTH - np.round(np.abs(random.normal(0, score_sd, alignment_count)))
+
+    virtool.vta.write(path, records, virtool.vta.encode_table(f"read_{i}" for i in range(read_count)), refs)
+
+    return dict(zip(refs, ref_lengths.tolist()))
+
+
+def measure(func, setup, repeat, memory=True):
+    """
+    Time ``func`` over ``repeat`` runs and measure its peak memory allocation in one additional run.
+
+    ``setup`` is called before each run and its return value is passed to ``func``. It is not timed.
+
+    :param func: the function to measure
+    :param setup: a function returning the arguments for ``func``
+    :param repeat: the number of timed runs
+    :param memory: measure peak memory allocation
+    :return: the measurements
+
+    """
+    seconds = list()
+
+    for _ in range(repeat):
+        args = setup()
+
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+
+    peak = None
+
+    if memory:
+        args = setup()
+
+        tracemalloc.start()
+
+        try:
+            func(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "peak_memory": peak
+    }
+
+
+def run_benchmarks(vta_path, ref_lengths, engines, repeat, proc, work_path, memory=True):
+    """
+    Benchmark the Pathoscope functions using the alignments in the VTA file at ``vta_path``.
+
+    :param vta_path: the path to the VTA file
+    :param ref_lengths: the length of each reference keyed by reference ID
+    :param engines: the names of the EM engines to benchmark
+    :param repeat: the number of timed runs for each function
+    :param proc: the number of processes for EM engines that support them
+    :param work_path: a directory to write output files to
+    :param memory: measure peak memory allocation
+    :return: the measurements keyed by benchmark name
+
+    """
+    rewrite_path = os.path.join(work_path, "rewrite.vta")
+
+    def build():
+        return virtool.pathoscope.build_matrix(vta_path, 0.01),
+
+    def build_reassigned():
+        matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+        virtool.pathoscope.em_vectorized(matrix, 50, 1e-7, 0, 0)
+        return matrix,
+
+    build_matrix = virtool.pathoscope.build_matrix
+
+    results = {
+        "build_matrix": measure(build_matrix, lambda: (vta_path, 0.01), repeat, memory),
+        "build_matrix_collapsed": measure(build_matrix, lambda: (vta_path, 0.01, True), repeat, memory)
+    }
+
+    for engine in engines:
+        em = virtool.pathoscope.EM_ENGINES[engine]
+
+        results[f"em_{engine}"] = measure(lambda m: em(m, 50, 1e-7, 0, 0, proc=proc), build, repeat, memory)
+
+    results["compute_best_hit"] = measure(virtool.pathoscope.compute_best_hit, build_reassigned, repeat, memory)
+
+    results["rewrite_align"] = measure(
+        lambda m: virtool.pathoscope.rewrite_align(m, vta_path, 0.01, rewrite_path),
+        build_reassigned,
+        repeat,
+        memory
+    )
+
+    results["calculate_coverage"] = measure(
+        virtool.pathoscope.calculate_coverage,
+        lambda: (rewrite_path, ref_lengths),
+        repeat,
+        memory
+    )
+
+    return results
+
+
+def get_revision():
+    """
+    Get the current Git revision of the repository or ``None`` if it can't be determined.
+
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Print a comparison of ``results`` with the ``baseline`` results from a previous run.
+
+    """
+    print(f"{'benchmark':<26}{'baseline (s)':>14}{'current (s)':>14}{'speedup':>10}{'memory ratio':>14}")
+
+    for name, current in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+
+        if previous is None:
+            print(f"{name:<26}{'-':>14}{current['median']:>14.4f}{'-':>10}{'-':>14}")
+            continue
+
+        speedup = previous["median"] / current["median"] if current["median"] else float("inf")
+
+        if current["peak_memory"] and previous["peak_memory"]:
+            memory_ratio = f"{current['peak_memory'] / previous['peak_memory']:.2f}"
+        else:
+            memory_ratio = "-"
+
+        print(
+            f"{name:<26}{previous['median']:>14.4f}{current['median']:>14.4f}{speedup:>9.2f}x{memory_ratio:>14}"
+        )
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Pathoscope functions in virtool.pathoscope")
+
+    parser.add_argument("--vta", dest="vta_path", help="benchmark an existing VTA file", metavar="PATH")
+    parser.add_argument(
+        "--ref-lengths",
+        dest="ref_lengths_path",
+        help="a JSON file of reference lengths keyed by reference ID (required with --vta)",
+        metavar="PATH"
+    )
+    parser.add_argument("--reads", dest="read_count", type=int, default=100000, help="the number of synthetic reads")
+    parser.add_argument("--refs", dest="ref_count", type=int, default=200, help="the number of synthetic references")
+    parser.add_argument(
+        "--isolates-per-otu",
+        dest="isolates_per_otu",
+        type=int,
+        default=4,
+        help="the number of references in each synthetic OTU"
+    )
+    parser.add_argument(
+        "--unique-fraction",
+        dest="unique_fraction",
+        type=float,
+        default=0.3,
+        help="the fraction of synthetic reads with a single alignment"
+    )
+    parser.add_argument(
+        "--max-fan-out",
+        dest="max_fan_out",
+        type=int,
+        default=20,
+        help="the maximum number of alignments for a synthetic read"
+    )
+    parser.add_argument(
+        "--cross-otu-fraction",
+        dest="cross_otu_fraction",
+        type=float,
+        default=0.1,
+        help="the fraction of multi-mapping alignments to a random reference"
+    )
+    parser.add_argument(
+        "--score-sd",
+        dest="score_sd",
+        type=float,
+        default=8.0,
+        help="the standard deviation of synthetic alignment score penalties"
+    )
+    parser.add_argument("--seed", dest="seed", type=int, default=0, help="the random seed for the synthetic sample")
+    parser.add_argument(
+        "--engines",
+        dest="engines",
+        nargs="+",
+        default=sorted(virtool.pathoscope.EM_ENGINES),
+        choices=sorted(virtool.pathoscope.EM_ENGINES),
+        help="the EM engines to benchmark"
+    )
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3, help="the number of timed runs")
+    parser.add_argument("--proc", dest="proc", type=int, default=1, help="the number of processes for the EM engines")
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="skip peak memory measurement, which is slow for the python EM engine"
+    )
+    parser.add_argument("--output", dest="output_path", help="write the results to a JSON file", metavar="PATH")
+    parser.add_argument(
+        "--compare",
+        dest="compare_path",
+        help="compare the results with a previous JSON results file",
+        metavar="PATH"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.vta_path and not args.ref_lengths_path:
+        parser.error("--ref-lengths is required with --vta")
+
+    return args
+
+
+def main(argv=None):
+    args = get_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_path:
+        if args.vta_path:
+            vta_path = args.vta_path
+
+            with open(args.ref_lengths_path, "r") as f:
+                ref_lengths = json.load(f)
+
+            sample = {
+                "path": os.path.abspath(vta_path)
+            }
+        else:
+            vta_path = os.path.join(work_path, "synthetic.vta")
+
+            sample = {
+                "read_count": args.read_count,
+                "ref_count": args.ref_count,
+                "isolates_per_otu": args.isolates_per_otu,
+                "unique_fraction": args.unique_fraction,
+                "max_fan_out": args.max_fan_out,
+                "cross_otu_fraction": args.cross_otu_fraction,
+                "score_sd": args.score_sd,
+                "seed": args.seed
+            }
+
+            ref_lengths = generate_alignments(vta_path, **sample)
+
+        sample["alignment_count"] = len(virtool.vta.load(vta_path))
+
+        results = {
+            "revision": get_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "proc": args.proc,
+            "repeat": args.repeat,
+            "sample": sample,
+            "benchmarks": run_benchmarks(
+                vta_path,
+                ref_lengths,
+                args.engines,
+                args.repeat,
+                args.proc,
+                work_path,
+                args.memory
+            )
+        }
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare_path:
+        with open(args.compare_path, "r") as f:
+            compare(results, json.load(f))
+    elif not args.output_path:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+
+
+if __name__ == "__main__":
+    main()
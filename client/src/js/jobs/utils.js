@@ -29,6 +29,10 @@ const buildIndexDescriptions = {
         title: "Generate OTU FASTA",
         description: "Generate a FASTA file containing sequences for all default OTU isolates."
     },
+    build_similarity_index: {
+        title: "Build Similarity Index",
+        description: "Build a local k-mer index used to find reference sequences similar to NuVs contigs."
+    },
     bowtie_build: {
         title: "Bowtie Build",
         description: "Build a Bowtie2 index from the FASTA file generated in the previous step."
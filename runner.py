@@ -0,0 +1,15 @@
+import asyncio
+import sys
+
+import uvloop
+
+import virtool.jobs.runner
+
+sys.dont_write_bytecode = True
+
+if __name__ == "__main__":
+    # Set up event loop using uvloop.
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    loop = asyncio.get_event_loop()
+
+    loop.run_until_complete(virtool.jobs.runner.run())
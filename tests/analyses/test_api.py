@@ -1,6 +1,10 @@
+import random
+
 import pytest
 from aiohttp.test_utils import make_mocked_coro
 
+import virtool.indexes.similarity
+
 
 @pytest.mark.parametrize("ready", [True, False])
 @pytest.mark.parametrize("error", [None, "400", "403", "404"])
@@ -202,11 +206,16 @@ async def test_blast(error, mocker, spawn_client, resp_is, static_time):
 
         await client.db.analyses.insert_one(analysis_document)
 
-    m_initialize_ncbi_blast = mocker.patch("virtool.bio.initialize_ncbi_blast", make_mocked_coro(("FOOBAR1337", 23)))
+    blast = {
+        "rid": "FOOBAR1337",
+        "interval": 3,
+        "ready": False,
+        "last_checked_at": static_time.iso
+    }
 
-    m_check_rid = mocker.patch("virtool.bio.check_rid", make_mocked_coro(return_value=False))
+    m_submit = make_mocked_coro(blast)
 
-    m_wait_for_blast_result = mocker.patch("virtool.bio.wait_for_blast_result", make_mocked_coro())
+    client.app["blast"] = mocker.Mock(submit=m_submit)
 
     await client.put("/api/analyses/foobar/5/blast", {})
 
@@ -239,29 +248,101 @@ async def test_blast(error, mocker, spawn_client, resp_is, static_time):
     assert resp.status == 201
     assert resp.headers["Location"] == "/api/analyses/foobar/5/blast"
 
-    blast = {
-        "rid": "FOOBAR1337",
-        "interval": 3,
-        "ready": False,
-        "last_checked_at": static_time.iso
-    }
-
     assert await resp.json() == blast
 
-    m_initialize_ncbi_blast.assert_called_with(
-        client.settings,
-        "GGAGTTAGATTGG"
-    )
+    m_submit.assert_called_with("foobar", 5, "GGAGTTAGATTGG")
 
-    m_check_rid.assert_called_with(
-        client.settings,
-        "FOOBAR1337"
-    )
 
-    m_wait_for_blast_result.assert_called_with(
-        client.db,
-        client.settings,
-        "foobar",
-        5,
-        "FOOBAR1337"
-    )
+@pytest.mark.parametrize("error", [None, "403", "404_analysis", "404_sequence", "404_index", "409_algorithm"])
+async def test_similar(error, spawn_client, resp_is, tmpdir):
+    """
+    Test that the handler searches the similarity index of the current reference index for the given NuVs sequence.
+
+    """
+    client = await spawn_client(authorize=True)
+
+    client.app["settings"]["data_path"] = str(tmpdir)
+
+    generator = random.Random(7)
+
+    sequence = "".join(generator.choice("ACGT") for _ in range(300))
+
+    if error != "404_analysis":
+        await client.db.analyses.insert_one({
+            "_id": "foobar",
+            "algorithm": "pathoscope_bowtie" if error == "409_algorithm" else "nuvs",
+            "ready": True,
+            "reference": {
+                "id": "baz"
+            },
+            "results": [
+                {"index": 3, "sequence": "ATAGAGATTAGAT"},
+                {"index": 5, "sequence": sequence}
+            ],
+            "sample": {
+                "id": "baz"
+            }
+        })
+
+    await client.db.samples.insert_one({
+        "_id": "baz",
+        "all_read": error != "403",
+        "all_write": False,
+        "group": "tech",
+        "group_read": False,
+        "group_write": False,
+        "user": {
+            "id": "fred"
+        }
+    })
+
+    await client.db.otus.insert_one({"_id": "otu_1", "name": "Prunus virus F"})
+
+    await client.db.indexes.insert_one({"_id": "index_1", "version": 0, "ready": True, "reference": {"id": "baz"}})
+
+    if error != "404_index":
+        virtool.indexes.similarity.build(
+            str(tmpdir.join("references", "baz", "index_1", "similarity")),
+            [("seq_1", "otu_1", sequence)]
+        )
+
+    resp = await client.get(f"/api/analyses/foobar/{4 if error == '404_sequence' else 5}/similar")
+
+    if error == "403":
+        assert await resp_is.insufficient_rights(resp)
+        return
+
+    if error == "404_analysis":
+        assert await resp_is.not_found(resp, "Analysis not found")
+        return
+
+    if error == "404_sequence":
+        assert await resp_is.not_found(resp, "Sequence not found")
+        return
+
+    if error == "404_index":
+        assert await resp_is.not_found(resp, "Similarity index not found")
+        return
+
+    if error == "409_algorithm":
+        assert await resp_is.conflict(resp, "Not a NuVs analysis")
+        return
+
+    assert resp.status == 200
+
+    assert await resp.json() == {
+        "index": {
+            "id": "index_1"
+        },
+        "matches": [
+            {
+                "sequence_id": "seq_1",
+                "otu_id": "otu_1",
+                "otu_name": "Prunus virus F",
+                "length": 300,
+                "shared": len(virtool.indexes.similarity.get_minimizers(sequence.encode())),
+                "containment": 1,
+                "identity": 1
+            }
+        ]
+    }
@@ -69,6 +69,20 @@ async def test_load_results(loadable, mocker, tmpdir):
     }
 
 
+def test_calculate_median_depths():
+    """
+    Test that stored median depths are used when available and that median depths are calculated from the per-base
+    ``align`` list for older documents.
 
+    """
+    document = {
+        "results": [
+            {"id": "foo", "median_depth": 4, "align_rle": {"values": [0, 4], "lengths": [1, 3]}},
+            {"id": "bar", "align": [0, 2, 3, 3]}
+        ]
+    }
 
-
+    assert virtool.analyses.format.calculate_median_depths(document) == {
+        "foo": 4,
+        "bar": 2.5
+    }
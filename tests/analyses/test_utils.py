@@ -21,6 +21,24 @@ def test_collapse_pathoscope_coverage(coverage, expected):
     assert virtool.analyses.utils.transform_coverage_to_coordinates(coverage) == expected
 
 
+@pytest.mark.parametrize("rle,expected", [
+    (
+        {"values": [0, 1, 2, 3, 4, 3, 2], "lengths": [2, 2, 1, 3, 2, 1, 1]},
+        [(0, 0), (1, 0), (2, 1), (3, 1), (4, 2), (5, 3), (7, 3), (8, 4), (9, 4), (10, 3), (11, 2)]
+    ),
+    (
+        {"values": [0, 1, 2, 3, 4, 3, 2, 1], "lengths": [2, 2, 1, 3, 2, 1, 1, 2]},
+        [(0, 0), (1, 0), (2, 1), (3, 1), (4, 2), (5, 3), (7, 3), (8, 4), (9, 4), (10, 3), (11, 2), (12, 1), (13, 1)]
+    )
+])
+def test_transform_rle_to_coordinates(rle, expected):
+    """
+    Test that run-length encoded coverage is converted to the same coordinates as the equivalent coverage list.
+
+    """
+    assert virtool.analyses.utils.transform_rle_to_coordinates(rle) == expected
+
+
 @pytest.mark.parametrize("name", ["nuvs", "pathoscope"])
 def test_get_json_path(name):
     """
@@ -8,6 +8,7 @@ import virtool.users.utils
 def get_settings(no_job_manager, setup):
     return {
         "enable_api": True,
+        "external_jobs": False,
         "force_setup": setup,
         "force_version": "v0.0.0",
         "no_client": True,
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+import virtool.hmm.utils
+
+
+@pytest.fixture
+def hmm_path(tmpdir):
+    path = tmpdir.mkdir("hmm")
+    path.join("profiles.hmm").write("HMMER3/f\n")
+    return str(path)
+
+
+def fake_hmmpress(commands):
+    def run(command):
+        commands.append(command)
+
+        for suffix in virtool.hmm.utils.PRESSED_SUFFIXES:
+            with open(command[-1] + suffix, "w") as f:
+                f.write("pressed")
+
+    return run
+
+
+def test_press_profiles(hmm_path):
+    commands = list()
+
+    assert not virtool.hmm.utils.check_pressed(hmm_path)
+
+    virtool.hmm.utils.press_profiles(hmm_path, fake_hmmpress(commands))
+
+    assert len(commands) == 1
+    assert commands[0][0] == "hmmpress"
+
+    # The profiles should be pressed in a temporary directory that is removed afterwards.
+    assert os.path.dirname(commands[0][1]) != hmm_path
+
+    assert sorted(os.listdir(hmm_path)) == [
+        "profiles.hmm",
+        "profiles.hmm.h3f",
+        "profiles.hmm.h3i",
+        "profiles.hmm.h3m",
+        "profiles.hmm.h3p",
+        "profiles.stamp"
+    ]
+
+    assert virtool.hmm.utils.check_pressed(hmm_path)
+
+
+def test_press_profiles_error(hmm_path):
+    """
+    Test that a failed press leaves the profiles unstamped.
+
+    """
+    virtool.hmm.utils.press_profiles(hmm_path, fake_hmmpress(list()))
+
+    def run(command):
+        raise OSError("hmmpress not found")
+
+    with pytest.raises(OSError):
+        virtool.hmm.utils.press_profiles(hmm_path, run)
+
+    assert not virtool.hmm.utils.check_pressed(hmm_path)
+    assert "profiles.stamp" not in os.listdir(hmm_path)
+
+
+@pytest.mark.parametrize("change", ["replaced", "missing_pressed", "missing_stamp"])
+def test_check_pressed(change, hmm_path):
+    virtool.hmm.utils.press_profiles(hmm_path, fake_hmmpress(list()))
+
+    profiles_path = os.path.join(hmm_path, "profiles.hmm")
+
+    if change == "replaced":
+        with open(profiles_path + ".new", "w") as f:
+            f.write("HMMER3/f\nNAME  vFam_1\n")
+
+        os.replace(profiles_path + ".new", profiles_path)
+
+    elif change == "missing_pressed":
+        os.remove(profiles_path + ".h3m")
+
+    else:
+        os.remove(os.path.join(hmm_path, "profiles.stamp"))
+
+    assert not virtool.hmm.utils.check_pressed(hmm_path)
+
+
+def test_lock_profiles(hmm_path):
+    with virtool.hmm.utils.lock_profiles(hmm_path):
+        with virtool.hmm.utils.lock_profiles(hmm_path):
+            pass
+
+    with virtool.hmm.utils.lock_profiles(hmm_path, exclusive=True):
+        pass
+
+    assert os.path.isfile(os.path.join(hmm_path, "profiles.lock"))
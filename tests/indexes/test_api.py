@@ -178,6 +178,7 @@ class TestCreate:
             "created_at": static_time.datetime,
             "ready": False,
             "has_files": True,
+            "isolate_index": None,
             "manifest": "manifest",
             "job": {
                 "id": expected_job_id
@@ -195,6 +196,7 @@ class TestCreate:
         assert await client.db.jobs.find_one() == {
             "_id": test_random_alphanumeric.history[2],
             "args": {
+                "build_isolate_index": False,
                 "index_id": "u3cuwaoq",
                 "index_version": 9,
                 "manifest": "manifest",
@@ -0,0 +1,113 @@
+import random
+
+import numpy as np
+import pytest
+
+import virtool.bio
+import virtool.indexes.similarity
+
+
+@pytest.fixture
+def sequences():
+    generator = random.Random(7)
+
+    return [
+        (f"seq_{i}", f"otu_{i // 2}", "".join(generator.choice("ACGT") for _ in range(generator.randint(500, 2000))))
+        for i in range(20)
+    ]
+
+
+def test_get_kmer_hashes():
+    """
+    Test that a sequence and its reverse complement have the same k-mer hashes and that k-mers containing invalid bases
+    are given the maximum hash.
+
+    """
+    sequence = "ACGTTGCAAGTCCGATGATTGACCA"
+
+    hashes = virtool.indexes.similarity.get_kmer_hashes(sequence.encode())
+    reverse = virtool.indexes.similarity.get_kmer_hashes(virtool.bio.reverse_complement(sequence).encode())
+
+    assert len(hashes) == len(sequence) - virtool.indexes.similarity.K + 1
+    assert hashes.tolist() == reverse[::-1].tolist()
+
+    hashes = virtool.indexes.similarity.get_kmer_hashes(b"ACGTTGCAAGTCCGANGATTGACCA")
+
+    assert (hashes == virtool.indexes.similarity.MAX_HASH).tolist() == [False] + [True] * 10
+
+
+@pytest.mark.parametrize("sequence,count", [(b"", 0), (b"ACGT", 0), (b"ACGTTGCAAGTCCGA", 1), (b"N" * 30, 0)])
+def test_get_minimizers_short(sequence, count):
+    assert len(virtool.indexes.similarity.get_minimizers(sequence)) == count
+
+
+def test_build(sequences, tmpdir):
+    path = str(tmpdir.join("similarity"))
+
+    assert virtool.indexes.similarity.build(path, sequences) == 20
+
+    index = virtool.indexes.similarity.SimilarityIndex(path)
+
+    assert len(index) == 20
+    assert np.all(np.diff(index.hashes.astype(np.float64)) >= 0)
+    assert [sequence["id"] for sequence in index.sequences] == [sequence_id for sequence_id, _, _ in sequences]
+
+
+def test_build_incremental(sequences, tmpdir):
+    """
+    Test that only new or changed sequences are sketched when a previous index is available and that the result is
+    the same as building from scratch.
+
+    """
+    previous_path = str(tmpdir.join("previous"))
+
+    virtool.indexes.similarity.build(previous_path, sequences)
+
+    sequences[3] = ("seq_3", "otu_1", sequences[3][2][:400])
+    sequences.append(("seq_20", "otu_10", sequences[0][2][100:900]))
+
+    path = str(tmpdir.join("incremental"))
+    full_path = str(tmpdir.join("full"))
+
+    assert virtool.indexes.similarity.build(path, sequences, previous_path) == 2
+    assert virtool.indexes.similarity.build(full_path, sequences, str(tmpdir.join("missing"))) == 21
+
+    incremental = virtool.indexes.similarity.SimilarityIndex(path)
+    full = virtool.indexes.similarity.SimilarityIndex(full_path)
+
+    assert incremental.hashes.tolist() == full.hashes.tolist()
+    assert incremental.targets.tolist() == full.targets.tolist()
+    assert incremental.sequences == full.sequences
+
+
+def test_search(sequences, tmpdir):
+    path = str(tmpdir.join("similarity"))
+
+    virtool.indexes.similarity.build(path, sequences)
+
+    index = virtool.indexes.similarity.load(path)
+
+    generator = random.Random(3)
+
+    # Introduce substitutions at about 2% of positions in part of seq_5.
+    query = "".join(
+        generator.choice("ACGT") if generator.random() < 0.02 else base for base in sequences[5][2][100:400]
+    )
+
+    matches = index.search(query)
+
+    assert matches[0]["sequence_id"] == "seq_5"
+    assert matches[0]["otu_id"] == "otu_2"
+    assert 0.9 < matches[0]["identity"] <= 1
+
+    assert all(match["shared"] < matches[0]["shared"] / 4 for match in matches[1:])
+
+    # The reverse complement of a sequence should match it exactly.
+    matches = index.search(virtool.bio.reverse_complement(sequences[8][2]), limit=1)
+
+    assert len(matches) == 1
+    assert matches[0]["sequence_id"] == "seq_8"
+    assert matches[0]["containment"] == 1
+    assert matches[0]["identity"] == 1
+
+    assert index.search("ACGT") == []
@@ -61,3 +61,31 @@ async def test_get(error, spawn_client, test_job, resp_is):
             }
         ]
     }
+
+
+@pytest.mark.parametrize("error", [None, "404"])
+async def test_get_metrics(error, mocker, spawn_client, resp_is):
+    client = await spawn_client(authorize=True)
+
+    metrics = {
+        "queue_depth": 2,
+        "messages": {
+            "received": 12,
+            "dispatched": 5,
+            "batches": 3,
+            "last_batch": 4
+        },
+        "latency": None
+    }
+
+    if not error:
+        client.app["jobs"] = mocker.Mock(metrics=metrics)
+
+    resp = await client.get("/api/jobs/metrics")
+
+    if error:
+        assert await resp_is.not_found(resp, "Job manager not running")
+        return
+
+    assert resp.status == 200
+    assert await resp.json() == metrics
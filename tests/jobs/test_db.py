@@ -134,3 +134,60 @@ async def test_delete_zombies(dbi):
         documents[3],
         documents[1]
     ]
+
+
+async def test_requeue_zombies(dbi):
+    """
+    Test that running jobs for resumable tasks are put back into the waiting state and kept by
+    :func:`delete_zombies`, and that jobs leased by job runners are left alone.
+
+    """
+    waiting = dict(status, state="waiting", stage=None, progress=0)
+    running = dict(status, stage="assemble")
+
+    await dbi.jobs.insert_many([
+        {"_id": "nuvs", "task": "nuvs", "status": [waiting, running]},
+        {"_id": "waiting", "task": "nuvs", "status": [waiting]},
+        {"_id": "leased", "task": "nuvs", "status": [waiting, running]},
+        {"_id": "sample", "task": "create_sample", "status": [waiting, running]}
+    ])
+
+    await dbi.job_leases.insert_one({"_id": "leased", "runner": "runner_1"})
+
+    assert await virtool.jobs.db.requeue_zombies(dbi, ["nuvs"]) == ["nuvs"]
+
+    await virtool.jobs.db.delete_zombies(dbi, ["nuvs"])
+
+    assert sorted(await dbi.jobs.distinct("_id")) == ["leased", "nuvs", "waiting"]
+
+    latest = (await dbi.jobs.find_one("nuvs"))["status"][-1]
+
+    assert latest["state"] == "waiting"
+    assert latest["stage"] == "assemble"
+    assert latest["progress"] == 0.5
+
+    assert len((await dbi.jobs.find_one("leased"))["status"]) == 2
+
+
+@pytest.mark.parametrize("external", [False, True])
+async def test_delete_zombies_external(external, dbi):
+    """
+    Test that waiting jobs that have not been claimed yet are kept when jobs are run by standalone job runners and
+    that jobs leased by runners are never deleted.
+
+    """
+    waiting = dict(status, state="waiting", stage=None, progress=0)
+
+    await dbi.jobs.insert_many([
+        {"_id": "waiting", "task": "create_sample", "status": [waiting]},
+        {"_id": "running", "task": "create_sample", "status": [waiting, dict(status)]},
+        {"_id": "leased", "task": "create_sample", "status": [waiting, dict(status)]}
+    ])
+
+    await dbi.job_leases.insert_one({"_id": "leased", "runner": "runner_1"})
+
+    await virtool.jobs.db.delete_zombies(dbi, external=external)
+
+    expected = ["leased", "waiting"] if external else ["leased"]
+
+    assert sorted(await dbi.jobs.distinct("_id")) == expected
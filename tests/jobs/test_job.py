@@ -0,0 +1,363 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+import virtool.jobs.job
+
+
+@pytest.fixture
+def job(tmpdir):
+    tmpdir.mkdir("logs").mkdir("jobs")
+
+    return virtool.jobs.job.Job("mongodb://localhost:27017", "test", {"data_path": str(tmpdir)}, "foobar", None)
+
+
+def python_command(code):
+    return [sys.executable, "-c", code]
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 1024])
+def test_watch_pipes(block_size):
+    """
+    Test that lines from stdout and stderr are passed to their handlers with the same content they would have if read
+    with ``readline()``, regardless of how they are split into blocks.
+
+    """
+    process = subprocess.Popen(
+        python_command(
+            "import sys\n"
+            "for i in range(500): sys.stdout.write(f'out {i}\\n')\n"
+            "sys.stderr.write('err 1\\nerr 2\\r\\n')\n"
+            "sys.stdout.write('no newline')\n"
+        ),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    stdout = list()
+    stderr = list()
+
+    virtool.jobs.job.watch_pipes(
+        process,
+        {
+            process.stdout: stdout.append,
+            process.stderr: stderr.append
+        },
+        block_size=block_size
+    )
+
+    assert process.wait() == 0
+
+    assert stdout == [f"out {i}\n".encode() for i in range(500)] + [b"no newline"]
+    assert stderr == [b"err 1\n", b"err 2\r\n"]
+
+
+def test_watch_pipes_orphan(monkeypatch):
+    """
+    Test that :func:`watch_pipes` returns promptly when the process exits even if its pipe is held open by an orphaned
+    child process.
+
+    """
+    monkeypatch.setattr(virtool.jobs.job, "PIPE_POLL_INTERVAL", 0.1)
+
+    process = subprocess.Popen(
+        python_command(
+            "import subprocess, sys\n"
+            "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)'])\n"
+            "print('done', flush=True)\n"
+        ),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+
+    lines = list()
+
+    start = time.monotonic()
+
+    virtool.jobs.job.watch_pipes(process, {process.stdout: lines.append})
+
+    assert time.monotonic() - start < 5
+    assert lines == [b"done\n"]
+
+
+def test_watch_pipes_orphan_remainder(monkeypatch):
+    """
+    Test that a final line without a trailing newline is handled when :func:`watch_pipes` returns because the process
+    exited while its pipe is held open by an orphaned child process.
+
+    """
+    monkeypatch.setattr(virtool.jobs.job, "PIPE_POLL_INTERVAL", 0.1)
+
+    process = subprocess.Popen(
+        python_command(
+            "import subprocess, sys\n"
+            "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3)'])\n"
+            "sys.stdout.write('done\\ntail-without-newline')\n"
+            "sys.stdout.flush()\n"
+        ),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+
+    lines = list()
+
+    start = time.monotonic()
+
+    virtool.jobs.job.watch_pipes(process, {process.stdout: lines.append})
+
+    assert time.monotonic() - start < 3
+    assert lines == [b"done\n", b"tail-without-newline"]
+
+
+def test_run_subprocess(job):
+    stdout = list()
+    stderr = list()
+
+    job.run_subprocess(
+        python_command("import sys; print('foo'); print('bar'); print('baz', file=sys.stderr)"),
+        stdout_handler=stdout.append,
+        stderr_handler=stderr.append
+    )
+
+    assert stdout == [b"foo\n", b"bar\n"]
+    assert stderr == [b"baz\n"]
+
+    assert job._process is None
+
+
+def test_run_subprocess_error(job):
+    with pytest.raises(virtool.jobs.job.SubprocessError):
+        job.run_subprocess(python_command("import sys; sys.exit(1)"))
+
+
+def test_run_subprocess_termination(job):
+    """
+    Test that a ``SIGTERM`` received while waiting on a subprocess raises :class:`TerminationError` and leaves the
+    subprocess available to be killed.
+
+    """
+    previous = signal.signal(signal.SIGTERM, virtool.jobs.job.handle_sigterm)
+
+    try:
+        with pytest.raises(virtool.jobs.job.TerminationError):
+            job.run_subprocess(python_command(
+                f"import os, signal, time; os.kill({os.getpid()}, signal.SIGTERM); time.sleep(30)"
+            ))
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    assert job._process.poll() is None
+
+    job._process.kill()
+    job._process.wait()
+
+
+def test_run_subprocesses(job, tmpdir):
+    commands = [
+        python_command(f"import sys; open({str(tmpdir.join(str(i)))!r}, 'w').write('{i}'); print({i}, file=sys.stderr)")
+        for i in range(3)
+    ]
+
+    job.run_subprocesses(commands)
+
+    assert sorted(os.listdir(str(tmpdir))) == ["0", "1", "2", "logs"]
+
+
+def test_run_subprocesses_error(job):
+    """
+    Test that :class:`SubprocessError` is raised when any of the commands fails.
+
+    """
+    with pytest.raises(virtool.jobs.job.SubprocessError) as excinfo:
+        job.run_subprocesses([
+            python_command("pass"),
+            python_command("import sys; sys.exit(2)")
+        ])
+
+    assert "sys.exit(2)" in str(excinfo.value)
+
+
+def test_run_subprocesses_termination(job, tmpdir):
+    """
+    Test that all commands are killed when a ``SIGTERM`` is received while waiting on them.
+
+    """
+    previous = signal.signal(signal.SIGTERM, virtool.jobs.job.handle_sigterm)
+
+    pids_path = str(tmpdir.join("pids"))
+
+    try:
+        with pytest.raises(virtool.jobs.job.TerminationError):
+            job.run_subprocesses([
+                python_command(f"import os, time; open({pids_path!r}, 'a').write(f'{{os.getpid()}}\\n'); time.sleep(30)"),
+                python_command(f"import os, signal, time; time.sleep(0.5); os.kill({os.getpid()}, signal.SIGTERM); time.sleep(30)")
+            ])
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    with open(pids_path, "r") as f:
+        pid = int(f.read())
+
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+def read_all(handle):
+    return handle.read()
+
+
+def test_run_subprocess_filter(job):
+    """
+    Test that STDOUT is passed to a ``stdout_filter`` running in a separate process and that its return value is
+    returned. STDERR should still be logged.
+
+    """
+    stderr = list()
+
+    result = job.run_subprocess(
+        python_command("import os, sys; print('foo'); print('bar'); print(os.getpid(), file=sys.stderr)"),
+        stderr_handler=stderr.append,
+        stdout_filter=read_all
+    )
+
+    assert result == b"foo\nbar\n"
+    assert len(stderr) == 1
+
+    assert job._process is None
+
+
+def raise_error(handle):
+    raise ValueError("Bad output")
+
+
+def test_run_subprocess_filter_error(job):
+    with pytest.raises(ValueError) as excinfo:
+        job.run_subprocess(python_command("print('foo')"), stdout_filter=raise_error)
+
+    assert "Bad output" in str(excinfo.value)
+
+
+def test_run_subprocess_filter_and_handler(job):
+    with pytest.raises(ValueError):
+        job.run_subprocess(python_command("print('foo')"), stdout_handler=print, stdout_filter=read_all)
+
+
+class CheckpointedJob(virtool.jobs.job.Job):
+
+    checkpoints = {
+        "write_file": ["{path}/file.txt"],
+        "count": []
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._stage_list = [
+            self.write_file,
+            self.prepare,
+            self.count,
+            self.finish
+        ]
+
+        self.calls = list()
+
+    def init_db(self):
+        pass
+
+    def check_db(self):
+        self.params = {
+            "path": self.settings["data_path"]
+        }
+
+    def write_file(self):
+        self.calls.append("write_file")
+
+        self.params["file_path"] = os.path.join(self.params["path"], "file.txt")
+
+        with open(self.params["file_path"], "w") as f:
+            f.write("foo")
+
+        self.intermediate["count"] = 1
+
+    def prepare(self):
+        self.calls.append("prepare")
+        self.intermediate["prepared"] = True
+
+    def count(self):
+        self.calls.append("count")
+        self.intermediate["count"] += 1
+
+    def finish(self):
+        self.calls.append("finish")
+
+        if self.settings.get("interrupt"):
+            raise virtool.jobs.job.InterruptionError
+
+
+def run_checkpointed_job(monkeypatch, tmpdir, interrupt=False):
+    monkeypatch.setattr("signal.set_wakeup_fd", lambda fd: None)
+    monkeypatch.setattr("signal.signal", lambda signum, handler: None)
+
+    job = CheckpointedJob(None, None, {"data_path": str(tmpdir), "interrupt": interrupt}, "foobar", None)
+
+    states = list()
+
+    monkeypatch.setattr(job, "add_status", lambda state=None, stage=None: states.append(state))
+
+    job.run()
+
+    return job, states
+
+
+@pytest.mark.parametrize("modified", [False, True])
+def test_resume(modified, monkeypatch, tmpdir):
+    """
+    Test that an interrupted job is put back into the waiting state and that completed stages with unchanged
+    artifacts are skipped when it is run again. Completed stages that are not declared as checkpoints are run again.
+
+    """
+    tmpdir.mkdir("logs").mkdir("jobs")
+
+    checkpoint_path = os.path.join(str(tmpdir), "jobs", "foobar.checkpoint")
+
+    job, states = run_checkpointed_job(monkeypatch, tmpdir, interrupt=True)
+
+    assert job.calls == ["write_file", "prepare", "count", "finish"]
+    assert states[-1] == "waiting"
+    assert os.path.isfile(checkpoint_path)
+
+    if modified:
+        with open(os.path.join(str(tmpdir), "file.txt"), "a") as f:
+            f.write("bar")
+
+    job, states = run_checkpointed_job(monkeypatch, tmpdir)
+
+    if modified:
+        assert job.calls == ["write_file", "prepare", "count", "finish"]
+    else:
+        assert job.calls == ["prepare", "finish"]
+
+    assert job.params["file_path"] == os.path.join(str(tmpdir), "file.txt")
+    assert job.intermediate == {"count": 2, "prepared": True}
+
+    assert states[-1] == "complete"
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_fingerprints(tmpdir):
+    file_path = os.path.join(str(tmpdir), "foo.txt")
+
+    with open(file_path, "w") as f:
+        f.write("foo")
+
+    fingerprints = virtool.jobs.job.get_fingerprints([str(tmpdir), file_path])
+
+    assert virtool.jobs.job.check_fingerprints(fingerprints) is True
+
+    os.remove(file_path)
+
+    assert virtool.jobs.job.check_fingerprints(fingerprints) is False
@@ -0,0 +1,158 @@
+import pytest
+
+import virtool.jobs.manager
+
+SETTINGS = {
+    "proc": 8,
+    "mem": 16
+}
+
+
+def make_job(order, task_name="create_sample", proc=2, mem=4, user_id="bob", running=False, enqueued_at=0):
+    return {
+        "process": True if running else None,
+        "task_name": task_name,
+        "proc": proc,
+        "mem": mem,
+        "user_id": user_id,
+        "priority": virtool.jobs.manager.TASK_PRIORITIES[task_name],
+        "enqueued_at": enqueued_at,
+        "order": order
+    }
+
+
+def test_multiple():
+    """
+    Test that every job that fits is started in a single pass.
+
+    """
+    jobs = {f"job_{i}": make_job(i) for i in range(5)}
+
+    assert virtool.jobs.manager.schedule(SETTINGS, jobs, 10) == ["job_0", "job_1", "job_2", "job_3"]
+
+
+def test_backfill():
+    """
+    Test that a small job is started around a large job that was enqueued first but does not fit.
+
+    """
+    jobs = {
+        "running": make_job(0, "nuvs", proc=6, mem=8, running=True),
+        "large": make_job(1, "pathoscope_bowtie", proc=8, mem=16),
+        "small": make_job(2, "create_sample")
+    }
+
+    assert virtool.jobs.manager.schedule(SETTINGS, jobs, 10) == ["small"]
+
+
+def test_priority():
+    jobs = {
+        "running": make_job(0, "nuvs", proc=6, mem=8, running=True),
+        "analysis": make_job(1, "pathoscope_bowtie", proc=2, mem=4),
+        "sample": make_job(2, "create_sample", proc=2, mem=4)
+    }
+
+    assert virtool.jobs.manager.schedule(SETTINGS, jobs, 10) == ["sample"]
+
+
+def test_fair_share():
+    """
+    Test that the jobs of users using a smaller share of resources are started first and that shares are updated as
+    jobs are chosen.
+
+    """
+    jobs = {
+        "running": make_job(0, user_id="bob", running=True),
+        "bob_1": make_job(1, user_id="bob"),
+        "bob_2": make_job(2, user_id="bob"),
+        "fred_1": make_job(3, user_id="fred"),
+        "fred_2": make_job(4, user_id="fred")
+    }
+
+    assert virtool.jobs.manager.schedule(SETTINGS, jobs, 10) == ["fred_1", "bob_1", "fred_2"]
+
+
+@pytest.mark.parametrize("now,expected", [(10, ["small"]), (virtool.jobs.manager.RESERVE_AFTER, [])])
+def test_reservation(now, expected):
+    """
+    Test that a large job that has waited for :data:`RESERVE_AFTER` seconds reserves the free resources it needs so
+    that smaller jobs are not backfilled into them.
+
+    """
+    jobs = {
+        "running": make_job(0, "nuvs", proc=6, mem=8, running=True),
+        "large": make_job(1, "create_sample", proc=4, mem=4),
+        "small": make_job(2, "create_sample")
+    }
+
+    assert virtool.jobs.manager.schedule(SETTINGS, jobs, now) == expected
+
+
+def test_too_large():
+    """
+    Test that a job that needs more resources than the host has is never started and does not reserve resources.
+
+    """
+    jobs = {
+        "huge": make_job(0, "nuvs", proc=16, mem=8),
+        "small": make_job(1, "create_sample")
+    }
+
+    assert virtool.jobs.manager.schedule(SETTINGS, jobs, 600) == ["small"]
+
+
+def test_coalesce():
+    messages = [
+        ("jobs", "update", ["foo"], 1),
+        ("samples", "update", ["bar", "baz"], 2),
+        ("jobs", "update", ["foo", "bar"], 3),
+        ("samples", "delete", ["baz"], 4),
+        ("samples", "update", ["baz"], 5),
+        ("jobs", "update", ["foo"], 6)
+    ]
+
+    groups = virtool.jobs.manager.coalesce(messages)
+
+    assert list(groups.items()) == [
+        (("jobs", "update"), ["foo", "bar"]),
+        (("samples", "update"), ["bar", "baz"]),
+        (("samples", "delete"), ["baz"])
+    ]
+
+    assert virtool.jobs.manager.get_queried_ids(groups) == {
+        "jobs": ["foo", "bar"],
+        "samples": ["bar", "baz"]
+    }
+
+
+@pytest.mark.parametrize("runner", [None, "runner_1"])
+async def test_external_cancel(runner, mocker, dbi, test_job):
+    """
+    Test that a waiting job is given a placeholder lease and cancelled immediately and that a job claimed by a runner
+    is flagged for cancellation by the runner.
+
+    """
+    await dbi.jobs.insert_one(test_job)
+
+    if runner:
+        await dbi.job_leases.insert_one({"_id": test_job["_id"], "runner": runner, "cancel": False})
+
+    manager = virtool.jobs.manager.ExternalManager({
+        "db": dbi,
+        "dispatcher": mocker.Mock(),
+        "settings": SETTINGS
+    })
+
+    await manager.cancel(test_job["_id"])
+
+    lease = await dbi.job_leases.find_one(test_job["_id"])
+
+    assert lease["cancel"] is True
+    assert lease["runner"] == runner
+
+    status = (await dbi.jobs.find_one(test_job["_id"]))["status"]
+
+    if runner:
+        assert status == test_job["status"]
+    else:
+        assert status[-1]["state"] == "cancelled"
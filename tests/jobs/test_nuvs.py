@@ -217,7 +217,7 @@ def test_process_fasta(mock_job):
     )
 
 
-def test_press_hmm(mock_job):
+def test_press_hmm(mocker, mock_job):
     os.mkdir(mock_job.params["analysis_path"])
 
     hmm_path = os.path.join(mock_job.settings["data_path"], "hmm")
@@ -231,10 +231,20 @@ def test_press_hmm(mock_job):
 
     mock_job.prepare_hmm()
 
-    listing = os.listdir(mock_job.params["analysis_path"])
+    listing = os.listdir(hmm_path)
 
-    # Check that all the pressed file were written to the analysis directory.
+    # Check that all the pressed files were written to the shared HMM directory.
     assert all("profiles.hmm." + suffix in listing for suffix in ["h3p", "h3m", "h3f", "h3i"])
+    assert "profiles.stamp" in listing
+
+    assert not os.listdir(mock_job.params["analysis_path"])
+
+    # The profiles should not be pressed again while they are unchanged.
+    mock_job.run_subprocess = mocker.Mock()
+
+    mock_job.prepare_hmm()
+
+    assert mock_job.run_subprocess.called is False
 
 
 def test_vfam(mock_job, dbs):
@@ -268,10 +278,14 @@ def test_vfam(mock_job, dbs):
             "NGIPCIILVNEDEDWLQQMQPSQADWFNANAVVHYMYSGESFFEAL"
         )
 
+    hmm_path = os.path.join(mock_job.settings["data_path"], "hmm")
+
+    os.mkdir(hmm_path)
+
     for suffix in ["h3p", "h3m", "h3f", "h3i"]:
         shutil.copyfile(
             os.path.join(NUVS_PATH, "test.hmm." + suffix),
-            os.path.join(mock_job.params["analysis_path"], "profiles.hmm." + suffix)
+            os.path.join(hmm_path, "profiles.hmm." + suffix)
         )
 
     mock_job.results = [
@@ -331,6 +345,35 @@ def test_vfam(mock_job, dbs):
     ]
 
 
+def test_get_annotation_ids(dbs):
+    dbs.hmm.insert_many([
+        {
+            "_id": "foo",
+            "cluster": 2
+        },
+        {
+            "_id": "bar",
+            "cluster": 9
+        },
+        {
+            "_id": "baz",
+            "cluster": 12
+        }
+    ])
+
+    assert virtool.jobs.nuvs.get_annotation_ids(dbs, {2, 9}) == {
+        2: "foo",
+        9: "bar"
+    }
+
+    assert virtool.jobs.nuvs.get_annotation_ids(dbs, set()) == dict()
+
+    with pytest.raises(ValueError) as excinfo:
+        virtool.jobs.nuvs.get_annotation_ids(dbs, {2, 5})
+
+    assert "[5]" in str(excinfo.value)
+
+
 def test_import_results(mock_job, dbs):
     """
     Test that the stage method saves the result list to the analysis database document and updated the algorithm tags on
@@ -449,3 +492,79 @@ def test_import_results(mock_job, dbs):
             }
         ]
     }
+
+
+@pytest.mark.parametrize("orf_count,proc,expected", [
+    (0, 8, 1),
+    (49, 8, 1),
+    (120, 8, 2),
+    (10000, 8, 8),
+    (10000, 1, 1)
+])
+def test_get_shard_count(orf_count, proc, expected):
+    assert virtool.jobs.nuvs.get_shard_count(orf_count, proc) == expected
+
+
+def test_shard_fasta():
+    records = [(f"sequence_{i}.0", "M" * length) for i, length in enumerate([100, 400, 300, 200, 100, 100])]
+
+    shards = virtool.jobs.nuvs.shard_fasta(records, 2)
+
+    # The shards should have equal total lengths and keep the original record order.
+    assert [sum(len(sequence) for _, sequence in shard) for shard in shards] == [600, 600]
+    assert all(shard == sorted(shard, key=records.index) for shard in shards)
+    assert sorted(record for shard in shards for record in shard) == sorted(records)
+
+
+@pytest.mark.parametrize("first_empty", [False, True])
+def test_merge_tblout(first_empty, tmpdir):
+    """
+    Test that hits are merged in query order and that the column header and summary comments from the first file
+    surround the hits, even if the first file has no hits.
+
+    """
+    head = "# target name  accession  query name\n#-----\n"
+    tail = "#\n# Program:         hmmscan\n# [ok]\n"
+
+    def write(name, rows):
+        path = str(tmpdir.join(name))
+
+        with open(path, "w") as f:
+            f.write(head + "".join(f"vFam_{cluster} - {query} - 1e-10\n" for cluster, query in rows) + tail)
+
+        return path
+
+    paths = [
+        write("orfs_0.fa.tsv", [(9, "sequence_0.0"), (2, "sequence_0.0"), (4, "sequence_2.1")]),
+        write("orfs_1.fa.tsv", [(7, "sequence_0.1"), (1, "sequence_3.0")]),
+        write("orfs_2.fa.tsv", [])
+    ]
+
+    if first_empty:
+        paths = paths[2:] + paths[:2]
+
+    output_path = str(tmpdir.join("hmm.tsv"))
+
+    query_names = ["sequence_0.0", "sequence_0.1", "sequence_1.0", "sequence_2.1", "sequence_3.0"]
+
+    virtool.jobs.nuvs.merge_tblout(paths, query_names, output_path)
+
+    with open(output_path, "r") as f:
+        assert f.read() == head + (
+            "vFam_9 - sequence_0.0 - 1e-10\n"
+            "vFam_2 - sequence_0.0 - 1e-10\n"
+            "vFam_7 - sequence_0.1 - 1e-10\n"
+            "vFam_4 - sequence_2.1 - 1e-10\n"
+            "vFam_1 - sequence_3.0 - 1e-10\n"
+        ) + tail
+
+
+@pytest.mark.parametrize("proc", [1, 4])
+def test_find_all_orfs(proc):
+    """
+    Test that ORFs are found for each sequence in order whether or not worker processes are used.
+
+    """
+    sequences = [sequence for _, sequence in virtool.bio.read_fasta(os.path.join(NUVS_PATH, "scaffolds_p.fa"))]
+
+    assert virtool.jobs.nuvs.find_all_orfs(sequences, proc) == [virtool.bio.find_orfs(s) for s in sequences]
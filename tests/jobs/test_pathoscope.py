@@ -5,6 +5,8 @@ import shutil
 import pytest
 
 import virtool.jobs.pathoscope
+import virtool.pathoscope
+import virtool.vta
 
 TEST_FILES_PATH = os.path.join(sys.path[0], "tests", "test_files")
 PATHOSCOPE_PATH = os.path.join(TEST_FILES_PATH, "pathoscope")
@@ -148,6 +150,58 @@ def test_check_db(tmpdir, paired, dbs, mock_job):
     )
 
 
+@pytest.mark.parametrize("prebuilt", [False, True])
+def test_check_db_isolate_index(prebuilt, tmpdir, dbs, mock_job):
+    """
+    Test that the prebuilt all-isolates index is used and the per-sample index stages are replaced when the index
+    document and files for it exist.
+
+    """
+    dbs.samples.insert_one({
+        "_id": "foobar",
+        "paired": False,
+        "subtraction": {
+            "id": "Arabidopsis thaliana"
+        },
+        "quality": {
+            "count": 1337
+        }
+    })
+
+    index_path = os.path.join(str(tmpdir), "references", "original", "index3")
+
+    if prebuilt:
+        dbs.indexes.update_one({"_id": "index3"}, {
+            "$set": {
+                "isolate_index": {
+                    "sequence_count": 2,
+                    "size": 1024
+                }
+            }
+        })
+
+        with open(os.path.join(index_path, "isolate_lengths.json"), "w") as f:
+            json.dump({"foo": 12, "bar": 14}, f)
+
+    mock_job.check_db()
+
+    stage_names = [stage.__name__ for stage in mock_job._stage_list]
+
+    if prebuilt:
+        assert mock_job.params["isolate_index_path"] == os.path.join(index_path, "isolates")
+
+        assert "map_default_isolates" not in stage_names
+        assert "build_isolate_index" not in stage_names
+        assert stage_names.index("load_isolate_index") == stage_names.index("map_isolates") - 1
+
+        mock_job.load_isolate_index()
+
+        assert mock_job.intermediate["ref_lengths"] == {"foo": 12, "bar": 14}
+    else:
+        assert mock_job.params["isolate_index_path"] == os.path.join(mock_job.params["analysis_path"], "isolates")
+        assert "load_isolate_index" not in stage_names
+
+
 def test_make_analysis_dir(dbs, mock_job):
     dbs.samples.insert_one({
         "_id": "foobar",
@@ -247,8 +301,7 @@ def test_map_isolates(tmpdir, dbs, mock_job):
 
     vta_path = os.path.join(mock_job.params["analysis_path"], "to_isolates.vta")
 
-    with open(vta_path, "r") as f:
-        observed = sorted([line.rstrip() for line in f])
+    observed = sorted([line.rstrip() for line in virtool.vta.iter_lines(vta_path)])
 
     with open(ISOLATES_VTA_PATH, "r") as f:
         expected = sorted([line.rstrip() for line in f])
@@ -283,30 +336,126 @@ def test_map_subtraction(dbs, mock_job):
         assert sorted(mock_job.intermediate["to_subtraction"]) == sorted(json.load(handle))
 
 
-def test_subtract_mapping(dbs, mock_job):
-    dbs.samples.insert_one({
-        "_id": "foobar",
-        "paired": False,
-        "subtraction": {
-            "id": "Arabidopsis thaliana"
-        },
-        "quality": {
-            "count": 1337
-        }
-    })
+@pytest.mark.parametrize("collapse", [False, True])
+@pytest.mark.parametrize("em_engine", ["python", "numpy", "squarem"])
+def test_run_patho(em_engine, collapse, tmpdir):
+    """
+    Test that host subtraction is applied while the alignments are ingested and that the reassigned alignments and
+    their coverage are consistent.
 
-    mock_job.check_db()
+    """
+    vta_path = os.path.join(str(tmpdir), "to_isolates.vta")
+    reassigned_path = os.path.join(str(tmpdir), "reassigned.vta")
 
-    os.makedirs(mock_job.params["analysis_path"])
+    shutil.copyfile(VTA_PATH, vta_path)
 
     with open(TO_SUBTRACTION_PATH, "r") as handle:
-        mock_job.intermediate["to_subtraction"] = json.load(handle)
+        host_scores = json.load(handle)
 
-    shutil.copyfile(VTA_PATH, os.path.join(mock_job.params["analysis_path"], "to_isolates.vta"))
+    with open(REF_LENGTHS_PATH, "r") as handle:
+        ref_lengths = json.load(handle)
+
+    result = virtool.jobs.pathoscope.run_patho(
+        vta_path,
+        reassigned_path,
+        host_scores,
+        ref_lengths,
+        em_engine,
+        collapse
+    )
 
-    mock_job.subtract_mapping()
+    refs, read_count, subtracted_count, coverage, em_stats = result[10:]
 
-    assert mock_job.results["subtracted_count"] == 4
+    assert subtracted_count == 4
+
+    assert em_stats["engine"] == em_engine
+    assert 0 < em_stats["iterations"] <= 50
+    assert em_stats["time"] >= 0
+
+    expected = virtool.pathoscope.calculate_coverage(reassigned_path, ref_lengths)
+
+    assert {ref_id: depths.tolist() for ref_id, depths in coverage.items()} == {
+        ref_id: depths.tolist() for ref_id, depths in expected.items()
+    }
+
+
+
+def test_run_patho_subtracted_ref(tmpdir):
+    """
+    Test that a reference whose alignments are all removed by host subtraction is not counted as a mapped genome or
+    included in the report.
+
+    """
+    vta_path = os.path.join(str(tmpdir), "to_isolates.vta")
+    reassigned_path = os.path.join(str(tmpdir), "reassigned.vta")
+    report_path = os.path.join(str(tmpdir), "report.tsv")
+
+    shutil.copyfile(VTA_PATH, vta_path)
+
+    with open(TO_SUBTRACTION_PATH, "r") as handle:
+        host_scores = json.load(handle)
+
+    with open(REF_LENGTHS_PATH, "r") as handle:
+        ref_lengths = json.load(handle)
+
+    kept_refs = list()
+
+    with open(VTA_PATH, "r") as handle:
+        lines = [line.rstrip().split(",") for line in handle]
+
+    # Make every read that aligns to NC_003615 align better to the host.
+    for read_id, ref_id, _, _, _ in lines:
+        if ref_id == "NC_003615":
+            host_scores[read_id] = 1000
+
+    for read_id, ref_id, _, _, score in lines:
+        if float(score) > host_scores.get(read_id, 0) and ref_id not in kept_refs:
+            kept_refs.append(ref_id)
+
+    (
+        best_hit_initial_reads,
+        best_hit_initial,
+        level_1_initial,
+        level_2_initial,
+        best_hit_final_reads,
+        best_hit_final,
+        level_1_final,
+        level_2_final,
+        init_pi,
+        pi,
+        refs,
+        read_count,
+        _,
+        _,
+        _
+    ) = virtool.jobs.pathoscope.run_patho(vta_path, reassigned_path, host_scores, ref_lengths)
+
+    assert "NC_003615" not in refs
+    assert refs == kept_refs
+
+    virtool.pathoscope.write_report(
+        report_path,
+        pi,
+        refs,
+        read_count,
+        init_pi,
+        best_hit_initial,
+        best_hit_initial_reads,
+        best_hit_final,
+        best_hit_final_reads,
+        level_1_initial,
+        level_2_initial,
+        level_1_final,
+        level_2_final
+    )
+
+    with open(report_path, "r") as handle:
+        rows = [line.rstrip("\n").split("\t") for line in handle]
+
+    assert rows[0][2:] == ["Total Number of Mapped Genomes:", str(len(kept_refs))]
+
+    assert "NC_003615" not in [row[0] for row in rows[2:]]
+    assert {row[0] for row in rows[2:]} <= set(kept_refs)
 
 
 def test_pathoscope(dbs, mock_job):
@@ -328,6 +477,8 @@ def test_pathoscope(dbs, mock_job):
     with open(REF_LENGTHS_PATH, "r") as handle:
         mock_job.intermediate["ref_lengths"] = json.load(handle)
 
+    mock_job.intermediate["to_subtraction"] = dict()
+
     shutil.copyfile(
         VTA_PATH,
         os.path.join(mock_job.params["analysis_path"], "to_isolates.vta")
@@ -367,8 +518,9 @@ def test_pathoscope(dbs, mock_job):
     with open(UPDATED_VTA_PATH, "r") as f:
         updated_vta = sorted([line.rstrip() for line in f])
 
-    with open(os.path.join(mock_job.params["analysis_path"], "reassigned.vta"), "r") as f:
-        assert updated_vta == sorted([line.rstrip() for line in f])
+    reassigned_path = os.path.join(mock_job.params["analysis_path"], "reassigned.vta")
+
+    assert updated_vta == sorted([line.rstrip() for line in virtool.vta.iter_lines(reassigned_path)])
 
     # Check that the correct report.tsv file is written.
     with open(TSV_PATH, "r") as f:
@@ -382,6 +534,8 @@ def test_pathoscope(dbs, mock_job):
         results = mock_job.results
 
         assert results["read_count"] == 20276
+        assert results["subtracted_count"] == 0
+        assert results["em"]["engine"] == "python"
         assert results["ready"] is True
 
         assert expected == sorted(results["results"], key=lambda h: h["id"])
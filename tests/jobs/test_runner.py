@@ -0,0 +1,115 @@
+import datetime
+
+import pytest
+
+import virtool.jobs.runner
+import virtool.utils
+
+
+def make_status(*states):
+    return [{
+        "state": state,
+        "stage": None,
+        "error": None,
+        "progress": 0,
+        "timestamp": virtool.utils.timestamp()
+    } for state in states]
+
+
+async def test_acquire_lease(test_motor):
+    assert await virtool.jobs.runner.acquire_lease(test_motor, "foo", "runner_1") is True
+    assert await virtool.jobs.runner.acquire_lease(test_motor, "foo", "runner_2") is False
+
+    lease = await test_motor.job_leases.find_one("foo")
+
+    assert lease["runner"] == "runner_1"
+    assert lease["cancel"] is False
+    assert lease["expires_at"] > virtool.utils.timestamp()
+
+
+async def test_renew_leases(test_motor):
+    """
+    Test that leases held by the runner are renewed and that the IDs of cancelled jobs and jobs whose leases are not
+    held by the runner are returned.
+
+    """
+    expires_at = virtool.utils.timestamp()
+
+    await test_motor.job_leases.insert_many([
+        {"_id": "foo", "runner": "runner_1", "expires_at": expires_at, "cancel": False},
+        {"_id": "bar", "runner": "runner_1", "expires_at": expires_at, "cancel": True},
+        {"_id": "baz", "runner": "runner_2", "expires_at": expires_at, "cancel": False}
+    ])
+
+    result = await virtool.jobs.runner.renew_leases(test_motor, "runner_1", ["foo", "bar", "baz", "missing"])
+
+    assert result == ["bar", "baz", "missing"]
+
+    assert (await test_motor.job_leases.find_one("foo"))["expires_at"] > expires_at
+    assert (await test_motor.job_leases.find_one("baz"))["expires_at"] == expires_at
+
+
+async def test_expire_leases(test_motor):
+    """
+    Test that expired leases are removed and that only jobs that were running under an expired lease are marked as
+    failed.
+
+    """
+    past = virtool.utils.timestamp() - datetime.timedelta(seconds=5)
+    future = virtool.utils.timestamp() + datetime.timedelta(seconds=60)
+
+    await test_motor.jobs.insert_many([
+        {"_id": "running", "status": make_status("waiting", "running")},
+        {"_id": "waiting", "status": make_status("waiting")},
+        {"_id": "cancelled", "status": make_status("waiting", "cancelled")},
+        {"_id": "current", "status": make_status("waiting", "running")}
+    ])
+
+    await test_motor.job_leases.insert_many([
+        {"_id": "running", "runner": "runner_1", "host": "foo", "expires_at": past},
+        {"_id": "waiting", "runner": "runner_1", "host": "foo", "expires_at": past},
+        {"_id": "cancelled", "runner": None, "expires_at": past},
+        {"_id": "current", "runner": "runner_2", "host": "bar", "expires_at": future}
+    ])
+
+    assert await virtool.jobs.runner.expire_leases(test_motor) == ["running"]
+
+    assert await test_motor.job_leases.distinct("_id") == ["current"]
+
+    status = (await test_motor.jobs.find_one("running"))["status"]
+
+    assert status[-1]["state"] == "error"
+    assert status[-1]["error"]["type"] == "LeaseExpired"
+
+    assert len((await test_motor.jobs.find_one("waiting"))["status"]) == 1
+    assert (await test_motor.jobs.find_one("current"))["status"][-1]["state"] == "running"
+
+
+async def test_find_waiting_jobs(test_motor):
+    """
+    Test that unclaimed jobs whose latest state is waiting are found, including jobs that were interrupted and put
+    back into the waiting state.
+
+    """
+    await test_motor.jobs.insert_many([
+        {"_id": "foo", "status": make_status("waiting")},
+        {"_id": "bar", "status": make_status("waiting", "running")},
+        {"_id": "baz", "status": make_status("waiting", "cancelled")},
+        {"_id": "interrupted", "status": make_status("waiting", "running", "waiting")},
+        {"_id": "leased", "status": make_status("waiting")}
+    ])
+
+    await test_motor.job_leases.insert_one({"_id": "leased", "runner": "runner_1"})
+
+    documents = await virtool.jobs.runner.find_waiting_jobs(test_motor)
+
+    assert sorted(d["_id"] for d in documents) == ["foo", "interrupted"]
+
+
+@pytest.mark.parametrize("messages", [[], [("jobs", "update", ["foo"], 1.5), ("samples", "delete", ["bar"], 2.5)]])
+async def test_send_messages(messages, test_motor):
+    await virtool.jobs.runner.send_messages(test_motor, messages)
+
+    documents = await test_motor.job_messages.find({}, {"_id": False}).sort("_id").to_list(None)
+
+    assert [(d["interface"], d["operation"], d["id_list"], d["sent_at"]) for d in documents] == messages
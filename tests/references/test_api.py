@@ -234,6 +234,7 @@ async def test_create(mocker, spawn_client, test_random_alphanumeric, static_tim
         groups=[],
         contributors=[],
         internal_control=None,
+        build_isolate_index=False,
         restrict_source_types=False,
         otu_count=22,
         unbuilt_change_count=5,
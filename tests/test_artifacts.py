@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import virtool.artifacts
+
+
+@pytest.fixture
+def store(tmpdir):
+    return virtool.artifacts.ArtifactStore(str(tmpdir.join("store")), 100)
+
+
+def make_build(size, calls=None):
+    def build(path):
+        if calls is not None:
+            calls.append(path)
+
+        with open(os.path.join(path, "index"), "wb") as f:
+            f.write(b"a" * size)
+
+    return build
+
+
+def test_acquire(store):
+    """
+    Test that an entry is built the first time it is acquired and reused after that.
+
+    """
+    calls = list()
+
+    path = store.acquire("foo", make_build(10, calls))
+
+    assert path == store.entry_path("foo")
+    assert os.listdir(path) == ["index"]
+
+    assert store.acquire("foo", make_build(10, calls)) == path
+
+    assert len(calls) == 1
+
+    with open(os.path.join(store.path, "state.json"), "r") as f:
+        assert len(f.read())
+
+    assert os.listdir(os.path.join(store.path, "tmp")) == []
+
+
+def test_acquire_error(store):
+    """
+    Test that a failed build leaves nothing behind and that the entry can be built again.
+
+    """
+    def build(path):
+        with open(os.path.join(path, "index"), "w") as f:
+            f.write("partial")
+
+        raise ValueError("Build failed")
+
+    with pytest.raises(ValueError):
+        store.acquire("foo", build)
+
+    assert not os.path.exists(store.entry_path("foo"))
+    assert os.listdir(os.path.join(store.path, "tmp")) == []
+
+    store.acquire("foo", make_build(10))
+
+    assert os.path.isdir(store.entry_path("foo"))
+
+
+def test_evict(store):
+    """
+    Test that unused entries are evicted in least-recently-used order when the store is over quota and that entries in
+    use are never evicted.
+
+    """
+    store.acquire("a", make_build(40))
+    store.acquire("b", make_build(40))
+
+    store.release("a")
+    store.release("b")
+
+    # Use "a" more recently than "b".
+    store.acquire("a", make_build(40))
+    store.release("a")
+
+    # The store is now over quota. Only "b" should be evicted.
+    store.acquire("c", make_build(40))
+
+    assert not os.path.exists(store.entry_path("b"))
+    assert os.path.exists(store.entry_path("a"))
+    assert os.path.exists(store.entry_path("c"))
+
+    # Entries that are in use are kept even when the store is over quota.
+    store.acquire("d", make_build(200))
+
+    assert os.path.exists(store.entry_path("c"))
+    assert os.path.exists(store.entry_path("d"))
+    assert not os.path.exists(store.entry_path("a"))
+
+    store.release("d")
+
+    assert not os.path.exists(store.entry_path("d"))
+
+
+def test_dead_holder(store):
+    """
+    Test that entries held by processes that no longer exist can be evicted.
+
+    """
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    holder = f"{virtool.artifacts.get_holder().rsplit(':', 1)[0]}:{process.pid}"
+
+    assert not virtool.artifacts.is_holder_alive(holder)
+    assert virtool.artifacts.is_holder_alive(virtool.artifacts.get_holder())
+    assert virtool.artifacts.is_holder_alive(f"another-host:{process.pid}")
+
+    store.acquire("foo", make_build(200))
+
+    with store._state() as state:
+        state["foo"]["holders"] = [holder]
+
+    store.release("bar")
+
+    assert not os.path.exists(store.entry_path("foo"))
+
+
+def acquire_in_process(path, key, results):
+    store = virtool.artifacts.ArtifactStore(path, 1000)
+
+    def build(build_path):
+        results.put("built")
+        time.sleep(0.2)
+        make_build(10)(build_path)
+
+    store.acquire(key, build)
+    results.put(os.listdir(store.entry_path(key)))
+    store.release(key)
+
+
+def test_concurrent(tmpdir):
+    """
+    Test that an entry acquired by several processes at once is only built once.
+
+    """
+    path = str(tmpdir.join("store"))
+
+    results = multiprocessing.Queue()
+
+    processes = [
+        multiprocessing.Process(target=acquire_in_process, args=(path, "foo", results)) for _ in range(4)
+    ]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+    observed = [results.get() for _ in range(5)]
+
+    assert observed.count("built") == 1
+    assert observed.count(["index"]) == 4
+
+
+def test_hash_file(tmpdir):
+    path = str(tmpdir.join("isolate_index.fa"))
+
+    with open(path, "w") as f:
+        f.write(">foo\nACGT\n")
+
+    assert virtool.artifacts.hash_file(path) == "5c4bd0187aa5c6b9ebf7e807772b0a90c547f9a89654f1a02ecc8328349b5c95"
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sys
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import virtool.blast
+
+TEST_BIO_PATH = os.path.join(sys.path[0], "tests", "test_files", "bio")
+
+#: The RID of the result in ``blast.zip``.
+RID = "YA6M9135015"
+
+
+@pytest.fixture
+def fake_blast_server(monkeypatch, loop, aiohttp_server):
+    """
+    A fake NCBI BLAST server that reports every search as waiting for the first ``waiting`` checks. Requests are
+    counted in ``server.counts``.
+
+    """
+    counts = {
+        "put": 0,
+        "check": 0,
+        "get": 0
+    }
+
+    async def get_handler(req):
+        if req.query.get("FORMAT_OBJECT") == "SearchInfo":
+            counts["check"] += 1
+
+            with open(os.path.join(TEST_BIO_PATH, "check_rid.html"), "r") as f:
+                html = f.read()
+
+            if counts["check"] <= req.app["waiting"]:
+                html = html.replace("Status=READY", "Status=WAITING")
+
+            return web.Response(text=html)
+
+        counts["get"] += 1
+
+        with open(os.path.join(TEST_BIO_PATH, "blast.zip"), "rb") as f:
+            return web.Response(body=f.read())
+
+    async def post_handler(req):
+        counts["put"] += 1
+
+        with open(os.path.join(TEST_BIO_PATH, "initialize_blast.html"), "r") as f:
+            return web.Response(text=f.read().replace("YA40WNN5014", RID))
+
+    app = web.Application()
+
+    app["waiting"] = 2
+
+    app.router.add_get("/blast", get_handler)
+    app.router.add_post("/blast", post_handler)
+
+    server = loop.run_until_complete(aiohttp_server(app))
+
+    server.counts = counts
+
+    monkeypatch.setattr("virtool.bio.BLAST_URL", f"http://{server.host}:{server.port}/blast")
+    monkeypatch.setattr("virtool.blast.INITIAL_INTERVAL", 0.01)
+
+    return server
+
+
+async def insert_analyses(dbi):
+    await dbi.analyses.insert_many([
+        {
+            "_id": analysis_id,
+            "results": [
+                {"index": 2, "sequence": "ATAGAGATTAGAT"},
+                {"index": 5, "sequence": "GGAGTTAGATTGG"}
+            ]
+        } for analysis_id in ["foo", "bar"]
+    ])
+
+
+async def wait_for_searches(service):
+    for _ in range(100):
+        if not service.searches:
+            return
+
+        await asyncio.sleep(0.02)
+
+
+async def test_submit(dbi, fake_blast_server):
+    """
+    Test that identical sequences are only submitted once, that all outstanding searches are polled by the service,
+    and that the result is attached to every sequence waiting on the search.
+
+    """
+    await insert_analyses(dbi)
+
+    session = aiohttp.ClientSession()
+    service = virtool.blast.BLAST(dbi, {"proxy": ""}, session)
+
+    task = asyncio.ensure_future(service.run())
+
+    data = await service.submit("foo", 5, "GGAGTTAGATTGG")
+
+    assert data["rid"] == RID
+    assert data["ready"] is False
+
+    assert (await service.submit("bar", 2, "ggagttagattgg"))["rid"] == RID
+
+    await wait_for_searches(service)
+
+    assert fake_blast_server.counts == {
+        "put": 1,
+        "check": 3,
+        "get": 1
+    }
+
+    for analysis_id, sequence_index in [("foo", 5), ("bar", 2)]:
+        document = await dbi.analyses.find_one(analysis_id)
+
+        blast = [result for result in document["results"] if result["index"] == sequence_index][0]["blast"]
+
+        assert blast["ready"] is True
+        assert blast["result"]["program"] == "blastn"
+
+    # Cached results are returned without contacting NCBI.
+    data = await service.submit("foo", 2, "GGAGTTAGATTGG")
+
+    assert data["ready"] is True
+    assert fake_blast_server.counts["put"] == 1
+
+    task.cancel()
+    await task
+
+    await session.close()
+
+
+async def test_cancel(dbi, fake_blast_server):
+    """
+    Test that the BLAST data is removed from sequences waiting on outstanding searches when the service is cancelled.
+
+    """
+    await insert_analyses(dbi)
+
+    fake_blast_server.app["waiting"] = 1000
+
+    session = aiohttp.ClientSession()
+    service = virtool.blast.BLAST(dbi, {"proxy": ""}, session)
+
+    task = asyncio.ensure_future(service.run())
+
+    await service.submit("foo", 5, "GGAGTTAGATTGG")
+
+    await asyncio.sleep(0.1)
+
+    # Only outstanding searches that are due should be checked and nothing should be written while they are waiting.
+    assert 1 <= fake_blast_server.counts["check"] < 5
+
+    document = await dbi.analyses.find_one("foo")
+    assert document["results"][1]["blast"]["ready"] is False
+
+    task.cancel()
+    await task
+
+    document = await dbi.analyses.find_one("foo")
+    assert document["results"][1]["blast"] is None
+
+    await session.close()
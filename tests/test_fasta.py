@@ -0,0 +1,157 @@
+import gzip
+import os
+
+import pytest
+
+import virtool.fasta
+
+RECORDS = [
+    (b"seq_1 first sequence", b"ACGTACGTAC" * 7),
+    (b"seq_2", b""),
+    (b"seq_3", b"acgtn" * 3),
+    (b"seq_4 last", b"A" * 25)
+]
+
+
+def write_fasta(path, records, width=10, line_ending="\n", compressed=False):
+    lines = list()
+
+    for header, sequence in records:
+        lines.append(b">" + header)
+        lines.extend(sequence[i:i + width] for i in range(0, len(sequence), width))
+
+    with (gzip.open if compressed else open)(path, "wb") as f:
+        f.write(b"".join(line + line_ending.encode() for line in lines))
+
+
+@pytest.mark.parametrize("block_size", [1, 16, 4096])
+@pytest.mark.parametrize("line_ending", ["\n", "\r\n"], ids=["unix", "windows"])
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_read_records(block_size, line_ending, compressed, tmpdir):
+    """
+    Test that records are read correctly regardless of block size, line endings, and compression.
+
+    """
+    path = str(tmpdir.join("test.fa"))
+
+    write_fasta(path, RECORDS, line_ending=line_ending, compressed=compressed)
+
+    assert list(virtool.fasta.read_records(path, block_size)) == RECORDS
+    assert list(virtool.fasta.read_headers(path, block_size)) == [header for header, _ in RECORDS]
+
+
+def test_read_batches(tmpdir):
+    path = str(tmpdir.join("test.fa"))
+
+    write_fasta(path, RECORDS)
+
+    batches = list(virtool.fasta.read_batches(path, 32))
+
+    assert sum(len(batch) for batch in batches) == 4
+    assert [length for batch in batches for length in batch.lengths.tolist()] == [70, 0, 15, 25]
+
+
+def test_find_headers():
+    block = b">a\nACGT\n>b c\n\n>d\nA\n"
+
+    spans = virtool.fasta.find_headers(block)
+
+    assert [block[start:end] for start, end in spans] == [b">a", b">b c", b">d"]
+    assert virtool.fasta.find_headers(b"ACGT\nACGT\n") == []
+
+
+def test_read_chunks(tmpdir):
+    """
+    Test that chunks contain all of the bases and headers in the file without assembling records.
+
+    """
+    path = str(tmpdir.join("test.fa"))
+
+    write_fasta(path, RECORDS)
+
+    chunks = list(virtool.fasta.read_chunks(path, 32))
+
+    assert b"".join(data for _, data, _ in chunks) == b"".join(sequence for _, sequence in RECORDS)
+    assert [header for headers, _, _ in chunks for header in headers] == [header for header, _ in RECORDS]
+
+
+@pytest.mark.parametrize("block_size", [1, 4096])
+def test_illegal_line(block_size, tmpdir):
+    path = tmpdir.join("test.fa")
+
+    path.write("\nATTAGATAC\n>seq_1\nACGT\n")
+
+    with pytest.raises(ValueError) as excinfo:
+        list(virtool.fasta.read_records(str(path), block_size))
+
+    assert "Illegal FASTA line: ATTAGATAC" in str(excinfo.value)
+
+
+def test_build_index(tmpdir):
+    path = str(tmpdir.join("test.fa"))
+
+    write_fasta(path, RECORDS)
+
+    assert virtool.fasta.build_index(path, 16) == [
+        virtool.fasta.IndexEntry("seq_1", 70, 22, 10, 11),
+        virtool.fasta.IndexEntry("seq_2", 0, 106, 0, 0),
+        virtool.fasta.IndexEntry("seq_3", 15, 113, 10, 11),
+        virtool.fasta.IndexEntry("seq_4", 25, 142, 10, 11)
+    ]
+
+
+@pytest.mark.parametrize("content", [
+    ">seq_1\nACGT\nAC\nACGT\n",
+    ">seq_1\nACGT\nACGTA\n",
+    ">seq_1\nACGT\n\nACGT\n",
+    "ACGT\n>seq_1\nACGT\n"
+])
+def test_build_index_invalid(content, tmpdir):
+    path = tmpdir.join("test.fa")
+
+    path.write(content)
+
+    with pytest.raises(ValueError):
+        virtool.fasta.build_index(str(path))
+
+
+def test_build_index_compressed(tmpdir):
+    path = str(tmpdir.join("test.fa"))
+
+    write_fasta(path, RECORDS, compressed=True)
+
+    with pytest.raises(ValueError) as excinfo:
+        virtool.fasta.build_index(path)
+
+    assert "Cannot index a compressed FASTA file" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("line_ending", ["\n", "\r\n"], ids=["unix", "windows"])
+def test_indexed_fasta(line_ending, tmpdir):
+    path = str(tmpdir.join("test.fa"))
+
+    write_fasta(path, RECORDS, line_ending=line_ending)
+
+    with virtool.fasta.IndexedFasta(path) as fasta:
+        assert len(fasta) == 4
+        assert fasta.names == ["seq_1", "seq_2", "seq_3", "seq_4"]
+        assert "seq_3" in fasta
+
+        for header, sequence in RECORDS:
+            name = header.split()[0].decode()
+
+            assert fasta.fetch(name) == sequence
+            assert fasta.fetch(name, 8, 23) == sequence[8:23]
+            assert fasta.fetch(name, 12, 100) == sequence[12:100]
+
+        with pytest.raises(KeyError):
+            fasta.fetch("seq_5")
+
+    assert os.path.isfile(f"{path}.fai")
+
+    # The saved index should be used the next time the file is opened.
+    with open(f"{path}.fai", "r") as f:
+        assert f.readline().split("\t")[0] == "seq_1"
+
+    with virtool.fasta.IndexedFasta(path) as fasta:
+        assert fasta.fetch("seq_1", 0, 5) == b"ACGTA"
@@ -0,0 +1,161 @@
+import gzip
+import io
+import json
+import os
+import sys
+
+import pytest
+
+import virtool.fastq
+
+UNITE_PATH = os.path.join(sys.path[0], "tests", "test_files", "nuvs", "unite.json")
+
+RECORDS = [
+    b"@read_1 1:N:0:AGTCAA\nACGT\n+\nIIII\n",
+    b"@read_2\nACGTAC\n+read_2\nIIIIII\n",
+    b"@read_3 2:N:0:AGTCAA /2\nA\n+\nI\n"
+]
+
+
+@pytest.fixture
+def unite(tmpdir):
+    with open(UNITE_PATH, "r") as f:
+        unite = json.load(f)
+
+    paths = dict()
+
+    for key in ["left", "right", "separate"]:
+        paths[key] = str(tmpdir.join(f"{key}.fq"))
+
+        with open(paths[key], "w") as f:
+            f.write("\n".join(unite[key]) + "\n")
+
+    return unite, paths
+
+
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_read_records(compressed, tmpdir):
+    path = str(tmpdir.join("reads.fq"))
+
+    with (gzip.open if compressed else open)(path, "wb") as f:
+        f.write(b"".join(RECORDS))
+
+    assert list(virtool.fastq.read_records(path)) == [
+        (b"@read_1 1:N:0:AGTCAA", b"ACGT", b"IIII"),
+        (b"@read_2", b"ACGTAC", b"IIIIII"),
+        (b"@read_3 2:N:0:AGTCAA /2", b"A", b"I")
+    ]
+
+    assert list(virtool.fastq.read_headers(path)) == [b"@read_1 1:N:0:AGTCAA", b"@read_2", b"@read_3 2:N:0:AGTCAA /2"]
+
+
+@pytest.mark.parametrize("headers_only", [True, False], ids=["iter_headers", "iter_records"])
+def test_iter_records_text(headers_only):
+    handle = io.StringIO(b"".join(RECORDS).decode().replace("\n", "\r\n"))
+
+    if headers_only:
+        assert list(virtool.fastq.iter_headers(handle))[1] == "@read_2"
+    else:
+        assert list(virtool.fastq.iter_records(handle))[1] == ("@read_2", "ACGTAC", "IIIIII")
+
+
+@pytest.mark.parametrize("record", [b">read_4\nACGT\n+\nIIII\n", b"@read_4\nACGT\nIIII\n+\n"])
+def test_iter_records_invalid(record):
+    with pytest.raises(ValueError) as excinfo:
+        list(virtool.fastq.iter_records(io.BytesIO(b"".join(RECORDS) + record)))
+
+    assert "Invalid FASTQ record" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("line_ending", [b"\n", b"\r\n"], ids=["unix", "windows"])
+def test_batch(line_ending):
+    """
+    Test that the fields of a batch exclude line endings.
+
+    """
+    batch = virtool.fastq.Batch(b"".join(RECORDS).replace(b"\n", line_ending))
+
+    assert len(batch) == 3
+    assert batch.headers() == [b"@read_1 1:N:0:AGTCAA", b"@read_2", b"@read_3 2:N:0:AGTCAA /2"]
+    assert batch.sequences() == [b"ACGT", b"ACGTAC", b"A"]
+    assert batch.qualities() == [b"IIII", b"IIIIII", b"I"]
+    assert batch.lengths.tolist() == [4, 6, 1]
+
+
+def test_read_batches(tmpdir):
+    path = str(tmpdir.join("reads.fq"))
+
+    with open(path, "wb") as f:
+        f.write(b"".join(RECORDS))
+
+    batches = list(virtool.fastq.read_batches(path, 10))
+
+    assert [header for batch in batches for header in batch.headers()] == [
+        b"@read_1 1:N:0:AGTCAA",
+        b"@read_2",
+        b"@read_3 2:N:0:AGTCAA /2"
+    ]
+
+
+@pytest.mark.parametrize("block_size", [1, 10, 1024])
+def test_read_blocks(block_size):
+    """
+    Test that blocks only contain complete records regardless of block size and that a final record without a trailing
+    newline is completed.
+
+    """
+    data = b"".join(RECORDS)
+
+    blocks = list(virtool.fastq.read_blocks(io.BytesIO(data[:-1] + b"\n\n"), block_size))
+
+    assert b"".join(blocks) == data
+    assert all(block.count(b"\n") % 4 == 0 for block in blocks)
+
+
+def test_read_blocks_truncated():
+    with pytest.raises(ValueError) as excinfo:
+        list(virtool.fastq.read_blocks(io.BytesIO(b"".join(RECORDS) + b"@read_4\nACGT\n")))
+
+    assert "Truncated FASTQ record" in str(excinfo.value)
+
+
+def test_hash_roots():
+    records = RECORDS + [b"@read_1 1:N:0:AGTCAA /1\nAAAA\n+\nIIII\n", b"@read_1_long_name_that_spans_words\nA\n+\nI\n"]
+
+    starts, hashes = virtool.fastq.hash_roots(b"".join(records))
+
+    assert starts.tolist() == [sum(len(record) for record in records[:i]) for i in range(5)]
+
+    # Reads with the same root should have the same hash.
+    assert hashes[0] == hashes[3]
+    assert len(set(hashes.tolist())) == 4
+
+
+def test_hash_roots_bad_record():
+    with pytest.raises(ValueError) as excinfo:
+        virtool.fastq.hash_roots(b">read_1\nACGT\n+\nIIII\n")
+
+    assert "does not start with '@'" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("proc", [1, 2])
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_reunite_pairs(compressed, proc, tmpdir, unite):
+    unite, paths = unite
+
+    if compressed:
+        with open(paths["left"], "rb") as f:
+            data = f.read()
+
+        with gzip.open(paths["left"], "wb") as f:
+            f.write(data)
+
+    output_paths = [str(tmpdir.join("unmapped_1.fq")), str(tmpdir.join("unmapped_2.fq"))]
+
+    counts = virtool.fastq.reunite_pairs(paths["separate"], [paths["left"], paths["right"]], output_paths, proc)
+
+    assert counts == [4, 4]
+
+    for path, key in zip(output_paths, ["united_left", "united_right"]):
+        with open(path, "r") as f:
+            assert [line.rstrip() for line in f] == unite[key]
@@ -4,8 +4,9 @@ import pytest
 import shutil
 import pickle
 import filecmp
-
+import numpy as np
 import virtool.pathoscope
+import virtool.vta
 
 BASE_PATH = os.path.join(sys.path[0], "tests", "test_files", "pathoscope")
 BEST_HIT_PATH = os.path.join(BASE_PATH, "best_hit")
@@ -44,15 +45,74 @@ def test_build_matrix(tmpdir):
     vta_path = os.path.join(str(tmpdir), "test.vta")
 
     with open(MATRIX_PATH, "rb") as handle:
-        expected = pickle.load(handle)
+        expected_u, expected_nu, expected_refs, expected_reads = pickle.load(handle)
+
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    assert matrix.refs == expected_refs
+    assert matrix.read_count == len(expected_reads)
+
+    for read_index in range(matrix.read_count):
+        start = matrix.offsets[read_index]
+        end = matrix.offsets[read_index + 1]
+
+        if read_index in expected_u:
+            assert end - start == 1
+            assert matrix.ref_indexes[start] == expected_u[read_index][0]
+            assert matrix.scores[start] == expected_u[read_index][1]
+        else:
+            ref_indexes, scores, x, weight = expected_nu[read_index]
+
+            assert matrix.ref_indexes[start:end].tolist() == ref_indexes
+            assert matrix.scores[start:end].tolist() == scores
+            assert matrix.x[start:end].tolist() == pytest.approx(x)
+            assert matrix.weights[read_index] == weight
 
-    actual = virtool.pathoscope.build_matrix(vta_path, 0.01)
 
-    assert expected[0] == actual[0]
-    assert expected[1] == actual[1]
+def test_build_matrix_collapsed(tmpdir):
+    """
+    Test that reads with identical alignment profiles are collapsed into rows whose entries match those of the first
+    read in each class.
+
+    """
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+    collapsed = virtool.pathoscope.build_matrix(vta_path, 0.01, collapse=True)
+
+    assert collapsed.read_count == matrix.read_count
+    assert collapsed.row_count < matrix.row_count
+    assert collapsed.multiplicities.sum() == matrix.read_count
+
+    def get_profile(m, row):
+        start = m.offsets[row]
+        end = m.offsets[row + 1]
+        return sorted(zip(m.ref_indexes[start:end].tolist(), m.scores[start:end].tolist()))
+
+    # Every read must be represented by a class with the same profile.
+    read_rows = np.repeat(np.arange(matrix.row_count), matrix.lengths)
+    class_rows = np.repeat(np.arange(collapsed.row_count), collapsed.lengths)
+
+    lines = np.flatnonzero(matrix.line_entries != -1)
+
+    assert np.array_equal(lines, np.flatnonzero(collapsed.line_entries != -1))
+
+    read_classes = dict(zip(
+        read_rows[matrix.line_entries[lines]].tolist(),
+        class_rows[collapsed.line_entries[lines]].tolist()
+    ))
+
+    assert len(read_classes) == matrix.read_count
+
+    for read_index, class_index in read_classes.items():
+        assert get_profile(matrix, read_index) == get_profile(collapsed, class_index)
+
+    assert np.array_equal(
+        matrix.ref_indexes[matrix.line_entries[lines]],
+        collapsed.ref_indexes[collapsed.line_entries[lines]]
+    )
 
-    assert sorted(expected[2]) == sorted(actual[2])
-    assert sorted(expected[3]) == sorted(actual[3])
 
 @pytest.mark.parametrize("theta_prior", [0, 1e-5])
 @pytest.mark.parametrize("pi_prior", [0, 1e-5])
@@ -62,43 +122,100 @@ def test_em(tmpdir, theta_prior, pi_prior, epsilon, max_iter, expected_em):
     shutil.copy(VTA_PATH, str(tmpdir))
     vta_path = os.path.join(str(tmpdir), "test.vta")
 
-    u, nu, refs, _ = virtool.pathoscope.build_matrix(vta_path, 0.01)
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
 
-    result = virtool.pathoscope.em(u, nu, refs, max_iter, epsilon, pi_prior, theta_prior)
+    result = virtool.pathoscope.em(matrix, max_iter, epsilon, pi_prior, theta_prior)
 
     file_string = "_".join([str(i) for i in ["em", theta_prior, pi_prior, epsilon, max_iter]])
 
     for i in [0, 1, 2]:
         assert sorted(result[i]) == sorted(expected_em[file_string][i])
 
-    assert result[3] == expected_em[file_string][3]
+    nu = expected_em[file_string][3]
+
+    for read_index in nu:
+        start = matrix.offsets[read_index]
+        end = matrix.offsets[read_index + 1]
+
+        assert matrix.x[start:end].tolist() == nu[read_index][2]
 
 
-def test_compute_best_hit():
+@pytest.mark.parametrize("collapse", [False, True])
+def test_compute_best_hit(collapse, tmpdir):
     """
     Test that :meth:`compute_best_hit` gives the expected result given some input data.
 
     """
-    with open(MATRIX_PATH, "rb") as handle:
-        matrix_tuple = pickle.load(handle)
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01, collapse)
 
     with open(BEST_HIT_PATH, "rb") as handle:
-        assert pickle.load(handle) == virtool.pathoscope.compute_best_hit(*matrix_tuple)
+        expected = pickle.load(handle)
+
+    result = virtool.pathoscope.compute_best_hit(matrix)
+
+    if collapse:
+        for i in range(4):
+            assert result[i] == pytest.approx(expected[i])
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize("em_engine", ["python", "numpy"])
+def test_rewrite_align(em_engine, tmpdir):
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    rewrite_path = os.path.join(str(tmpdir), "rewrite.vta")
 
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    virtool.pathoscope.EM_ENGINES[em_engine](matrix, 50, 1e-7, 0, 0)
 
-def test_rewrite_align(tmpdir):
     with open(UNU_PATH, "rb") as f:
-        u, nu = pickle.load(f)
+        _, nu = pickle.load(f)
+
+    for read_index in nu:
+        start = matrix.offsets[read_index]
+        end = matrix.offsets[read_index + 1]
+
+        assert matrix.x[start:end].tolist() == pytest.approx(nu[read_index][2])
+
+    virtool.pathoscope.rewrite_align(matrix, vta_path, 0.01, rewrite_path)
+
+    with open(UPDATED_VTA_PATH, "r") as f:
+        assert list(virtool.vta.iter_lines(rewrite_path)) == list(f)
+
 
+@pytest.mark.parametrize("em_engine", ["python", "numpy"])
+def test_em_collapsed(em_engine, tmpdir):
+    """
+    Test that running the EM algorithm over read equivalence classes gives the same result and reassigned alignments
+    as running it over individual reads.
+
+    """
     shutil.copy(VTA_PATH, str(tmpdir))
     vta_path = os.path.join(str(tmpdir), "test.vta")
 
     rewrite_path = os.path.join(str(tmpdir), "rewrite.vta")
 
-    virtool.pathoscope.rewrite_align(u, nu, vta_path, 0.01, rewrite_path)
+    em = virtool.pathoscope.EM_ENGINES[em_engine]
+
+    expected = em(virtool.pathoscope.build_matrix(vta_path, 0.01), 50, 1e-7, 0, 0)
+
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01, collapse=True)
+
+    result = em(matrix, 50, 1e-7, 0, 0)
 
-    assert filecmp.cmp(UPDATED_VTA_PATH, rewrite_path)
-    assert not filecmp.cmp(vta_path, rewrite_path)
+    for i in range(3):
+        assert result[i] == pytest.approx(expected[i], rel=1e-9, abs=1e-15)
+
+    virtool.pathoscope.rewrite_align(matrix, vta_path, 0.01, rewrite_path)
+
+    with open(UPDATED_VTA_PATH, "r") as f:
+        assert list(virtool.vta.iter_lines(rewrite_path)) == list(f)
 
 
 def test_calculate_coverage(tmpdir, test_sam_path):
@@ -124,34 +241,80 @@ def test_calculate_coverage(tmpdir, test_sam_path):
 
                 ref_lengths[ref_id] = length
 
-    virtool.pathoscope.calculate_coverage(vta_path, ref_lengths)
+    coverage = virtool.pathoscope.calculate_coverage(vta_path, ref_lengths)
+
+    for ref_id, depths in coverage.items():
+        assert depths.dtype == np.int32
+        assert len(depths) == ref_lengths[ref_id]
+
+
+@pytest.mark.parametrize("depths,expected", [
+    (
+        [0, 0, 3, 3, 3, 1],
+        {
+            "coverage": 0.667,
+            "depth": 2,
+            "median_depth": 2.0,
+            "align_rle": {"values": [0, 3, 1], "lengths": [2, 3, 1]}
+        }
+    ),
+    (
+        [2, 2, 5, 0, 7],
+        {
+            "coverage": 0.8,
+            "depth": 3,
+            "median_depth": 2,
+            "align_rle": {"values": [2, 5, 0, 7], "lengths": [2, 1, 1, 1]}
+        }
+    )
+])
+def test_summarize_coverage(depths, expected):
+    summary = virtool.pathoscope.summarize_coverage(np.array(depths, dtype=np.int32))
+
+    assert summary == expected
+    assert type(summary["median_depth"]) == type(expected["median_depth"])
+
+
+def test_count_coverage():
+    """
+    Test that alignments overhanging the end of a reference are truncated and that depths do not leak between
+    references.
+
+    """
+    records = np.array([
+        (0, 0, 1, 3, 1.0),
+        (1, 0, 3, 4, 1.0),
+        (1, 1, 2, 2, 1.0)
+    ], dtype=virtool.vta.RECORD_DTYPE)
+
+    coverage = virtool.pathoscope.count_coverage(records, ["foo", "bar"], {"foo": 5, "bar": 4})
+
+    assert {ref_id: depths.tolist() for ref_id, depths in coverage.items()} == {
+        "foo": [1, 1, 2, 1, 1],
+        "bar": [0, 1, 1, 0]
+    }
 
 
 def test_write_report(tmpdir):
     shutil.copy(VTA_PATH, str(tmpdir))
     vta_path = os.path.join(str(tmpdir), "test.vta")
 
-    u, nu, refs, reads = virtool.pathoscope.build_matrix(vta_path, 0.01)
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
 
     with open(BEST_HIT_PATH, "rb") as handle:
         best_hit_initial_reads, best_hit_initial, level_1_initial, level_2_initial = pickle.load(handle)
 
-    init_pi, pi, _, nu = virtool.pathoscope.em(u, nu, refs, 30, 1e-7, 0, 0)
+    init_pi, pi, _, _ = virtool.pathoscope.em(matrix, 30, 1e-7, 0, 0)
 
-    best_hit_final_reads, best_hit_final, level_1_final, level_2_final = virtool.pathoscope.compute_best_hit(
-        u,
-        nu,
-        refs,
-        reads
-    )
+    best_hit_final_reads, best_hit_final, level_1_final, level_2_final = virtool.pathoscope.compute_best_hit(matrix)
 
     report_path = os.path.join(str(tmpdir), "report.tsv")
 
     virtool.pathoscope.write_report(
         report_path,
         pi,
-        refs,
-        len(reads),
+        matrix.refs,
+        matrix.read_count,
         init_pi,
         best_hit_initial,
         best_hit_initial_reads,
@@ -166,4 +329,83 @@ def test_write_report(tmpdir):
     assert filecmp.cmp(report_path, TSV_PATH)
 
 
+@pytest.mark.parametrize("theta_prior", [0, 1e-5])
+@pytest.mark.parametrize("pi_prior", [0, 1e-5])
+@pytest.mark.parametrize("max_iter", [0, 5, 50])
+def test_em_vectorized(tmpdir, theta_prior, pi_prior, max_iter):
+    """
+    Test that :func:`em_vectorized` returns the same results as the reference :func:`em` implementation.
+
+    """
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    expected_matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    expected = virtool.pathoscope.em(expected_matrix, max_iter, 1e-7, pi_prior, theta_prior)
+    result = virtool.pathoscope.em_vectorized(matrix, max_iter, 1e-7, pi_prior, theta_prior)
+
+    for i in [0, 1, 2]:
+        assert result[i] == pytest.approx(expected[i], rel=1e-9)
+
+    assert matrix.x.tolist() == pytest.approx(expected_matrix.x.tolist(), rel=1e-9)
+
+
+@pytest.mark.parametrize("max_iter", [1, 2, 3, 5, 50])
+def test_em_squarem(tmpdir, max_iter):
+    """
+    Test that :func:`em_squarem` respects ``max_iter`` and converges to the same result as the unaccelerated
+    implementation.
+
+    """
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    expected_matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    expected = virtool.pathoscope.em_vectorized(expected_matrix, 1000, 1e-14, 0, 0)
+    result = virtool.pathoscope.em_squarem(matrix, max_iter, 1e-14, 0, 0)
+
+    init_pi, pi, theta, stats = result
+
+    assert 0 < stats["iterations"] <= max_iter
+
+    # The first iteration is always an unaccelerated EM step.
+    assert init_pi == pytest.approx(virtool.pathoscope.em_vectorized(
+        virtool.pathoscope.build_matrix(vta_path, 0.01), 1, 1e-14, 0, 0
+    )[1])
+
+    if max_iter == 50:
+        assert stats["iterations"] <= expected[3]["iterations"]
+        assert stats["delta"] <= 1e-14
+        assert pi == pytest.approx(expected[1], abs=1e-12)
+        assert theta == pytest.approx(expected[2], abs=1e-9)
+
+
+@pytest.mark.parametrize("proc", [2, 3])
+@pytest.mark.parametrize("em_engine", ["numpy", "squarem"])
+def test_em_parallel(em_engine, proc, tmpdir, monkeypatch):
+    """
+    Test that running the E-step in multiple processes gives exactly the same result as running it in one.
+
+    """
+    shutil.copy(VTA_PATH, str(tmpdir))
+    vta_path = os.path.join(str(tmpdir), "test.vta")
+
+    # Use small blocks so the work is divided between all of the processes.
+    monkeypatch.setattr(virtool.pathoscope, "E_STEP_BLOCK_ROWS", 100)
+
+    em = virtool.pathoscope.EM_ENGINES[em_engine]
+
+    expected_matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+    matrix = virtool.pathoscope.build_matrix(vta_path, 0.01)
+
+    expected = em(expected_matrix, 50, 1e-7, 0, 0, proc=1)
+    result = em(matrix, 50, 1e-7, 0, 0, proc=proc)
+
+    assert result[:3] == expected[:3]
+    assert result[3]["iterations"] == expected[3]["iterations"]
 
+    assert np.array_equal(matrix.x, expected_matrix.x)
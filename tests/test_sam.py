@@ -0,0 +1,106 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import virtool.pathoscope
+import virtool.sam
+import virtool.vta
+
+SAM_PATH = os.path.join(sys.path[0], "tests", "test_files", "sam_50.sam")
+
+
+@pytest.fixture
+def sam_data():
+    with open(SAM_PATH, "rb") as f:
+        data = f.read()
+
+    unmapped = "\t".join(["unmapped", "4", "*", "0", "0", "*", "*", "0", "0", "ACGT", "IIII", "YT:Z:UU"])
+    no_ref = "\t".join(["no_ref", "0", "*", "0", "0", "*", "*", "0", "0", "ACGT", "IIII", "AS:i:4"])
+    late_score = "\t".join(["late", "0", "NC_016509", "12", "255", "4M", "*", "0", "0", "ACGT", "IIII", "XS:i:2\tAS:i:-3"])
+
+    return b"@HD\tVN:1.0\tSO:unsorted\n#comment\n" + data + "\n".join([unmapped, no_ref, late_score]).encode()
+
+
+def expected_alignments(data):
+    """
+    Parse SAM data line-by-line the way Virtool did before :mod:`virtool.sam` was introduced.
+
+    """
+    for line in data.decode().splitlines():
+        if line[0] == "@" or line[0] == "#":
+            continue
+
+        fields = line.split("\t")
+
+        if int(fields[1]) & 0x4 == 4 or fields[2] == "*":
+            continue
+
+        yield fields[0], fields[2], int(fields[3]), len(fields[9]), virtool.pathoscope.find_sam_align_score(fields)
+
+
+@pytest.mark.parametrize("block_size", [1, 100, virtool.sam.BLOCK_SIZE])
+def test_iter_alignments(block_size, sam_data):
+    """
+    Test that alignments are parsed identically to the legacy line-by-line parser regardless of how the data is split
+    into blocks.
+
+    """
+    observed = [
+        (qname.decode(), rname.decode(), pos, length, score) for qname, _, rname, pos, length, score in
+        virtool.sam.iter_alignments(io.BytesIO(sam_data), block_size)
+    ]
+
+    assert observed == list(expected_alignments(sam_data))
+    assert observed[-1] == ("late", "NC_016509", 12, 4, 1.0)
+
+
+@pytest.mark.parametrize("line,message", [
+    (b"read\t0\tNC_016509\t12\t255\t4M\t*\t0\t0\tACGT\tIIII\tXS:i:2\tYT:Z:UU", "Could not find alignment score"),
+    (b"read\t0\tNC_016509\t12\t255\t4M\t*\t0\t0\tACGT", "SAM line has too few fields"),
+    (b"read\tfoo\tNC_016509\t12\t255\t4M\t*\t0\t0\tACGT\tIIII\tAS:i:2", "Could not parse integer field")
+], ids=["no_score", "too_few_fields", "bad_flag"])
+def test_parse_block_error(line, message):
+    with pytest.raises(ValueError) as excinfo:
+        virtool.sam.parse_block(line + b"\n")
+
+    assert message in str(excinfo.value)
+
+
+def test_parse_ints():
+    array = np.frombuffer(b"12\t-3\t0\t4096", dtype=np.uint8)
+
+    starts = np.array([0, 3, 6, 8])
+    ends = np.array([2, 5, 7, 12])
+
+    assert virtool.sam.parse_ints(array, starts, ends).tolist() == [12, -3, 0, 4096]
+
+
+def test_filter_alignments(tmpdir, sam_data):
+    path = os.path.join(str(tmpdir), "to_isolates.vta")
+
+    count = virtool.sam.filter_alignments(io.BytesIO(sam_data), path, p_score_cutoff=2)
+
+    expected = [
+        f"{read_id},{ref_id},{pos},{length},{score}\n" for read_id, ref_id, pos, length, score in
+        expected_alignments(sam_data) if score >= 2
+    ]
+
+    assert count == len(expected) == 50
+    assert list(virtool.vta.iter_lines(path)) == expected
+
+
+def test_filter_refs(sam_data):
+    expected = {ref_id for _, ref_id, _, _, score in expected_alignments(sam_data) if score >= 2}
+
+    assert virtool.sam.filter_refs(io.BytesIO(sam_data), p_score_cutoff=2) == expected
+    assert "NC_016509" in expected
+
+
+def test_filter_scores(sam_data):
+    expected = {read_id: score for read_id, _, _, _, score in expected_alignments(sam_data)}
+
+    assert virtool.sam.filter_scores(io.BytesIO(sam_data)) == expected
+    assert expected["late"] == 1.0
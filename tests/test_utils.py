@@ -1,4 +1,5 @@
 import datetime
+import gzip
 import os
 import shutil
 import sys
@@ -69,6 +70,18 @@ def test_decompress_tgz(tmpdir):
     assert set(os.listdir(os.path.join(path, "de", "virtool"))) == {"run", "client", "VERSION", "install.sh"}
 
 
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_open_binary(compressed, tmpdir):
+    # The file name should not affect how the file is opened.
+    path = str(tmpdir.join("reads.fq"))
+
+    with (gzip.open if compressed else open)(path, "wb") as f:
+        f.write(b"@read_1\nACGT\n+\nIIII\n")
+
+    with virtool.utils.open_binary(path) as f:
+        assert f.read() == b"@read_1\nACGT\n+\nIIII\n"
+
+
 class TestRm:
 
     def test_rm_file(self, fake_dir):
@@ -0,0 +1,125 @@
+import os
+import sys
+
+import pytest
+
+import virtool.vta
+
+VTA_PATH = os.path.join(sys.path[0], "tests", "test_files", "pathoscope", "test.vta")
+
+
+@pytest.fixture
+def legacy_lines():
+    with open(VTA_PATH, "r") as f:
+        return list(f)
+
+
+def test_convert(tmpdir, legacy_lines):
+    """
+    Test that a legacy text VTA file can be converted to the binary format and back without any changes.
+
+    """
+    path = os.path.join(str(tmpdir), "converted.vta")
+
+    assert virtool.vta.is_legacy(VTA_PATH)
+
+    virtool.vta.convert(VTA_PATH, path)
+
+    assert not virtool.vta.is_legacy(path)
+
+    assert list(virtool.vta.iter_lines(path)) == legacy_lines
+
+
+def test_writer(tmpdir, legacy_lines):
+    """
+    Test that writing alignments one at a time with :class:`.Writer` produces the same file as :func:`.convert`.
+
+    """
+    path = os.path.join(str(tmpdir), "written.vta")
+    converted_path = os.path.join(str(tmpdir), "converted.vta")
+
+    with virtool.vta.Writer(path) as writer:
+        for line in legacy_lines:
+            read_id, ref_id, pos, length, score = line.rstrip().split(",")
+            writer.write(read_id, ref_id, int(pos), int(length), float(score))
+
+    virtool.vta.convert(VTA_PATH, converted_path)
+
+    with open(path, "rb") as f:
+        with open(converted_path, "rb") as g:
+            assert f.read() == g.read()
+
+
+def test_write_many(tmpdir, legacy_lines):
+    """
+    Test that writing alignments in batches with :meth:`.Writer.write_many` produces the same file as
+    :func:`.convert`.
+
+    """
+    path = os.path.join(str(tmpdir), "written.vta")
+    converted_path = os.path.join(str(tmpdir), "converted.vta")
+
+    fields = [line.rstrip().split(",") for line in legacy_lines]
+
+    with virtool.vta.Writer(path) as writer:
+        for i in range(0, len(fields), 7):
+            batch = fields[i:i + 7]
+
+            writer.write_many(
+                [f[0] for f in batch],
+                [f[1] for f in batch],
+                [int(f[2]) for f in batch],
+                [int(f[3]) for f in batch],
+                [float(f[4]) for f in batch]
+            )
+
+    virtool.vta.convert(VTA_PATH, converted_path)
+
+    with open(path, "rb") as f:
+        with open(converted_path, "rb") as g:
+            assert f.read() == g.read()
+
+
+@pytest.mark.parametrize("legacy", [True, False], ids=["legacy", "binary"])
+def test_load(legacy, tmpdir, legacy_lines):
+    """
+    Test that legacy and binary files are loaded into equivalent :class:`.Alignments` objects.
+
+    """
+    path = VTA_PATH
+
+    if not legacy:
+        path = os.path.join(str(tmpdir), "converted.vta")
+        virtool.vta.convert(VTA_PATH, path)
+
+    alignments = virtool.vta.load(path)
+
+    assert len(alignments) == len(legacy_lines)
+
+    read_ids = alignments.read_ids()
+
+    read_id, ref_id, pos, length, score = legacy_lines[0].rstrip().split(",")
+
+    record = alignments.records[0]
+
+    assert read_ids[record["read"]] == read_id
+    assert alignments.refs[record["ref"]] == ref_id
+    assert record["pos"] == int(pos)
+    assert record["length"] == int(length)
+    assert record["score"] == float(score)
+
+    assert len(read_ids) == len({line.split(",")[0] for line in legacy_lines})
+    assert alignments.read_table == "".join(f"{read_id}\n" for read_id in read_ids).encode()
+
+
+def test_load_empty(tmpdir):
+    path = os.path.join(str(tmpdir), "empty.vta")
+
+    with virtool.vta.Writer(path):
+        pass
+
+    alignments = virtool.vta.load(path)
+
+    assert len(alignments) == 0
+    assert alignments.refs == []
+    assert alignments.read_ids() == []
@@ -3,15 +3,15 @@ Provides request handlers for managing and viewing analyses.
 
 """
 import os
-import aiojobs.aiohttp
 
 import virtool.analyses.format
 import virtool.analyses.utils
-import virtool.bio
 import virtool.analyses.db
 import virtool.samples.db
 import virtool.errors
 import virtool.http.routes
+import virtool.indexes.db
+import virtool.indexes.similarity
 import virtool.samples.utils
 import virtool.utils
 from virtool.api import bad_request, conflict, insufficient_rights, json_response, no_content, not_found
@@ -103,7 +103,6 @@ async def blast(req):
 
     """
     db = req.app["db"]
-    settings = req.app["settings"]
 
     analysis_id = req.match_info["analysis_id"]
     sequence_index = int(req.match_info["sequence_index"])
@@ -134,29 +133,85 @@ async def blast(req):
     if not write:
         return insufficient_rights()
 
-    # Start a BLAST at NCBI with the specified sequence. Return a RID that identifies the BLAST run.
-    rid, _ = await virtool.bio.initialize_ncbi_blast(req.app["settings"], sequence)
-
-    blast_data, document = await virtool.analyses.db.update_nuvs_blast(
-        db,
-        settings,
-        analysis_id,
-        sequence_index,
-        rid
-    )
-
-    # Wait on BLAST request as a Task until the it completes on NCBI. At that point the sequence in the DB will be
-    # updated with the BLAST result.
-    await aiojobs.aiohttp.spawn(req, virtool.bio.wait_for_blast_result(
-        db,
-        req.app["settings"],
-        analysis_id,
-        sequence_index,
-        rid
-    ))
+    # Start a BLAST at NCBI with the specified sequence unless it has already been searched. The BLAST service attaches
+    # the result to the sequence when it is ready.
+    blast_data = await req.app["blast"].submit(analysis_id, sequence_index, sequence)
 
     headers = {
         "Location": f"/api/analyses/{analysis_id}/{sequence_index}/blast"
     }
 
     return json_response(blast_data, headers=headers, status=201)
+
+
+@routes.get("/api/analyses/{analysis_id}/{sequence_index}/similar")
+async def similar(req):
+    """
+    Find the reference sequences most similar to a contig sequence that is part of a NuVs result record. The sequence is
+    searched against the local similarity index of the current index of the analysis reference (see
+    :mod:`virtool.indexes.similarity`).
+
+    """
+    db = req.app["db"]
+
+    analysis_id = req.match_info["analysis_id"]
+    sequence_index = int(req.match_info["sequence_index"])
+
+    document = await db.analyses.find_one(
+        {"_id": analysis_id},
+        ["ready", "algorithm", "results", "sample", "reference"]
+    )
+
+    if not document:
+        return not_found("Analysis not found")
+
+    if document["algorithm"] != "nuvs":
+        return conflict("Not a NuVs analysis")
+
+    if not document["ready"]:
+        return conflict("Analysis is still running")
+
+    sequence = virtool.analyses.utils.find_nuvs_sequence_by_index(document, sequence_index)
+
+    if sequence is None:
+        return not_found("Sequence not found")
+
+    sample = await db.samples.find_one({"_id": document["sample"]["id"]}, virtool.samples.db.PROJECTION)
+
+    if not sample:
+        return bad_request("Parent sample does not exist")
+
+    read, _ = virtool.samples.utils.get_sample_rights(sample, req["client"])
+
+    if not read:
+        return insufficient_rights()
+
+    ref_id = document["reference"]["id"]
+
+    index_id, _ = await virtool.indexes.db.get_current_id_and_version(db, ref_id)
+
+    if index_id is None:
+        return not_found("Similarity index not found")
+
+    path = os.path.join(req.app["settings"]["data_path"], "references", ref_id, index_id, "similarity")
+
+    if not os.path.isdir(path):
+        return not_found("Similarity index not found")
+
+    similarity_index = await req.app["run_in_thread"](virtool.indexes.similarity.load, path)
+
+    matches = await req.app["run_in_thread"](similarity_index.search, sequence)
+
+    otus = await db.otus.find({"_id": {"$in": list({match["otu_id"] for match in matches})}}, ["name"]).to_list(None)
+
+    otu_names = {otu["_id"]: otu["name"] for otu in otus}
+
+    for match in matches:
+        match["otu_name"] = otu_names.get(match["otu_id"])
+
+    return json_response({
+        "index": {
+            "id": index_id
+        },
+        "matches": matches
+    })
@@ -1,7 +1,6 @@
 import os
 
 import virtool.analyses.utils
-import virtool.bio
 import virtool.db.utils
 import virtool.history.db
 import virtool.indexes.db
@@ -91,37 +90,29 @@ async def new(app, sample_id, ref_id, user_id, algorithm):
     return document
 
 
-async def update_nuvs_blast(db, settings, analysis_id, sequence_index, rid):
+async def update_nuvs_blast(db, analysis_id, sequence_index, data):
     """
     Update the BLAST data for a sequence in a NuVs analysis.
 
-    :param settings:
-    :param db:
+    :param db: the application database object
+    :type db: :class:`~virtool.db.core.DB`
 
-    :param analysis_id:
-    :param sequence_index:
-    :param rid:
+    :param analysis_id: the ID of the analysis
+    :type analysis_id: str
 
-    :return: the blast data and the complete analysis document
-    :rtype: Tuple[dict, dict]
+    :param sequence_index: the index of the sequence in the analysis
+    :type sequence_index: int
 
-    """
-    # Do initial check of RID to populate BLAST embedded document.
-    data = {
-        "rid": rid,
-        "ready": await virtool.bio.check_rid(settings, rid),
-        "last_checked_at": virtool.utils.timestamp(),
-        "interval": 3
-    }
+    :param data: the BLAST data or ``None`` to remove it
+    :type data: Union[None, dict]
 
-    document = await db.analyses.find_one_and_update({"_id": analysis_id, "results.index": sequence_index}, {
+    """
+    await db.analyses.update_one({"_id": analysis_id, "results.index": sequence_index}, {
         "$set": {
             "results.$.blast": data
         }
     })
 
-    return data, document
-
 
 async def remove_orphaned_directories(app):
     """
@@ -31,7 +31,10 @@ CSV_HEADERS = (
 
 def calculate_median_depths(document: dict) -> dict:
     """
-    Calculate the median depth for all hits (sequences) in a Pathoscope result document.
+    Get the median depth for all hits (sequences) in a Pathoscope result document.
+
+    Median depths are calculated by the Pathoscope job and stored on each hit. They are only calculated here for older
+    documents that store the complete per-base ``align`` list instead.
 
     :param document: the pathoscope analysis document to calculate depths for
     :return: a dict of median depths keyed by hit (sequence) ids
@@ -40,7 +43,10 @@ def calculate_median_depths(document: dict) -> dict:
     depths = dict()
 
     for hit in document["results"]:
-        depths[hit["id"]] = statistics.median(hit["align"])
+        try:
+            depths[hit["id"]] = hit["median_depth"]
+        except KeyError:
+            depths[hit["id"]] = statistics.median(hit["align"])
 
     return depths
 
@@ -142,7 +148,9 @@ async def format_pathoscope(db, settings, document):
 
                 sequence["id"] = sequence.pop("_id")
 
-                if "align" in sequence:
+                if "align_rle" in sequence:
+                    sequence["align"] = virtool.analyses.utils.transform_rle_to_coordinates(sequence.pop("align_rle"))
+                elif "align" in sequence:
                     sequence["align"] = virtool.analyses.utils.transform_coverage_to_coordinates(sequence["align"])
 
                 del sequence["sequence"]
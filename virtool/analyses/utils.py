@@ -40,6 +40,37 @@ def transform_coverage_to_coordinates(coverage_list: list) -> list:
     return coordinates
 
 
+def transform_rle_to_coordinates(rle: dict) -> list:
+    """
+    Takes run-length encoded read depths and returns a list of (x, y) coordinates. Each run contributes a coordinate
+    at its first and last position.
+
+    The coordinates will be simplified using Visvalingham-Wyatt algorithm if the list exceeds 100 pairs.
+
+    :param rle: the depth (``values``) and length (``lengths``) of each run of equal depths
+    :return: a list of (x, y) coordinates
+
+    """
+    coordinates = list()
+
+    start = 0
+
+    for depth, length in zip(rle["values"], rle["lengths"]):
+        end = start + length - 1
+
+        coordinates.append((start, depth))
+
+        if end != start:
+            coordinates.append((end, depth))
+
+        start = end + 1
+
+    if len(coordinates) > 100:
+        return vw.simplify(coordinates, ratio=0.4)
+
+    return coordinates
+
+
 def find_nuvs_sequence_by_index(document: dict, sequence_index: int) -> Union[None, dict]:
     """
     Get a sequence from a NuVs analysis document by its sequence index.
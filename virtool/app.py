@@ -14,6 +14,7 @@ from aiohttp import client, web
 from motor import motor_asyncio
 
 import virtool.app_routes
+import virtool.blast
 import virtool.config
 import virtool.db.core
 import virtool.db.utils
@@ -26,6 +27,7 @@ import virtool.http.csp
 import virtool.http.errors
 import virtool.http.proxy
 import virtool.http.query
+import virtool.jobs.db
 import virtool.jobs.manager
 import virtool.logs
 import virtool.db.migrate
@@ -232,6 +234,7 @@ async def init_check_db(app):
     await db.history.create_index([("otu.version", -1)])
     await db.indexes.drop_indexes()
     await db.indexes.create_index([("version", 1), ("reference.id", 1)], unique=True)
+    await db.job_leases.create_index("expires_at")
     await db.keys.create_index("id", unique=True)
     await db.keys.create_index("user.id")
     await db.samples.create_index([("created_at", pymongo.DESCENDING)])
@@ -266,6 +269,25 @@ async def init_events(app):
     app["events"] = events
 
 
+async def init_blast(app):
+    """
+    An application ``on_startup`` callback that initializes the :class:`virtool.blast.BLAST` service, attaches it to
+    the ``app`` object, and starts its polling task.
+
+    :param app: the app object
+    :type app: :class:`aiohttp.web.Application`
+
+    """
+    if app["setup"] is not None:
+        return
+
+    app["blast"] = virtool.blast.BLAST(app["db"], app["settings"], app["client"])
+
+    scheduler = aiojobs.aiohttp.get_scheduler_from_app(app)
+
+    await scheduler.spawn(app["blast"].run())
+
+
 async def init_job_manager(app):
     """
     An application `on_startup` callback that initializes a Virtool :class:`virtool.job_manager.Manager` object and
@@ -286,7 +308,15 @@ async def init_job_manager(app):
     if "sentry" in app:
         capture_exception = app["sentry"].captureException
 
-    app["jobs"] = virtool.jobs.manager.IntegratedManager(app, capture_exception)
+    if app["settings"]["external_jobs"]:
+        logger.info("Running jobs on external job runners")
+        app["jobs"] = virtool.jobs.manager.ExternalManager(app)
+    else:
+        app["jobs"] = virtool.jobs.manager.IntegratedManager(app, capture_exception)
+
+    # Resume jobs that were interrupted when the server last stopped.
+    for job_id in await virtool.jobs.db.get_waiting_ids(app["db"]):
+        await app["jobs"].enqueue(job_id)
 
     scheduler = aiojobs.aiohttp.get_scheduler_from_app(app)
 
@@ -425,6 +455,7 @@ def create_app(config):
         init_sentry,
         init_check_db,
         init_resources,
+        init_blast,
         init_job_manager,
         init_file_manager,
         init_refresh
@@ -0,0 +1,269 @@
+"""
+A content-addressed store for files that are expensive to build and can be shared between jobs.
+
+Each entry is a directory identified by a key, usually a hash of the inputs used to build it (see :func:`hash_file`).
+Jobs call :meth:`ArtifactStore.acquire` to get the path to an entry, building it first if it does not exist, and
+:meth:`ArtifactStore.release` when they no longer need it.
+
+The store is safe to use from several processes at once. Its state is kept in a JSON file that is only read and written
+while holding an exclusive :func:`fcntl.flock` lock. Entries are built outside of that lock in a temporary directory
+and moved into place when complete, so long builds do not block other jobs. A separate lock for each key prevents the
+same entry from being built by two processes at the same time.
+
+Entries that are in use are never removed. Each acquisition is recorded as a holder identified by host name and process
+ID, so holders left behind by processes that exited without releasing their entries are ignored. The quota caps the
+total size of all entries in the store, including entries that are in use. When the total size exceeds the quota,
+unused entries are evicted in least-recently-used order. Entries that are in use are never evicted, so the store can
+stay over its quota until they are released.
+
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+
+#: The maximum number of bytes read from a file at once when hashing it.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class ArtifactStore:
+    """
+    A content-addressed store of directories rooted at ``path``.
+
+    :param path: the directory to keep the store in
+    :param quota: the maximum total size in bytes of all entries, including entries in use, which are never evicted
+
+    """
+
+    def __init__(self, path: str, quota: int):
+        self.path = path
+        self.quota = quota
+
+        for name in ("entries", "locks", "tmp"):
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    def entry_path(self, key: str) -> str:
+        """
+        Get the path to the directory for the entry with ``key``. The directory only exists if the entry does.
+
+        """
+        return os.path.join(self.path, "entries", key)
+
+    def acquire(self, key: str, build) -> str:
+        """
+        Get the path to the entry with ``key`` and mark it as in use by the calling process.
+
+        If the entry does not exist, ``build`` is called with the path to an empty directory that it should write the
+        entry's files to. The directory is added to the store when ``build`` returns. It is removed if ``build`` raises
+        an exception.
+
+        Every call must be matched with a call to :meth:`release`.
+
+        :param key: the key for the entry
+        :param build: a function that builds the entry in the directory it is passed
+        :return: the path to the entry directory
+
+        """
+        with self._lock(key):
+            with self._state() as state:
+                entry = state.get(key)
+
+                if entry is not None:
+                    entry["holders"].append(get_holder())
+                    entry["last_used"] = time.time()
+
+                    return self.entry_path(key)
+
+            tmp_path = os.path.join(self.path, "tmp", f"{get_holder()}:{uuid.uuid4().hex}")
+
+            os.mkdir(tmp_path)
+
+            try:
+                build(tmp_path)
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+
+            size = get_size(tmp_path)
+
+            with self._state() as state:
+                # Remove the files of an entry that was being added when its process was killed.
+                shutil.rmtree(self.entry_path(key), ignore_errors=True)
+
+                os.rename(tmp_path, self.entry_path(key))
+
+                now = time.time()
+
+                state[key] = {
+                    "created_at": now,
+                    "holders": [get_holder()],
+                    "last_used": now,
+                    "size": size
+                }
+
+                evicted = self._evict(state)
+
+        remove_paths(evicted)
+
+        return self.entry_path(key)
+
+    def release(self, key: str):
+        """
+        Mark the entry with ``key`` as no longer in use by the calling process. Unused entries are evicted if the store
+        is over its quota.
+
+        """
+        with self._state() as state:
+            entry = state.get(key)
+
+            if entry is not None:
+                try:
+                    entry["holders"].remove(get_holder())
+                except ValueError:
+                    pass
+
+                entry["last_used"] = time.time()
+
+            evicted = self._evict(state)
+
+        remove_paths(evicted)
+
+    def _evict(self, state: dict) -> list:
+        """
+        Remove unused entries from ``state`` in least-recently-used order until the total size of the store is within
+        its quota. The entry directories are moved to the temporary directory and their paths are returned so they can
+        be deleted after the state lock is released.
+
+        Holders that belong to processes on this host that no longer exist are removed first. Temporary directories
+        left behind by such processes are also returned for deletion.
+
+        """
+        for entry in state.values():
+            entry["holders"] = [holder for holder in entry["holders"] if is_holder_alive(holder)]
+
+        total = sum(entry["size"] for entry in state.values())
+
+        unused = sorted((entry["last_used"], key) for key, entry in state.items() if not entry["holders"])
+
+        evicted = list()
+
+        for _, key in unused:
+            if total <= self.quota:
+                break
+
+            path = os.path.join(self.path, "tmp", f"evicted-{uuid.uuid4().hex}")
+
+            os.rename(self.entry_path(key), path)
+
+            evicted.append(path)
+
+            total -= state.pop(key)["size"]
+
+        tmp_path = os.path.join(self.path, "tmp")
+
+        # Temporary build directories are named after their holder. Evicted directories are removable by any process.
+        for name in os.listdir(tmp_path):
+            if name.startswith("evicted-") or not is_holder_alive(name.rsplit(":", 1)[0]):
+                evicted.append(os.path.join(tmp_path, name))
+
+        return evicted
+
+    @contextlib.contextmanager
+    def _lock(self, name: str):
+        with open(os.path.join(self.path, "locks", f"{name}.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def _state(self):
+        """
+        Lock, load, and yield the state of the store. The state is saved when the context exits without an exception.
+
+        """
+        path = os.path.join(self.path, "state.json")
+
+        with self._lock("state"):
+            try:
+                with open(path, "r") as f:
+                    state = json.load(f)
+            except FileNotFoundError:
+                state = dict()
+
+            yield state
+
+            tmp_path = f"{path}.tmp"
+
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+
+            os.replace(tmp_path, path)
+
+
+def get_holder() -> str:
+    """
+    Get a string that identifies the calling process as the holder of a store entry.
+
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_holder_alive(holder: str) -> bool:
+    """
+    Check if the process identified by ``holder`` still exists. Holders on other hosts are assumed to be alive.
+
+    """
+    host, pid = holder.rsplit(":", 1)
+
+    if host != socket.gethostname():
+        return True
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def get_size(path: str) -> int:
+    """
+    Get the total size in bytes of the files in the directory at ``path``.
+
+    """
+    size = 0
+
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(root, filename))
+
+    return size
+
+
+def hash_file(path: str) -> str:
+    """
+    Calculate the SHA-256 hash of the file at ``path``.
+
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def remove_paths(paths: list):
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
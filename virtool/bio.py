@@ -1,5 +1,3 @@
-import asyncio
-import gzip
 import io
 import json
 import re
@@ -7,9 +5,12 @@ import zipfile
 from typing import Awaitable
 
 import aiohttp
+import numpy as np
 
 import virtool.analyses.utils
 import virtool.errors
+import virtool.fasta
+import virtool.fastq
 import virtool.http.proxy
 import virtool.utils
 
@@ -121,163 +122,191 @@ TRANSLATION_TABLE = {
 
 
 def read_fasta(path):
-    data = list()
+    """
+    Read the plain or gzip-compressed FASTA file at ``path`` into a list of ``(header, sequence)`` tuples. See
+    :func:`virtool.fasta.read_records`.
 
-    with open(path, "r") as f:
-        header = None
-        seq = []
+    """
+    try:
+        return [
+            (header.decode().replace(">", ""), sequence.decode()) for header, sequence in
+            virtool.fasta.read_records(path)
+        ]
+    except ValueError as err:
+        raise IOError(str(err))
 
-        for line in f:
-            if line[0] == ">":
-                if header:
-                    data.append((header, "".join(seq)))
 
-                header = line.rstrip().replace(">", "")
-                seq = []
-                continue
+def read_fastq(f):
+    """
+    Iterate through the ``(header, sequence, quality)`` records in a text FASTQ file object. See
+    :func:`virtool.fastq.iter_records`.
 
-            if header:
-                seq.append(line.rstrip())
-                continue
+    """
+    return virtool.fastq.iter_records(f)
 
-            raise IOError(f"Illegal FASTA line: {line}")
 
-        if header:
-            data.append((header, "".join(seq)))
+def read_fastq_from_path(path):
+    """
+    Iterate through the ``(header, sequence, quality)`` records in the plain or gzip-compressed FASTQ file at
+    ``path``.
 
-    return data
+    """
+    with io.TextIOWrapper(virtool.utils.open_binary(path)) as f:
+        yield from virtool.fastq.iter_records(f)
 
 
-def read_fastq(f):
-    data = list()
+def read_fastq_headers(path):
+    """
+    Get a list of the headers in the plain or gzip-compressed FASTQ file at ``path``. Sequence and quality lines are
+    skipped.
 
-    had_plus = False
+    """
+    with io.TextIOWrapper(virtool.utils.open_binary(path)) as f:
+        return list(virtool.fastq.iter_headers(f))
 
-    header = None
-    seq = None
 
-    for line in f:
-        if line == "+\n":
-            had_plus = True
-            continue
+#: The nucleotides that can appear in sequences passed to :func:`reverse_complement` and :func:`find_orfs`.
+NUCLEOTIDES = "".join(COMPLEMENT_TABLE)
 
-        if not had_plus:
-            if line[0] == "@":
-                header = line.rstrip()
-                continue
+#: A :meth:`str.translate` table that complements nucleotides.
+COMPLEMENT_TRANSLATION = str.maketrans(COMPLEMENT_TABLE)
 
-            seq = line.rstrip()
-            continue
+#: A :meth:`str.translate` table that deletes all valid nucleotides, leaving only invalid characters.
+INVALID_NUCLEOTIDES = str.maketrans("", "", NUCLEOTIDES)
 
-        if had_plus:
-            yield (header, seq, line.rstrip())
+#: The code for each byte value used to index :data:`CODON_LOOKUP`. Bytes that are not nucleotides get the code
+#: ``len(NUCLEOTIDES)``.
+NUCLEOTIDE_CODES = np.full(256, len(NUCLEOTIDES), dtype=np.uint8)
+NUCLEOTIDE_CODES[np.frombuffer(NUCLEOTIDES.encode(), dtype=np.uint8)] = np.arange(len(NUCLEOTIDES))
 
-            header = None
-            seq = None
-            had_plus = False
+#: The number of distinct nucleotide codes.
+CODE_COUNT = len(NUCLEOTIDES) + 1
 
-    return data
+#: The amino acid byte for every codon, indexed by the codon's nucleotide codes as ``a * CODE_COUNT ** 2 + b *
+#: CODE_COUNT + c``. Codons that are not in :data:`TRANSLATION_TABLE` translate to ``X``.
+CODON_LOOKUP = np.array([
+    ord(TRANSLATION_TABLE.get(a + b + c, "X")) for a in NUCLEOTIDES + "?" for b in NUCLEOTIDES + "?" for c in
+    NUCLEOTIDES + "?"
+], dtype=np.uint8)
 
+#: The minimum length in amino acids of an ORF returned by :func:`find_orfs`.
+MIN_ORF_LENGTH = 100
 
-def read_fastq_from_path(path):
-    try:
-        with open(path, "r") as f:
-            for record in read_fastq(f):
-                yield record
-    except UnicodeDecodeError:
-        with gzip.open(path, "rt") as f:
-            for record in read_fastq(f):
-                yield record
+STOP = ord("*")
 
 
-def read_fastq_headers(path):
-    headers = list()
+def reverse_complement(sequence):
+    sequence = sequence.upper()
 
-    had_plus = False
+    invalid = sequence.translate(INVALID_NUCLEOTIDES)
 
-    with open(path, "r") as f:
-        for line in f:
-            if line == "+\n":
-                had_plus = True
-                continue
+    if invalid:
+        raise KeyError(invalid[0])
 
-            if not had_plus and line[0] == "@":
-                headers.append(line.rstrip())
-                continue
+    return sequence.translate(COMPLEMENT_TRANSLATION)[::-1]
 
-            if had_plus:
-                had_plus = False
 
-    return headers
+def encode_codons(sequence: str):
+    """
+    Get an array of :data:`CODON_LOOKUP` indexes for the complete codons in each of the three frames of a nucleotide
+    sequence.
 
+    """
+    # Replace any non-ASCII characters so that there is exactly one byte per character.
+    data = sequence.upper().encode("ascii", "replace")
 
-def reverse_complement(sequence):
-    sequence = sequence.upper()
+    codes = NUCLEOTIDE_CODES[np.frombuffer(data, dtype=np.uint8)].astype(np.uint16)
 
-    complement = [COMPLEMENT_TABLE[s] for s in sequence]
-    complement.reverse()
+    frames = list()
 
-    return "".join(complement)
+    for frame in range(3):
+        count = (len(codes) - frame) // 3
 
+        if count < 1:
+            frames.append(np.zeros(0, dtype=np.uint16))
+            continue
 
-def translate(sequence):
-    sequence = sequence.upper()
+        codons = codes[frame:frame + count * 3].reshape(count, 3)
+
+        frames.append(codons[:, 0] * CODE_COUNT ** 2 + codons[:, 1] * CODE_COUNT + codons[:, 2])
 
-    protein = list()
+    return frames
 
-    for i in range(0, len(sequence) // 3):
-        codon = sequence[i * 3:(i + 1) * 3]
 
-        # Translate to X if the codon matches no amino acid (taking into account ambiguous codons where possible)
-        protein.append(TRANSLATION_TABLE.get(codon, "X"))
+def translate(sequence):
+    """
+    Translate a nucleotide sequence to a protein sequence in the first frame. Codons that match no amino acid, taking
+    into account ambiguous codons where possible, are translated to ``X``.
 
-    return "".join(protein)
+    """
+    return CODON_LOOKUP[encode_codons(sequence)[0]].tobytes().decode()
 
 
 def find_orfs(sequence):
+    """
+    Find the open reading frames in all six frames of a nucleotide sequence. An ORF is any run of at least
+    :data:`MIN_ORF_LENGTH` amino acids between stop codons or the ends of the translation.
+
+    Each frame is translated at once using :data:`CODON_LOOKUP` and ORFs are found from the positions of its stop
+    codons.
+
+    :param sequence: the nucleotide sequence
+    :return: a list of ORF dicts containing the ``pro`` and ``nuc`` sequences, ``frame``, ``strand``, and ``pos``
+
+    """
     orfs = list()
 
     sequence_length = len(sequence)
 
     # Only look for ORFs if the contig is at least 300 nucleotides long.
-    if sequence_length > 300:
-        # Looks at both forward (+) and reverse (-) strands.
-        for strand, nuc in [(+1, sequence), (-1, reverse_complement(sequence))]:
-            # Look in all three translation frames.
-            for frame in range(3):
-                translation = translate(nuc[frame:])
-                translation_length = len(translation)
-
-                aa_start = 0
-
-                # Extract ORFs.
-                while aa_start < translation_length:
-                    aa_end = translation.find("*", aa_start)
-
-                    if aa_end == -1:
-                        aa_end = translation_length
-                    if aa_end - aa_start >= 100:
-                        if strand == 1:
-                            start = frame + aa_start * 3
-                            end = min(sequence_length, frame + aa_end * 3 + 3)
-                        else:
-                            start = sequence_length - frame - aa_end * 3 - 3
-                            end = sequence_length - frame - aa_start * 3
-
-                        orfs.append({
-                            "pro": str(translation[aa_start:aa_end]),
-                            "nuc": str(nuc[start:end]),
-                            "frame": frame,
-                            "strand": strand,
-                            "pos": (start, end)
-                        })
-
-                    aa_start = aa_end + 1
+    if sequence_length <= 300:
+        return orfs
+
+    # Looks at both forward (+) and reverse (-) strands.
+    for strand, nuc in [(+1, sequence), (-1, reverse_complement(sequence))]:
+        # Look in all three translation frames.
+        for frame, codons in enumerate(encode_codons(nuc)):
+            translation = CODON_LOOKUP[codons]
+            translation_length = len(translation)
+
+            stops = np.flatnonzero(translation == STOP)
+
+            # The translation is split into segments at each stop codon. The last segment ends at the end of the
+            # translation.
+            aa_starts = np.concatenate(([0], stops + 1))
+            aa_ends = np.append(stops, translation_length)
+
+            long_enough = aa_ends - aa_starts >= MIN_ORF_LENGTH
+
+            if not long_enough.any():
+                continue
+
+            protein = translation.tobytes().decode()
+
+            for aa_start, aa_end in zip(aa_starts[long_enough].tolist(), aa_ends[long_enough].tolist()):
+                if strand == 1:
+                    start = frame + aa_start * 3
+                    end = min(sequence_length, frame + aa_end * 3 + 3)
+                else:
+                    start = sequence_length - frame - aa_end * 3 - 3
+                    end = sequence_length - frame - aa_start * 3
+
+                orfs.append({
+                    "pro": protein[aa_start:aa_end],
+                    "nuc": nuc[start:end],
+                    "frame": frame,
+                    "strand": strand,
+                    "pos": (start, end)
+                })
 
     return orfs
 
 
-async def initialize_ncbi_blast(settings: dict, sequence: str) -> Awaitable[tuple]:
+async def initialize_ncbi_blast(
+        settings: dict,
+        sequence: str,
+        session: aiohttp.ClientSession = None
+) -> Awaitable[tuple]:
     """
     Send a request to NCBI to BLAST the passed sequence. Return the RID and RTOE from the response.
 
@@ -285,6 +314,8 @@ async def initialize_ncbi_blast(settings: dict, sequence: str) -> Awaitable[tupl
 
     :param sequence: the nucleotide sequence to BLAST
 
+    :param session: the client session to make the request with or ``None`` to use a new session
+
     :return: the RID and RTOE for the request
     :rtype:
 
@@ -305,13 +336,16 @@ async def initialize_ncbi_blast(settings: dict, sequence: str) -> Awaitable[tupl
         "QUERY": sequence,
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with virtool.http.proxy.ProxyRequest(settings, session.post, BLAST_URL, params=params, data=data) as resp:
-            if resp.status != 200:
-                raise virtool.errors.NCBIError(f"BLAST request returned status: {resp.status}")
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await initialize_ncbi_blast(settings, sequence, session)
+
+    async with virtool.http.proxy.ProxyRequest(settings, session.post, BLAST_URL, params=params, data=data) as resp:
+        if resp.status != 200:
+            raise virtool.errors.NCBIError(f"BLAST request returned status: {resp.status}")
 
-            # Extract and return the RID and RTOE from the QBlastInfo tag.
-            return extract_blast_info(await resp.text())
+        # Extract and return the RID and RTOE from the QBlastInfo tag.
+        return extract_blast_info(await resp.text())
 
 
 def extract_blast_info(html):
@@ -336,7 +370,7 @@ def extract_blast_info(html):
     return rid, int(rtoe)
 
 
-async def check_rid(settings, rid):
+async def check_rid(settings, rid, session=None):
     """
     Check if the BLAST process identified by the passed RID is ready.
 
@@ -346,6 +380,9 @@ async def check_rid(settings, rid):
     :param settings: the application settings object
     :type settings: :class:`virtool.app_settings.Settings`
 
+    :param session: the client session to make the request with or ``None`` to use a new session
+    :type session: Union[None, :class:`aiohttp.ClientSession`]
+
     :return: ``True`` if ready, ``False`` otherwise
     :rtype: Coroutine[bool]
 
@@ -356,15 +393,18 @@ async def check_rid(settings, rid):
         "FORMAT_OBJECT": "SearchInfo"
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with virtool.http.proxy.ProxyRequest(settings, session.get, BLAST_URL, params=params) as resp:
-            if resp.status != 200:
-                raise virtool.errors.NCBIError(f"RID check request returned status {resp.status}")
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await check_rid(settings, rid, session)
+
+    async with virtool.http.proxy.ProxyRequest(settings, session.get, BLAST_URL, params=params) as resp:
+        if resp.status != 200:
+            raise virtool.errors.NCBIError(f"RID check request returned status {resp.status}")
 
-            return "Status=WAITING" not in await resp.text()
+        return "Status=WAITING" not in await resp.text()
 
 
-async def get_ncbi_blast_result(settings, rid):
+async def get_ncbi_blast_result(settings, rid, session=None):
     params = {
         "CMD": "Get",
         "RID": rid,
@@ -372,9 +412,12 @@ async def get_ncbi_blast_result(settings, rid):
         "FORMAT_OBJECT": "Alignment"
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with virtool.http.proxy.ProxyRequest(settings, session.get, BLAST_URL, params=params) as resp:
-            return parse_blast_content(await resp.read(), rid)
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await get_ncbi_blast_result(settings, rid, session)
+
+    async with virtool.http.proxy.ProxyRequest(settings, session.get, BLAST_URL, params=params) as resp:
+        return parse_blast_content(await resp.read(), rid)
 
 
 def parse_blast_content(content, rid):
@@ -428,47 +471,3 @@ def parse_blast_content(content, rid):
         output["hits"].append(cleaned)
 
     return output
-
-
-async def wait_for_blast_result(db, settings, analysis_id, sequence_index, rid):
-    """
-    Retrieve the Genbank data associated with the given accession and transform it into a Virtool-format sequence
-    document.
-
-    """
-    try:
-        ready = False
-        interval = 3
-
-        while not ready:
-            await asyncio.sleep(interval)
-
-            # Do this before checking RID for more accurate time.
-            last_checked_at = virtool.utils.timestamp()
-
-            ready = await check_rid(settings, rid)
-
-            update = {
-                "interval": interval,
-                "last_checked_at": last_checked_at,
-                "ready": ready,
-                "rid": rid
-            }
-
-            interval += 5
-
-            if update["ready"]:
-                update["result"] = await get_ncbi_blast_result(settings, rid)
-
-            await db.analyses.update_one({"_id": analysis_id, "results.index": sequence_index}, {
-                "$set": {
-                    "results.$.blast": update
-                }
-            })
-    except asyncio.CancelledError:
-        # Remove the BLAST record from the sequence if the server is shutdown.
-        await db.analyses.update_one({"_id": analysis_id, "results.index": sequence_index}, {
-            "$set": {
-                "results.$.blast": None
-            }
-        })
@@ -0,0 +1,262 @@
+"""
+A service that runs BLAST searches at NCBI for NuVs contig sequences.
+
+The service is owned by the application and available as ``app["blast"]``. All requests to NCBI are made through the
+application's pooled HTTP client session.
+
+Outstanding searches are polled by a single scheduler task (:meth:`BLAST.run`) rather than a loop for each contig. Each
+search is checked when it is due and its polling interval is increased after every check, up to
+:data:`MAX_INTERVAL`. The scheduler sleeps until the next search is due or a new search is submitted.
+
+Finished results are cached by a hash of the contig sequence. Submitting a sequence that has a cached result or is
+already being searched never starts another search at NCBI. The database is only written to when the state of a
+search changes: when it is submitted and when its result is ready.
+
+"""
+import asyncio
+import collections
+import hashlib
+import logging
+import zipfile
+
+import aiohttp
+
+import virtool.analyses.db
+import virtool.bio
+import virtool.errors
+import virtool.utils
+
+logger = logging.getLogger(__name__)
+
+#: The number of seconds to wait before checking a new search for the first time.
+INITIAL_INTERVAL = 3
+
+#: The factor the polling interval of a search is multiplied by after each check.
+BACKOFF = 1.5
+
+#: The maximum number of seconds between checks of a search.
+MAX_INTERVAL = 120
+
+#: The maximum number of searches checked at NCBI at the same time.
+MAX_CONCURRENT_CHECKS = 4
+
+#: The number of consecutive failed checks after which a search is abandoned.
+MAX_ERRORS = 5
+
+#: The maximum number of finished results kept in the cache.
+CACHE_SIZE = 500
+
+
+def hash_sequence(sequence: str) -> str:
+    return hashlib.sha1(sequence.upper().encode()).hexdigest()
+
+
+class Search:
+    """
+    An outstanding BLAST search identified by an NCBI request ID (RID).
+
+    """
+
+    __slots__ = ("rid", "key", "targets", "interval", "due", "errors", "last_checked_at")
+
+    def __init__(self, rid: str, key: str, due: float):
+        self.rid = rid
+
+        #: The hash of the sequence being searched.
+        self.key = key
+
+        #: The ``(analysis_id, sequence_index)`` of each NuVs sequence waiting on this search.
+        self.targets = list()
+
+        #: The number of seconds to wait before the next check.
+        self.interval = INITIAL_INTERVAL
+
+        #: The event loop time when the search should next be checked.
+        self.due = due
+
+        #: The number of consecutive checks that have failed.
+        self.errors = 0
+
+        self.last_checked_at = virtool.utils.timestamp()
+
+    @property
+    def data(self) -> dict:
+        """
+        The BLAST data stored for the sequences waiting on the search while it is not ready.
+
+        """
+        return {
+            "rid": self.rid,
+            "interval": self.interval,
+            "ready": False,
+            "last_checked_at": self.last_checked_at
+        }
+
+
+class BLAST:
+    """
+    Submits BLAST searches to NCBI and stores their results in NuVs analysis documents.
+
+    :param db: the application database interface
+    :param settings: the application settings
+    :param session: the HTTP client session to make requests with
+
+    """
+
+    def __init__(self, db, settings: dict, session: aiohttp.ClientSession):
+        self.db = db
+        self.settings = settings
+        self.session = session
+
+        #: Outstanding searches keyed by sequence hash.
+        self.searches = dict()
+
+        #: The BLAST data of finished searches keyed by sequence hash in least-recently-used order.
+        self.cache = collections.OrderedDict()
+
+        self._wakeup = asyncio.Event()
+        self._submit_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+
+    async def submit(self, analysis_id: str, sequence_index: int, sequence: str) -> dict:
+        """
+        BLAST a NuVs contig sequence and attach the BLAST data to it. The data are updated when the search is complete.
+
+        A new search is only started at NCBI if the sequence has no cached result and is not already being searched.
+
+        :param analysis_id: the ID of the NuVs analysis
+        :param sequence_index: the index of the sequence in the analysis
+        :param sequence: the contig sequence
+        :return: the BLAST data attached to the sequence
+
+        """
+        key = hash_sequence(sequence)
+
+        # Only one search is started at a time so that the same sequence is never submitted twice.
+        async with self._submit_lock:
+            data = self.cache.get(key)
+
+            if data is not None:
+                self.cache.move_to_end(key)
+            else:
+                search = self.searches.get(key)
+
+                if search is None:
+                    rid, _ = await virtool.bio.initialize_ncbi_blast(self.settings, sequence, self.session)
+
+                    search = Search(rid, key, asyncio.get_event_loop().time() + INITIAL_INTERVAL)
+
+                    self.searches[key] = search
+                    self._wakeup.set()
+
+                search.targets.append((analysis_id, sequence_index))
+
+                data = search.data
+
+        await virtool.analyses.db.update_nuvs_blast(self.db, analysis_id, sequence_index, data)
+
+        return data
+
+    async def run(self):
+        """
+        Check outstanding searches as they become due until cancelled. When cancelled, the BLAST data is removed from
+        the sequences waiting on searches that are not complete.
+
+        """
+        loop = asyncio.get_event_loop()
+
+        try:
+            while True:
+                now = loop.time()
+
+                due = [search for search in self.searches.values() if search.due <= now]
+
+                if due:
+                    await asyncio.gather(*[self._check(search) for search in due])
+                    continue
+
+                self._wakeup.clear()
+
+                timeout = None
+
+                if self.searches:
+                    timeout = min(search.due for search in self.searches.values()) - now
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        except asyncio.CancelledError:
+            await self._remove_outstanding()
+
+    async def _check(self, search: Search):
+        """
+        Check if ``search`` is ready and store its result if it is. Only finished searches are written to the database.
+
+        """
+        async with self._semaphore:
+            last_checked_at = virtool.utils.timestamp()
+
+            try:
+                ready = await virtool.bio.check_rid(self.settings, search.rid, self.session)
+
+                if ready:
+                    result = await virtool.bio.get_ncbi_blast_result(self.settings, search.rid, self.session)
+
+            except (
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                virtool.errors.NCBIError,
+                zipfile.BadZipFile,
+                KeyError,
+                ValueError
+            ) as err:
+                search.errors += 1
+
+                logger.warning(f"Could not check BLAST {search.rid} ({search.errors}/{MAX_ERRORS}): {err}")
+
+                if search.errors >= MAX_ERRORS:
+                    del self.searches[search.key]
+                    await self._update_targets(search, None)
+                    return
+
+                ready = False
+            else:
+                search.errors = 0
+
+            search.last_checked_at = last_checked_at
+
+            if not ready:
+                search.interval = min(round(search.interval * BACKOFF), MAX_INTERVAL)
+                search.due = asyncio.get_event_loop().time() + search.interval
+                return
+
+            data = {
+                "rid": search.rid,
+                "interval": search.interval,
+                "ready": True,
+                "last_checked_at": last_checked_at,
+                "result": result
+            }
+
+            del self.searches[search.key]
+
+            self.cache[search.key] = data
+
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+            await self._update_targets(search, data)
+
+    async def _update_targets(self, search: Search, data):
+        for analysis_id, sequence_index in search.targets:
+            await virtool.analyses.db.update_nuvs_blast(self.db, analysis_id, sequence_index, data)
+
+    async def _remove_outstanding(self):
+        searches = list(self.searches.values())
+
+        self.searches.clear()
+
+        for search in searches:
+            await self._update_targets(search, None)
@@ -278,6 +278,14 @@ def get_from_args():
         help="disable the job manager"
     )
 
+    parser.add_argument(
+        "--external-jobs",
+        action="store_true",
+        default=False,
+        dest="external_jobs",
+        help="run jobs on standalone job runners instead of the server"
+    )
+
     parser.add_argument(
         "--no-refreshing",
         action="store_true",
@@ -248,6 +248,8 @@ class DB:
             projection=virtool.jobs.db.PROJECTION,
             processor=virtool.jobs.db.processor
         )
+        self.job_leases = self.bind_collection("job_leases", silent=True)
+        self.job_messages = self.bind_collection("job_messages", silent=True)
         self.keys = self.bind_collection("keys", silent=True)
         self.kinds = self.bind_collection("kinds", silent=True)
         self.otus = self.bind_collection("otus", projection=virtool.otus.db.PROJECTION)
@@ -7,6 +7,7 @@ import pymongo.errors
 import virtool.analyses.db
 import virtool.analyses.migrate
 import virtool.history.db
+import virtool.jobs.classes
 import virtool.jobs.db
 import virtool.otus.db
 import virtool.references.db
@@ -82,7 +83,10 @@ async def migrate_jobs(app):
     logger.info(" • jobs")
     motor_client = app["db"].motor_client
 
-    await virtool.jobs.db.delete_zombies(motor_client)
+    resumable_tasks = virtool.jobs.classes.RESUMABLE_TASKS
+
+    await virtool.jobs.db.requeue_zombies(motor_client, resumable_tasks)
+    await virtool.jobs.db.delete_zombies(motor_client, resumable_tasks, app["settings"]["external_jobs"])
 
 
 async def migrate_samples(app):
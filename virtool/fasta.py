@@ -0,0 +1,553 @@
+"""
+Fast reading of large FASTA files.
+
+FASTA data is read as :class:`bytes` in large blocks of complete lines and is never decoded. Header lines are found
+by searching each block and the sequence lines between them are compacted into a single byte string per block with
+:meth:`bytes.translate`, so multi-line sequences are joined without handling each line in Python. Plain and
+gzip-compressed files are both supported. Compression is detected from the magic bytes at the start of the file (see
+:func:`virtool.utils.open_binary`).
+
+Use :func:`read_records` to iterate through records one at a time, :func:`read_headers` to read only the header lines,
+and :func:`read_batches` to get a :class:`Batch` of complete records at a time for vectorized processing. Consumers
+that only need the bases, such as base counters, can use :func:`read_chunks` to avoid assembling long sequences.
+
+Plain FASTA files can also be read in random-access mode using :class:`IndexedFasta`. The index uses the same format as
+``samtools faidx``, so existing ``.fai`` files can be used.
+
+"""
+import os
+
+import numpy as np
+
+import virtool.utils
+
+#: The maximum number of bytes read from a FASTA file at once.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+HEADER = ord(">")
+NEWLINE = ord("\n")
+
+
+#: The bytes that are removed from sequence lines. These are the ASCII control characters and the space.
+WHITESPACE = bytes(range(ord(" ") + 1))
+
+
+class Batch:
+    """
+    A batch of complete FASTA records read by :func:`read_batches`.
+
+    All of the sequences in a batch are stored in one byte string with line breaks and other whitespace removed. The
+    sequence of record ``i`` is ``data[offsets[i]:offsets[i + 1]]``.
+
+    """
+
+    __slots__ = ("headers", "data", "offsets")
+
+    def __init__(self, headers: list, data: bytes, offsets):
+        #: The header of each record without the ``>`` or trailing whitespace.
+        self.headers = headers
+
+        #: The concatenated sequences of all records in the batch.
+        self.data = data
+
+        #: The start offset of each sequence in :attr:`data` followed by the end offset of the last sequence.
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.headers)
+
+    @property
+    def lengths(self):
+        """
+        The length of each sequence as a NumPy array.
+
+        """
+        return np.diff(self.offsets)
+
+    def sequences(self) -> list:
+        data = self.data
+        offsets = self.offsets.tolist()
+
+        return [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def read_blocks(handle, block_size: int = BLOCK_SIZE):
+    """
+    Read blocks of complete lines from a binary file object. A newline is added to a final line without one.
+
+    :param handle: a binary file object
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of blocks
+
+    """
+    read = getattr(handle, "read1", handle.read)
+
+    remainder = b""
+
+    while True:
+        block = read(block_size)
+
+        if not block:
+            break
+
+        end = block.rfind(b"\n") + 1
+
+        if not end:
+            remainder += block
+            continue
+
+        yield b"".join((remainder, memoryview(block)[:end]))
+
+        remainder = block[end:]
+
+    if remainder:
+        yield remainder + b"\n"
+
+
+def find_headers(block: bytes) -> list:
+    """
+    Find the header lines in a block of complete FASTA lines. Headers are found by searching the block for a newline
+    followed by ``>``, so the time taken depends on the number of records rather than the number of lines.
+
+    :param block: a block of complete FASTA lines
+    :return: the start offset of each header line and the offset of the newline that ends it
+
+    """
+    spans = list()
+
+    if block.startswith(b">"):
+        start = 0
+    else:
+        start = block.find(b"\n>") + 1
+
+        if not start:
+            return spans
+
+    while True:
+        end = block.index(b"\n", start)
+        spans.append((start, end))
+
+        start = block.find(b"\n>", end) + 1
+
+        if not start:
+            return spans
+
+
+def compact_block(block: bytes, spans: list):
+    """
+    Remove the header lines and all whitespace from a block of complete FASTA lines.
+
+    :param block: a block of complete FASTA lines
+    :param spans: the header line spans found in the block by :func:`find_headers`
+    :return: the compacted sequence data and the offset in it where the sequence following each header starts
+
+    """
+    chunks = list()
+    positions = list()
+
+    length = 0
+    start = 0
+
+    for header_start, header_end in spans:
+        chunk = block[start:header_start].translate(None, WHITESPACE)
+        chunks.append(chunk)
+
+        length += len(chunk)
+        positions.append(length)
+
+        start = header_end + 1
+
+    chunks.append(block[start:].translate(None, WHITESPACE))
+
+    return b"".join(chunks), np.array(positions, dtype=np.int64)
+
+
+def check_leading_data(block: bytes):
+    """
+    Raise a :class:`ValueError` for the first non-blank line before the first header in a block.
+
+    """
+    for line in block.split(b"\n"):
+        if line.startswith(b">"):
+            return
+
+        if line.strip():
+            raise ValueError(f"Illegal FASTA line: {line.decode(errors='replace')}")
+
+
+def read_chunks(path: str, block_size: int = BLOCK_SIZE):
+    """
+    Read the sequence data in the plain or gzip-compressed FASTA file at ``path`` one block at a time without
+    assembling records. Memory use is bounded by the block size no matter how long the sequences are.
+
+    Each chunk contains the headers that start in a block, the compacted sequence data from the block (see
+    :func:`compact_block`), and the offset in the data where the sequence following each header starts. Data before
+    the first offset belongs to the last header of a previous chunk.
+
+    A :class:`ValueError` is raised if the file contains sequence data before the first header.
+
+    :param path: the path to the FASTA file
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of ``(headers, data, positions)`` tuples
+
+    """
+    seen_header = False
+
+    with virtool.utils.open_binary(path) as f:
+        for block in read_blocks(f, block_size):
+            spans = find_headers(block)
+
+            data, positions = compact_block(block, spans)
+
+            if not seen_header and (positions[0] if spans else len(data)):
+                check_leading_data(block)
+
+            seen_header = seen_header or bool(spans)
+
+            yield [block[start + 1:end].rstrip() for start, end in spans], data, positions
+
+
+def read_batches(path: str, block_size: int = BLOCK_SIZE):
+    """
+    Read the plain or gzip-compressed FASTA file at ``path`` in batches of complete records. A batch is produced for
+    each block that completes at least one record. Records that are longer than a block are accumulated until they are
+    complete.
+
+    Whitespace is removed from sequences. A :class:`ValueError` is raised if the file contains sequence data before the
+    first header.
+
+    :param path: the path to the FASTA file
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of :class:`Batch` objects
+
+    """
+    # The header and sequence chunks of the record that is not complete yet.
+    header = None
+    chunks = list()
+
+    for headers, data, positions in read_chunks(path, block_size):
+        if not headers:
+            chunks.append(data)
+            continue
+
+        first = int(positions[0])
+
+        batch_headers = headers[:-1]
+        offsets = positions[:-1] - first
+
+        if header is not None:
+            chunks.append(data[:first])
+            length = sum(len(chunk) for chunk in chunks)
+
+            batch_headers = [header] + batch_headers
+            offsets = np.concatenate(([0], offsets + length))
+
+            batch_data = b"".join(chunks + [data[first:positions[-1]]])
+        else:
+            batch_data = data[first:positions[-1]]
+
+        header = headers[-1]
+        chunks = [data[positions[-1]:]]
+
+        if batch_headers:
+            yield Batch(batch_headers, batch_data, np.append(offsets, len(batch_data)).astype(np.int64))
+
+    if header is not None:
+        data = b"".join(chunks)
+        yield Batch([header], data, np.array([0, len(data)], dtype=np.int64))
+
+
+def read_records(path: str, block_size: int = BLOCK_SIZE):
+    """
+    Iterate through the records in the plain or gzip-compressed FASTA file at ``path``.
+
+    :param path: the path to the FASTA file
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of ``(header, sequence)`` tuples of bytes with the ``>`` removed from the header
+
+    """
+    for batch in read_batches(path, block_size):
+        yield from zip(batch.headers, batch.sequences())
+
+
+def read_headers(path: str, block_size: int = BLOCK_SIZE):
+    """
+    Iterate through the headers in the plain or gzip-compressed FASTA file at ``path`` without collecting sequences.
+
+    :param path: the path to the FASTA file
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of headers as bytes with the ``>`` removed
+
+    """
+    with virtool.utils.open_binary(path) as f:
+        for block in read_blocks(f, block_size):
+            yield from (block[start + 1:end].rstrip() for start, end in find_headers(block))
+
+
+class IndexEntry:
+    """
+    The location of a sequence in a FASTA file. The fields match the columns of a ``samtools faidx`` index.
+
+    """
+
+    __slots__ = ("name", "length", "offset", "line_bases", "line_width")
+
+    def __init__(self, name: str, length: int, offset: int, line_bases: int, line_width: int):
+        self.name = name
+        self.length = length
+
+        #: The offset in the file of the first base of the sequence.
+        self.offset = offset
+
+        #: The number of bases in each full line of the sequence.
+        self.line_bases = line_bases
+
+        #: The number of bytes in each full line of the sequence, including the line ending.
+        self.line_width = line_width
+
+    def __eq__(self, other):
+        return isinstance(other, IndexEntry) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __repr__(self):
+        return "IndexEntry({})".format(", ".join(repr(getattr(self, k)) for k in self.__slots__))
+
+    def get_file_offset(self, position: int) -> int:
+        """
+        Get the offset in the file of the base at ``position`` in the sequence.
+
+        """
+        if not self.line_bases:
+            return self.offset
+
+        return self.offset + (position // self.line_bases) * self.line_width + position % self.line_bases
+
+
+class Lines:
+    """
+    The lines in a block of complete FASTA lines. Used to check line lengths when building an index.
+
+    """
+
+    __slots__ = ("array", "starts", "ends", "is_header")
+
+    def __init__(self, block: bytes):
+        self.array = np.frombuffer(block, dtype=np.uint8)
+
+        newlines = np.flatnonzero(self.array == NEWLINE)
+
+        #: The offset of the first byte of each line.
+        self.starts = np.concatenate(([0], newlines[:-1] + 1)).astype(np.int64)
+
+        #: The offset of the newline at the end of each line.
+        self.ends = newlines
+
+        self.is_header = self.array[self.starts] == HEADER
+
+    def headers(self, block: bytes) -> list:
+        """
+        Get the header of each header line in the block without the ``>`` or trailing whitespace.
+
+        """
+        starts = self.starts[self.is_header].tolist()
+        ends = self.ends[self.is_header].tolist()
+
+        return [block[start + 1:end].rstrip() for start, end in zip(starts, ends)]
+
+
+def build_index(path: str, block_size: int = BLOCK_SIZE) -> list:
+    """
+    Build a ``samtools faidx``-compatible index for the plain FASTA file at ``path``.
+
+    Every line of a sequence except the last must have the same length. Blank lines are only allowed at the end of a
+    sequence. A :class:`ValueError` is raised if the file is compressed or does not meet these requirements.
+
+    :param path: the path to the FASTA file
+    :param block_size: the maximum number of bytes to read at once
+    :return: a list of :class:`IndexEntry` objects in file order
+
+    """
+    with open(path, "rb") as f:
+        if f.read(len(virtool.utils.GZIP_MAGIC)) == virtool.utils.GZIP_MAGIC:
+            raise ValueError("Cannot index a compressed FASTA file")
+
+    entries = list()
+
+    # The entry being built and whether a line shorter than a full line has been seen in its sequence.
+    entry = None
+    ended = False
+
+    block_offset = 0
+
+    with open(path, "rb") as f:
+        for block in read_blocks(f, block_size):
+            lines = Lines(block)
+
+            array = lines.array
+
+            widths = lines.ends - lines.starts + 1
+            bases = widths - 1 - (array[np.maximum(lines.ends - 1, 0)] == ord("\r")) * (widths > 1)
+
+            header_indexes = np.flatnonzero(lines.is_header).tolist()
+
+            # The boundaries of the runs of sequence lines in the block. The first run belongs to the entry carried
+            # over from the previous block.
+            boundaries = [-1] + header_indexes + [len(lines.starts)]
+
+            headers = lines.headers(block)
+
+            for i, (run_start, run_end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+                if i:
+                    name = headers[i - 1].split(None, 1)[0].decode() if headers[i - 1] else ""
+
+                    entry = IndexEntry(name, 0, block_offset + int(lines.ends[run_start]) + 1, 0, 0)
+                    entries.append(entry)
+                    ended = False
+
+                run_bases = bases[run_start + 1:run_end]
+                run_widths = widths[run_start + 1:run_end]
+
+                if not len(run_bases):
+                    continue
+
+                nonempty = run_bases > 0
+
+                if entry is None:
+                    if nonempty.any():
+                        raise ValueError("Sequence data found before first header")
+                    continue
+
+                if ended and nonempty.any():
+                    raise ValueError(f"Different line length in sequence: {entry.name}")
+
+                if not entry.line_width:
+                    entry.line_bases = int(run_bases[0])
+                    entry.line_width = int(run_widths[0])
+
+                entry.length += int(run_bases.sum())
+
+                irregular = (run_bases != entry.line_bases) | (run_widths != entry.line_width)
+
+                if irregular.any():
+                    first = int(irregular.argmax())
+
+                    if nonempty[first + 1:].any() or run_bases[first] > entry.line_bases:
+                        raise ValueError(f"Different line length in sequence: {entry.name}")
+
+                    ended = True
+
+            block_offset += len(block)
+
+    return entries
+
+
+def write_index(path: str, entries: list):
+    """
+    Write index entries to ``path`` in the ``samtools faidx`` format.
+
+    """
+    with open(path, "w") as f:
+        for entry in entries:
+            f.write(f"{entry.name}\t{entry.length}\t{entry.offset}\t{entry.line_bases}\t{entry.line_width}\n")
+
+
+def read_index(path: str) -> list:
+    """
+    Read index entries from a ``samtools faidx`` index file at ``path``.
+
+    """
+    entries = list()
+
+    with open(path, "r") as f:
+        for line in f:
+            name, length, offset, line_bases, line_width = line.rstrip("\n").split("\t")[:5]
+            entries.append(IndexEntry(name, int(length), int(offset), int(line_bases), int(line_width)))
+
+    return entries
+
+
+class IndexedFasta:
+    """
+    Random access to the sequences in a plain FASTA file.
+
+    The index is read from ``<path>.fai`` if it exists and is newer than the FASTA file. Otherwise, it is built with
+    :func:`build_index` and saved there if possible. Sequences are identified by the part of their header before the
+    first whitespace.
+
+    Use as a context manager:
+
+    .. code-block:: python
+
+        with virtool.fasta.IndexedFasta(path) as fasta:
+            sequence = fasta.fetch("NC_001836", 100, 200)
+
+    :param path: the path to the FASTA file
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        index_path = f"{path}.fai"
+
+        try:
+            if os.path.getmtime(index_path) < os.path.getmtime(path):
+                raise FileNotFoundError(index_path)
+
+            entries = read_index(index_path)
+        except FileNotFoundError:
+            entries = build_index(path)
+
+            try:
+                write_index(index_path, entries)
+            except OSError:
+                pass
+
+        self.entries = {entry.name: entry for entry in entries}
+
+        self._handle = open(path, "rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def names(self) -> list:
+        return list(self.entries)
+
+    def fetch(self, name: str, start: int = 0, end: int = None) -> bytes:
+        """
+        Get all or part of the sequence called ``name``. Positions are zero-based and ``end`` is exclusive, as in a
+        Python slice. A :class:`KeyError` is raised if there is no sequence called ``name``.
+
+        :param name: the name of the sequence
+        :param start: the position of the first base to get
+        :param end: the position after the last base to get or ``None`` to get the rest of the sequence
+        :return: the bases as bytes without line endings
+
+        """
+        entry = self.entries[name]
+
+        start = min(max(start, 0), entry.length)
+        end = entry.length if end is None else min(max(end, start), entry.length)
+
+        if start == end:
+            return b""
+
+        file_start = entry.get_file_offset(start)
+
+        self._handle.seek(file_start)
+
+        data = self._handle.read(entry.get_file_offset(end - 1) + 1 - file_start)
+
+        return data.replace(b"\n", b"").replace(b"\r", b"")
+
+    def close(self):
+        self._handle.close()
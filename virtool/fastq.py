@@ -0,0 +1,415 @@
+"""
+Fast, low-memory reading and processing of large FASTQ files.
+
+Plain and gzip-compressed files are both supported. Compression is detected from the magic bytes at the start of the
+file (see :func:`virtool.utils.open_binary`).
+
+Use :func:`read_records` to iterate through records one at a time and :func:`read_headers` to read only the header
+lines. Code that works on many records at once should use :func:`read_batches` instead. It reads FASTQ data as
+:class:`bytes` in large blocks of complete four-line records that are never decoded. The offsets of the lines in each
+block are found with NumPy and returned as a :class:`Batch`, so the records in a block can be inspected and selected
+all at once without creating an object for each field.
+
+Read names are compared using 64-bit hashes of their roots, the part of the header line before the first space. Hashes
+take a fraction of the memory of the names themselves, so the roots of every read in a large library can be kept in
+memory as a sorted NumPy array.
+
+"""
+import io
+import multiprocessing
+
+import numpy as np
+
+import virtool.utils
+
+#: The maximum number of bytes read from a FASTQ file at once.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+#: Masks that keep the first ``i`` bytes of a little-endian 64-bit word.
+WORD_MASKS = np.array([(1 << (8 * i)) - 1 for i in range(9)], dtype=np.uint64)
+
+AT = ord("@")
+CARRIAGE_RETURN = ord("\r")
+NEWLINE = ord("\n")
+PLUS = ord("+")
+SPACE = ord(" ")
+
+
+class Batch:
+    """
+    The records in a block of complete FASTQ records.
+
+    Records are stored as line offsets in the original block, so they can be inspected as NumPy arrays without slicing
+    out the individual fields. Line endings are not included in the fields.
+
+    """
+
+    __slots__ = ("data", "header_spans", "sequence_spans", "quality_spans")
+
+    def __init__(self, data: bytes, newlines=None):
+        array = np.frombuffer(data, dtype=np.uint8)
+
+        starts, header_ends = get_record_offsets(data, newlines)
+
+        if newlines is None:
+            newlines = np.flatnonzero(array == NEWLINE)
+
+        # Exclude the carriage return from lines with Windows line endings.
+        ends = newlines - (array[np.maximum(newlines - 1, 0)] == CARRIAGE_RETURN)
+
+        #: The block of FASTQ records.
+        self.data = data
+
+        #: The start and end offsets of each header, including the ``@``.
+        self.header_spans = np.column_stack((starts, ends[0::4]))
+
+        #: The start and end offsets of each sequence.
+        self.sequence_spans = np.column_stack((newlines[0::4] + 1, ends[1::4]))
+
+        #: The start and end offsets of each quality string.
+        self.quality_spans = np.column_stack((newlines[2::4] + 1, ends[3::4]))
+
+    def __len__(self):
+        return len(self.header_spans)
+
+    @property
+    def lengths(self):
+        """
+        The length of each sequence as a NumPy array.
+
+        """
+        return self.sequence_spans[:, 1] - self.sequence_spans[:, 0]
+
+    def headers(self) -> list:
+        return slice_spans(self.data, self.header_spans)
+
+    def sequences(self) -> list:
+        return slice_spans(self.data, self.sequence_spans)
+
+    def qualities(self) -> list:
+        return slice_spans(self.data, self.quality_spans)
+
+
+def slice_spans(data: bytes, spans) -> list:
+    return [data[start:end] for start, end in spans.tolist()]
+
+
+def read_blocks(handle, block_size: int = BLOCK_SIZE):
+    """
+    Read blocks of complete four-line records from a binary FASTQ file object. A final record without a trailing
+    newline is completed. Blank lines at the end of the file are ignored.
+
+    :param handle: a binary file object
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of blocks
+
+    """
+    for block, _ in read_indexed_blocks(handle, block_size):
+        yield block
+
+
+def read_indexed_blocks(handle, block_size: int = BLOCK_SIZE):
+    """
+    Like :func:`read_blocks`, but also yield the offsets of the newlines in each block as a NumPy array.
+
+    """
+    read = getattr(handle, "read1", handle.read)
+
+    remainder = b""
+
+    while True:
+        block = read(block_size)
+
+        if not block:
+            break
+
+        if remainder:
+            block = remainder + block
+
+        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == NEWLINE)
+
+        complete = len(newlines) - len(newlines) % 4
+
+        if not complete:
+            remainder = block
+            continue
+
+        end = newlines[complete - 1] + 1
+
+        yield block[:end], newlines[:complete]
+
+        remainder = block[end:]
+
+    remainder = remainder.rstrip(b"\r\n")
+
+    if remainder:
+        remainder += b"\n"
+
+        newlines = np.flatnonzero(np.frombuffer(remainder, dtype=np.uint8) == NEWLINE)
+
+        if len(newlines) % 4:
+            raise ValueError("Truncated FASTQ record")
+
+        yield remainder, newlines
+
+
+def get_record_offsets(block: bytes, newlines=None):
+    """
+    Find the start offset of each record in a block of complete FASTQ records and the offset of the newline ending each
+    record's header line.
+
+    :param block: a block of complete FASTQ records
+    :param newlines: the offsets of the newlines in the block if they are already known
+    :return: the record start offsets and header line end offsets as NumPy arrays
+
+    """
+    array = np.frombuffer(block, dtype=np.uint8)
+
+    if newlines is None:
+        newlines = np.flatnonzero(array == NEWLINE)
+
+    header_ends = newlines[0::4]
+    starts = np.concatenate(([0], newlines[3::4][:-1] + 1)).astype(np.int64)
+
+    if len(starts):
+        if (array[starts] != AT).any():
+            raise ValueError("FASTQ record does not start with '@'")
+
+        if (array[newlines[1::4] + 1] != PLUS).any():
+            raise ValueError("FASTQ record has no '+' separator line")
+
+    return starts, header_ends
+
+
+def read_batches(path: str, block_size: int = BLOCK_SIZE):
+    """
+    Read the plain or gzip-compressed FASTQ file at ``path`` in batches of records.
+
+    :param path: the path to the FASTQ file
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of :class:`Batch` objects
+
+    """
+    with virtool.utils.open_binary(path) as f:
+        for block, newlines in read_indexed_blocks(f, block_size):
+            yield Batch(block, newlines)
+
+
+def iter_records(handle):
+    """
+    Iterate through the records in a text or binary FASTQ file object. Records are taken four lines at a time
+    directly from the file object, which is faster than any other way of producing an object for each field. Trailing
+    whitespace is removed from each field. A final incomplete record is ignored.
+
+    A :class:`ValueError` is raised if a record does not start with ``@`` or has no ``+`` separator line.
+
+    :param handle: a text or binary file object
+    :return: a generator of ``(header, sequence, quality)`` tuples with the ``@`` kept in the header
+
+    """
+    at, plus = ("@", "+") if isinstance(handle, io.TextIOBase) else (b"@", b"+")
+
+    for header, sequence, separator, quality in zip(handle, handle, handle, handle):
+        if header[:1] != at or separator[:1] != plus:
+            raise ValueError("Invalid FASTQ record: {}".format(header.rstrip()))
+
+        yield header.rstrip(), sequence.rstrip(), quality.rstrip()
+
+
+def iter_headers(handle):
+    """
+    Like :func:`iter_records`, but only yield the header of each record. Sequence and quality lines are skipped without
+    being stripped.
+
+    """
+    at, plus = ("@", "+") if isinstance(handle, io.TextIOBase) else (b"@", b"+")
+
+    for header, _, separator, _ in zip(handle, handle, handle, handle):
+        if header[:1] != at or separator[:1] != plus:
+            raise ValueError("Invalid FASTQ record: {}".format(header.rstrip()))
+
+        yield header.rstrip()
+
+
+def read_records(path: str):
+    """
+    Iterate through the records in the plain or gzip-compressed FASTQ file at ``path``. See :func:`iter_records`.
+
+    :param path: the path to the FASTQ file
+    :return: a generator of ``(header, sequence, quality)`` tuples of bytes
+
+    """
+    with virtool.utils.open_binary(path) as f:
+        yield from iter_records(f)
+
+
+def read_headers(path: str):
+    """
+    Iterate through the headers of the records in the plain or gzip-compressed FASTQ file at ``path``. See
+    :func:`iter_headers`.
+
+    :param path: the path to the FASTQ file
+    :return: a generator of headers as bytes
+
+    """
+    with virtool.utils.open_binary(path) as f:
+        yield from iter_headers(f)
+
+
+def mix(hashes):
+    """
+    Mix the high bits of each hash in a ``uint64`` array into its low bits.
+
+    """
+    return hashes ^ (hashes >> np.uint64(32))
+
+
+def hash_roots(block: bytes, newlines=None):
+    """
+    Hash the root of the header of every record in a block of complete FASTQ records. The root is the part of the
+    header before the first space.
+
+    All headers in the block are copied into a zero-padded matrix with one row per record. Root hashes are calculated
+    for all rows at once by folding each eight-byte column of the matrix into the hash with an FNV-1a-style
+    xor-multiply step.
+
+    :param block: a block of complete FASTQ records
+    :param newlines: the offsets of the newlines in the block if they are already known
+    :return: the record start offsets and a ``uint64`` array of root hashes
+
+    """
+    starts, header_ends = get_record_offsets(block, newlines)
+
+    hashes = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+
+    if not len(starts):
+        return starts, hashes
+
+    header_lengths = header_ends - starts
+
+    # Round the width of the matrix up to a whole number of eight-byte words.
+    width = -(-int(header_lengths.max()) // 8) * 8
+
+    # Pad the block so that a full-width row can be taken at every offset. Copying whole rows from a strided view of
+    # the block is much faster than gathering every byte individually.
+    array = np.zeros(len(block) + width, dtype=np.uint8)
+    array[:len(block)] = np.frombuffer(block, dtype=np.uint8)
+
+    rows = np.lib.stride_tricks.as_strided(array, shape=(len(block) + 1, width), strides=(1, 1), writeable=False)
+
+    headers = rows[starts]
+
+    spaces = headers == SPACE
+
+    # The first space in each row ends the root if it is in the header line.
+    first_spaces = spaces.argmax(axis=1)
+    has_space = spaces[np.arange(len(starts)), first_spaces] & (first_spaces < header_lengths)
+
+    root_lengths = np.where(has_space, first_spaces, header_lengths)
+
+    words = headers.view("<u8")
+
+    # Integer overflow is the intended modulo 2^64 behaviour.
+    with np.errstate(over="ignore"):
+        for column in range(-(-int(root_lengths.max()) // 8)):
+            # Clear the bytes of each word that come after the end of the root.
+            masks = WORD_MASKS[np.clip(root_lengths - column * 8, 0, 8)]
+            hashes = mix((hashes ^ (words[:, column] & masks)) * FNV_PRIME)
+
+        hashes = mix((hashes ^ root_lengths.astype(np.uint64)) * FNV_PRIME)
+
+    return starts, hashes
+
+
+def read_root_hashes(path: str):
+    """
+    Get the sorted, unique hashes of the read name roots in the FASTQ file at ``path``.
+
+    :param path: the path to a plain or gzip-compressed FASTQ file
+    :return: a sorted ``uint64`` array
+
+    """
+    hashes = list()
+
+    with virtool.utils.open_binary(path) as f:
+        for block, newlines in read_indexed_blocks(f):
+            hashes.append(np.unique(hash_roots(block, newlines)[1]))
+
+    if not hashes:
+        return np.zeros(0, dtype=np.uint64)
+
+    return np.unique(np.concatenate(hashes))
+
+
+def filter_by_roots(path: str, output_path: str, roots) -> int:
+    """
+    Write the records in the FASTQ file at ``path`` whose read name roots are in ``roots`` to ``output_path``. Records
+    are copied unchanged and in their original order.
+
+    :param path: the path to a plain or gzip-compressed FASTQ file
+    :param output_path: the path to write the selected records to
+    :param roots: a sorted ``uint64`` array of root hashes from :func:`read_root_hashes`
+    :return: the number of records written
+
+    """
+    count = 0
+
+    with virtool.utils.open_binary(path) as f, open(output_path, "wb") as output:
+        for block, newlines in read_indexed_blocks(f):
+            starts, hashes = hash_roots(block, newlines)
+
+            if len(roots):
+                found = roots[np.minimum(np.searchsorted(roots, hashes), len(roots) - 1)] == hashes
+            else:
+                found = np.zeros(len(hashes), dtype=bool)
+
+            ends = np.append(starts[1:], len(block))
+
+            view = memoryview(block)
+
+            output.write(b"".join(view[start:end] for start, end in zip(starts[found].tolist(), ends[found].tolist())))
+
+            count += int(found.sum())
+
+    return count
+
+
+# The root hashes shared with pairing worker processes. Set by :func:`init_pair_worker`.
+_roots = None
+
+
+def init_pair_worker(roots):
+    global _roots
+    _roots = roots
+
+
+def pair_worker(path: str, output_path: str) -> int:
+    return filter_by_roots(path, output_path, _roots)
+
+
+def reunite_pairs(unmapped_path: str, read_paths: list, output_paths: list, proc: int = 1) -> list:
+    """
+    Write the mates of the reads in ``unmapped_path`` from each of the paired FASTQ files in ``read_paths`` to the
+    matching path in ``output_paths``. A read is written when the root of its name matches the root of any read in
+    ``unmapped_path``.
+
+    Each input file is read once. When ``proc`` is greater than one, the files are processed in parallel in forked
+    worker processes that share the root hashes.
+
+    :param unmapped_path: the path to the FASTQ file of unmapped reads
+    :param read_paths: the paths to the paired FASTQ files
+    :param output_paths: the paths to write the paired, unmapped reads to
+    :param proc: the number of processes to use
+    :return: the number of reads written to each output path
+
+    """
+    roots = read_root_hashes(unmapped_path)
+
+    if proc < 2:
+        return [filter_by_roots(path, output_path, roots) for path, output_path in zip(read_paths, output_paths)]
+
+    with multiprocessing.get_context("fork").Pool(min(proc, len(read_paths)), init_pair_worker, (roots,)) as pool:
+        return pool.starmap(pair_worker, zip(read_paths, output_paths))
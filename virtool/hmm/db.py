@@ -3,6 +3,7 @@ import json
 import logging
 import os
 import shutil
+import subprocess
 
 import aiofiles
 import aiohttp.client_exceptions
@@ -219,7 +220,7 @@ async def install(app, process_id, release, user_id):
 
         - downloads the official profiles.hmm.gz file
         - decompresses the vthmm.tar.gz file
-        - moves the file to the correct data path
+        - moves the file to the correct data path and presses it with ``hmmpress``
         - downloads the official annotations.json.gz file
         - imports the annotations into the database
 
@@ -298,9 +299,9 @@ async def install(app, process_id, release, user_id):
 
         decompressed_path = os.path.join(temp_path, "hmm")
 
-        install_path = os.path.join(app["settings"]["data_path"], "hmm", "profiles.hmm")
+        hmm_path = os.path.join(app["settings"]["data_path"], "hmm")
 
-        await app["run_in_thread"](shutil.move, os.path.join(decompressed_path, "profiles.hmm"), install_path)
+        await app["run_in_thread"](install_profiles, os.path.join(decompressed_path, "profiles.hmm"), hmm_path)
 
         await virtool.processes.db.update(
             db,
@@ -351,6 +352,29 @@ async def install(app, process_id, release, user_id):
         logger.debug("Finished HMM install process")
 
 
+def install_profiles(path: str, hmm_path: str):
+    """
+    Move the profile HMM file at ``path`` into the HMM data directory and press it for use by NuVs jobs.
+
+    The file is replaced and pressed while holding an exclusive lock, so running ``hmmscan`` processes are never exposed
+    to a partially pressed set of files. If ``hmmpress`` fails, the profiles are left unstamped and are pressed by the
+    next NuVs job instead.
+
+    :param path: the path to the new ``profiles.hmm`` file
+    :param hmm_path: the HMM data directory
+
+    """
+    os.makedirs(hmm_path, exist_ok=True)
+
+    with virtool.hmm.utils.lock_profiles(hmm_path, exclusive=True):
+        shutil.move(path, os.path.join(hmm_path, virtool.hmm.utils.PROFILES_FILENAME))
+
+        try:
+            virtool.hmm.utils.press_profiles(hmm_path)
+        except (OSError, subprocess.CalledProcessError) as err:
+            logger.warning(f"Could not press HMM profiles: {err}")
+
+
 async def purge(db, settings: dict):
     """
     Delete HMMs that are not used in analyses. Set `hidden` flag on used HMM documents.
@@ -1,6 +1,26 @@
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
 import semver
 import virtool.github
 
+#: The name of the profile HMM file in the HMM data directory.
+PROFILES_FILENAME = "profiles.hmm"
+
+#: The name of the file describing the ``profiles.hmm`` file the pressed files were generated from.
+STAMP_FILENAME = "profiles.stamp"
+
+#: The name of the file used to coordinate access to the profiles between the server and NuVs jobs.
+LOCK_FILENAME = "profiles.lock"
+
+#: The suffixes of the files written by ``hmmpress``.
+PRESSED_SUFFIXES = (".h3f", ".h3i", ".h3m", ".h3p")
+
 
 def format_hmm_release(updated, release, installed):
     # The release dict will only be replaced if there is a 200 response from GitHub. A 304 indicates the release
@@ -18,3 +38,106 @@ def format_hmm_release(updated, release, installed):
     )
 
     return formatted
+
+
+def get_profiles_stamp(hmm_path: str) -> dict:
+    """
+    Get a stamp identifying the current version of the ``profiles.hmm`` file in ``hmm_path``. The stamp changes
+    whenever the file is replaced or modified.
+
+    :param hmm_path: the HMM data directory
+    :return: the stamp
+
+    """
+    stat = os.stat(os.path.join(hmm_path, PROFILES_FILENAME))
+
+    return {
+        "inode": stat.st_ino,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size
+    }
+
+
+def check_pressed(hmm_path: str) -> bool:
+    """
+    Check if ``profiles.hmm`` in ``hmm_path`` has been pressed and the pressed files are up-to-date.
+
+    :param hmm_path: the HMM data directory
+    :return: ``True`` if the pressed files can be used with ``hmmscan``
+
+    """
+    profiles_path = os.path.join(hmm_path, PROFILES_FILENAME)
+
+    if not all(os.path.isfile(profiles_path + suffix) for suffix in PRESSED_SUFFIXES):
+        return False
+
+    try:
+        with open(os.path.join(hmm_path, STAMP_FILENAME), "r") as f:
+            stamp = json.load(f)
+
+        return stamp == get_profiles_stamp(hmm_path)
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+@contextlib.contextmanager
+def lock_profiles(hmm_path: str, exclusive: bool = False):
+    """
+    Lock the profiles in ``hmm_path`` for reading or, if ``exclusive`` is ``True``, for writing. Any number of
+    processes can hold a read lock at the same time.
+
+    :param hmm_path: the HMM data directory
+    :param exclusive: take an exclusive lock for replacing or pressing the profiles
+
+    """
+    with open(os.path.join(hmm_path, LOCK_FILENAME), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run_command(command: list):
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def press_profiles(hmm_path: str, run=run_command):
+    """
+    Press ``profiles.hmm`` in ``hmm_path`` with ``hmmpress`` and write a stamp recording the version of the file that
+    was pressed. The caller must hold an exclusive lock from :func:`lock_profiles`.
+
+    The pressed files are written to a temporary directory and moved into place when ``hmmpress`` succeeds. The old
+    stamp is removed first so the profiles are considered unpressed if pressing fails.
+
+    :param hmm_path: the HMM data directory
+    :param run: a function that runs a command given as a list of arguments and raises an exception if it fails
+
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(hmm_path, STAMP_FILENAME))
+
+    profiles_path = os.path.join(hmm_path, PROFILES_FILENAME)
+
+    stamp = get_profiles_stamp(hmm_path)
+
+    with tempfile.TemporaryDirectory(dir=hmm_path) as tempdir:
+        temp_profiles_path = os.path.join(tempdir, PROFILES_FILENAME)
+
+        try:
+            os.link(profiles_path, temp_profiles_path)
+        except OSError:
+            shutil.copyfile(profiles_path, temp_profiles_path)
+
+        run(["hmmpress", temp_profiles_path])
+
+        for suffix in PRESSED_SUFFIXES:
+            os.replace(temp_profiles_path + suffix, profiles_path + suffix)
+
+    stamp_path = os.path.join(hmm_path, STAMP_FILENAME)
+
+    with open(f"{stamp_path}.tmp", "w") as f:
+        json.dump(stamp, f)
+
+    os.replace(f"{stamp_path}.tmp", stamp_path)
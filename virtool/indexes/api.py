@@ -105,7 +105,7 @@ async def create(req):
 
     ref_id = req.match_info["ref_id"]
 
-    reference = await db.references.find_one(ref_id, ["groups", "users"])
+    reference = await db.references.find_one(ref_id, ["build_isolate_index", "groups", "users"])
 
     if reference is None:
         return not_found()
@@ -139,6 +139,7 @@ async def create(req):
         "manifest": manifest,
         "ready": False,
         "has_files": True,
+        "isolate_index": None,
         "job": {
             "id": job_id
         },
@@ -167,7 +168,8 @@ async def create(req):
         "user_id": user_id,
         "index_id": index_id,
         "index_version": index_version,
-        "manifest": manifest
+        "manifest": manifest,
+        "build_isolate_index": reference.get("build_isolate_index", False)
     }
 
     # Create job document.
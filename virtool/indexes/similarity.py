@@ -0,0 +1,315 @@
+"""
+A local sequence-similarity index for reference sequences.
+
+The index is a sketch of every sequence in a reference index built from its minimizers: the smallest hashed canonical
+k-mer in each window of :data:`WINDOW` consecutive k-mers. Sequences that share a large proportion of their minimizers
+are similar, so a query can be compared with every reference sequence at once by looking up its minimizers.
+
+The index is stored in the ``similarity`` directory of a reference index as NumPy arrays sorted by minimizer hash, with
+the index of the reference sequence each hash came from stored alongside it. These arrays are memory-mapped when the
+index is loaded, so the server only pages in the parts of the index that are searched.
+
+Searches take milliseconds, so they can be used to find likely matches for NuVs contigs before or instead of running a
+BLAST at NCBI. The identity of the query to each match is estimated from the proportion of the query's minimizers
+found in the match as in Mash (Ondov et al., 2016).
+
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+#: The length of the k-mers that minimizers are chosen from.
+K = 15
+
+#: The number of consecutive k-mers each minimizer is chosen from.
+WINDOW = 10
+
+#: The code for bases other than A, C, G, T, and U.
+INVALID_CODE = 4
+
+#: The 2-bit code of each byte value. Other bytes get :data:`INVALID_CODE`.
+CODES = np.full(256, INVALID_CODE, dtype=np.uint8)
+CODES[list(b"AaCcGgTtUu")] = [0, 0, 1, 1, 2, 2, 3, 3, 3, 3]
+
+#: The hash used for k-mers that contain invalid bases. It is never chosen as a minimizer unless a window contains no
+#: valid k-mers.
+MAX_HASH = np.uint64(0xffffffffffffffff)
+
+SEQUENCES_FILENAME = "sequences.json"
+HASHES_FILENAME = "hashes.npy"
+TARGETS_FILENAME = "targets.npy"
+
+
+def mix(values):
+    """
+    Scramble the bits of each value in a ``uint64`` array using the MurmurHash3 finalizer. Minimizers are chosen from
+    hashed k-mers so that they are not biased towards k-mers that sort first, such as poly-A runs.
+
+    """
+    values = values.copy()
+
+    # Integer overflow is the intended modulo 2^64 behaviour.
+    with np.errstate(over="ignore"):
+        values ^= values >> np.uint64(33)
+        values *= np.uint64(0xff51afd7ed558ccd)
+        values ^= values >> np.uint64(33)
+        values *= np.uint64(0xc4ceb9fe1a85ec53)
+        values ^= values >> np.uint64(33)
+
+    return values
+
+
+def get_kmer_hashes(sequence: bytes, k: int = K):
+    """
+    Get the hash of every canonical k-mer in ``sequence``. The canonical form of a k-mer is the smaller of its 2-bit
+    encoding and the encoding of its reverse complement, so a sequence and its reverse complement have the same hashes.
+
+    K-mers containing bases other than A, C, G, T, and U get :data:`MAX_HASH`.
+
+    :param sequence: the sequence to hash
+    :param k: the k-mer length
+    :return: a ``uint64`` array with one hash per k-mer
+
+    """
+    codes = CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+    count = len(codes) - k + 1
+
+    if count < 1:
+        return np.zeros(0, dtype=np.uint64)
+
+    invalid = codes == INVALID_CODE
+
+    # The number of invalid bases before each position.
+    invalid_before = np.concatenate(([0], np.cumsum(invalid)))
+
+    codes = np.where(invalid, 0, codes).astype(np.uint64)
+
+    forward = np.zeros(count, dtype=np.uint64)
+    reverse = np.zeros(count, dtype=np.uint64)
+
+    # Build the encoding of all k-mers one base position at a time. The complement of a 2-bit base code is 3 - code.
+    for i in range(k):
+        window = codes[i:i + count]
+        forward = (forward << np.uint64(2)) | window
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * i)
+
+    hashes = mix(np.minimum(forward, reverse))
+
+    hashes[invalid_before[k:] - invalid_before[:count] > 0] = MAX_HASH
+
+    return hashes
+
+
+def get_minimizers(sequence: bytes, k: int = K, window: int = WINDOW):
+    """
+    Get the distinct minimizers of ``sequence``. Sequences shorter than a full window have the smallest hash of all
+    their k-mers as their only minimizer.
+
+    :param sequence: the sequence to sketch
+    :param k: the k-mer length
+    :param window: the number of consecutive k-mers each minimizer is chosen from
+    :return: a sorted ``uint64`` array of minimizer hashes
+
+    """
+    hashes = get_kmer_hashes(sequence, k)
+
+    if not len(hashes):
+        return hashes
+
+    window = min(window, len(hashes))
+
+    windows = np.lib.stride_tricks.as_strided(
+        hashes,
+        shape=(len(hashes) - window + 1, window),
+        strides=(hashes.strides[0], hashes.strides[0]),
+        writeable=False
+    )
+
+    minimizers = np.unique(windows.min(axis=1))
+
+    return minimizers[minimizers != MAX_HASH]
+
+
+def hash_sequence(sequence: str) -> str:
+    return hashlib.sha1(sequence.encode()).hexdigest()
+
+
+def read_sketches(path: str) -> dict:
+    """
+    Read the minimizers of every sequence in the similarity index at ``path``. Used to reuse the sketches of unchanged
+    sequences when a new index is built for the same reference.
+
+    An empty dictionary is returned if there is no index at ``path`` or it was built with different parameters.
+
+    :param path: the path to a similarity index directory
+    :return: the minimizers of each sequence keyed by the hash of the sequence
+
+    """
+    try:
+        with open(os.path.join(path, SEQUENCES_FILENAME), "r") as f:
+            metadata = json.load(f)
+
+        hashes = np.load(os.path.join(path, HASHES_FILENAME))
+        targets = np.load(os.path.join(path, TARGETS_FILENAME))
+    except (FileNotFoundError, ValueError):
+        return dict()
+
+    if metadata["k"] != K or metadata["window"] != WINDOW:
+        return dict()
+
+    # Group the hashes by sequence. The hashes of each sequence stay sorted because the sort is stable.
+    order = np.argsort(targets, kind="mergesort")
+    counts = np.bincount(targets, minlength=len(metadata["sequences"]))
+
+    groups = np.split(hashes[order], np.cumsum(counts)[:-1])
+
+    return {sequence["hash"]: group for sequence, group in zip(metadata["sequences"], groups)}
+
+
+def build(path: str, sequences: list, previous_path: str = None) -> int:
+    """
+    Build a similarity index at ``path`` for ``sequences``.
+
+    Building is incremental. Sequences that are unchanged from the index at ``previous_path`` reuse their minimizers
+    from that index instead of being sketched again. The index is written to a temporary directory and moved to
+    ``path`` when complete, replacing any existing index.
+
+    :param path: the path of the directory to build the index in
+    :param sequences: a list of ``(sequence_id, otu_id, sequence)`` tuples
+    :param previous_path: the path to an earlier similarity index for the same reference
+    :return: the number of sequences sketched rather than reused
+
+    """
+    previous = read_sketches(previous_path) if previous_path else dict()
+
+    metadata = list()
+    sketches = list()
+
+    sketched = 0
+
+    for sequence_id, otu_id, sequence in sequences:
+        sequence_hash = hash_sequence(sequence)
+
+        sketch = previous.get(sequence_hash)
+
+        if sketch is None:
+            sketch = get_minimizers(sequence.encode())
+            sketched += 1
+
+        metadata.append({
+            "id": sequence_id,
+            "otu_id": otu_id,
+            "length": len(sequence),
+            "hash": sequence_hash,
+            "count": len(sketch)
+        })
+
+        sketches.append(sketch)
+
+    hashes = np.concatenate(sketches) if sketches else np.zeros(0, dtype=np.uint64)
+    targets = np.repeat(np.arange(len(sketches), dtype=np.uint32), [len(sketch) for sketch in sketches])
+
+    order = np.argsort(hashes, kind="mergesort")
+
+    tmp_path = f"{path}.tmp"
+
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, HASHES_FILENAME), hashes[order])
+    np.save(os.path.join(tmp_path, TARGETS_FILENAME), targets[order])
+
+    with open(os.path.join(tmp_path, SEQUENCES_FILENAME), "w") as f:
+        json.dump({"k": K, "window": WINDOW, "sequences": metadata}, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+
+    return sketched
+
+
+class SimilarityIndex:
+    """
+    A similarity index loaded from the directory at ``path``. The hash and target arrays are memory-mapped.
+
+    :param path: the path to the similarity index directory
+
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, SEQUENCES_FILENAME), "r") as f:
+            metadata = json.load(f)
+
+        self.k = metadata["k"]
+        self.window = metadata["window"]
+
+        self.sequences = metadata["sequences"]
+
+        #: The minimizer hashes of all sequences in ascending order.
+        self.hashes = np.load(os.path.join(path, HASHES_FILENAME), mmap_mode="r")
+
+        #: The index in :attr:`sequences` of the sequence each hash in :attr:`hashes` belongs to.
+        self.targets = np.load(os.path.join(path, TARGETS_FILENAME), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def search(self, sequence: str, limit: int = 10) -> list:
+        """
+        Find the reference sequences that share the most minimizers with ``sequence``.
+
+        Each match includes the proportion of the query's minimizers found in the reference sequence (``containment``)
+        and an estimate of the identity of the query to the reference sequence derived from it.
+
+        :param sequence: the query sequence
+        :param limit: the maximum number of matches to return
+        :return: a list of matches sorted by decreasing number of shared minimizers
+
+        """
+        query = get_minimizers(sequence.encode(), self.k, self.window)
+
+        if not len(query) or not len(self.sequences):
+            return list()
+
+        starts = np.searchsorted(self.hashes, query, "left")
+        counts = np.searchsorted(self.hashes, query, "right") - starts
+
+        # Gather the positions of all hashes matching any query minimizer without looping over the query.
+        total = int(counts.sum())
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+
+        shared = np.bincount(self.targets[offsets], minlength=len(self.sequences))
+
+        top = np.argsort(-shared, kind="mergesort")[:limit]
+        top = top[shared[top] > 0]
+
+        matches = list()
+
+        for index, count in zip(top.tolist(), shared[top].tolist()):
+            containment = count / len(query)
+
+            matches.append({
+                "sequence_id": self.sequences[index]["id"],
+                "otu_id": self.sequences[index]["otu_id"],
+                "length": self.sequences[index]["length"],
+                "shared": count,
+                "containment": round(containment, 4),
+                "identity": round(containment ** (1 / self.k), 4)
+            })
+
+        return matches
+
+
+@functools.lru_cache(maxsize=16)
+def load(path: str) -> SimilarityIndex:
+    """
+    Load the similarity index at ``path``. Loaded indexes are cached. Index directories are never modified after they
+    are built, so a cached index is always current.
+
+    """
+    return SimilarityIndex(path)
@@ -28,7 +28,15 @@ class Job(virtool.jobs.job.Job):
     - calculating the sample read count
     - constructing paths used by all subclasses
 
+    Of the stages shared by analysis jobs, only :meth:`make_analysis_dir` is skipped when an interrupted analysis is
+    resumed. Preparing reads from a ready cache is quick, so :meth:`prepare_reads` and :meth:`prepare_qc` are always
+    run again.
+
     """
+    checkpoints = {
+        "make_analysis_dir": ["{analysis_path}"]
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -79,7 +87,10 @@ class Job(virtool.jobs.job.Job):
             )
         })
 
-        index_document = self.db.indexes.find_one(self.task_args["index_id"], ["manifest", "sequence_otu_map"])
+        index_document = self.db.indexes.find_one(
+            self.task_args["index_id"],
+            ["isolate_index", "manifest", "sequence_otu_map"]
+        )
 
         sequence_otu_map = index_document.get("sequence_otu_map", None)
 
@@ -87,6 +98,7 @@ class Job(virtool.jobs.job.Job):
             sequence_otu_map = get_sequence_otu_map(self.db, index_document["manifest"])
 
         self.params.update({
+            "isolate_index": index_document.get("isolate_index"),
             "manifest": index_document["manifest"],
             "sequence_otu_map": sequence_otu_map
         })
@@ -96,7 +108,7 @@ class Job(virtool.jobs.job.Job):
         Make a directory for the analysis in the sample/analysis directory.
 
         """
-        os.mkdir(self.params["analysis_path"])
+        os.makedirs(self.params["analysis_path"], exist_ok=True)
 
     def prepare_reads(self):
         """
@@ -250,18 +262,7 @@ class Job(virtool.jobs.job.Job):
         self.dispatch("caches", "update", [cache_id])
 
     def cleanup(self):
-        cache_id = self.intermediate.get("cache_id", None)
-
-        if cache_id:
-            cache = self.db.caches.find_one(cache_id, ["ready"])
-
-            if not cache.get("ready"):
-                self.db.caches.delete_one({"_id": cache_id})
-                cache_path = virtool.jobs.utils.join_cache_path(self.settings, cache_id)
-                try:
-                    virtool.utils.rm(cache_path, recursive=True)
-                except FileNotFoundError:
-                    pass
+        self.remove_unready_cache()
 
         self.db.analyses.delete_one({"_id": self.params["analysis_id"]})
 
@@ -276,6 +277,28 @@ class Job(virtool.jobs.job.Job):
 
         self.dispatch("samples", "update", [sample_id])
 
+    def cleanup_interrupted(self):
+        """
+        Remove a cache that was still being created when the job was interrupted. Reads are trimmed again when the job
+        is resumed.
+
+        """
+        self.remove_unready_cache()
+
+    def remove_unready_cache(self):
+        cache_id = self.intermediate.get("cache_id", None)
+
+        if cache_id:
+            cache = self.db.caches.find_one(cache_id, ["ready"])
+
+            if cache and not cache.get("ready"):
+                self.db.caches.delete_one({"_id": cache_id})
+                cache_path = virtool.jobs.utils.join_cache_path(self.settings, cache_id)
+                try:
+                    virtool.utils.rm(cache_path, recursive=True)
+                except FileNotFoundError:
+                    pass
+
 
 def get_sequence_otu_map(db, manifest):
     sequence_otu_map = dict()
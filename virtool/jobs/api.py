@@ -38,6 +38,18 @@ async def find(req):
     return json_response(data)
 
 
+@routes.get("/api/jobs/metrics")
+async def get_metrics(req):
+    """
+    Get metrics describing the flow of messages from running jobs to clients.
+
+    """
+    if "jobs" not in req.app:
+        return not_found("Job manager not running")
+
+    return json_response(req.app["jobs"].metrics)
+
+
 @routes.get("/api/jobs/{job_id}")
 async def get(req):
     """
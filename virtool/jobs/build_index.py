@@ -1,7 +1,11 @@
+import json
 import os
 
+import pymongo
+
 import virtool.history.db
 import virtool.indexes.db
+import virtool.indexes.similarity
 import virtool.otus.db
 import virtool.db.sync
 import virtool.errors
@@ -23,7 +27,9 @@ class Job(virtool.jobs.job.Job):
         self._stage_list = [
             self.mk_index_dir,
             self.write_fasta,
+            self.build_similarity_index,
             self.bowtie_build,
+            self.build_isolate_index,
             self.replace_old
         ]
 
@@ -62,6 +68,7 @@ class Job(virtool.jobs.job.Job):
 
         """
         fasta_dict = dict()
+        isolate_fasta_dict = dict()
         sequence_otu_map = dict()
 
         for patch_id, patch_version in self.params["manifest"].items():
@@ -75,6 +82,7 @@ class Job(virtool.jobs.job.Job):
             for isolate in joined["isolates"]:
                 for sequence in isolate["sequences"]:
                     sequence_otu_map[sequence["_id"]] = patch_id
+                    isolate_fasta_dict[sequence["_id"]] = sequence["sequence"]
 
             # Extract the list of sequences from the joined patched patch.
             sequences = virtool.otus.utils.extract_default_sequences(joined)
@@ -93,6 +101,19 @@ class Job(virtool.jobs.job.Job):
 
         write_fasta_dict_to_file(fasta_path, fasta_dict)
 
+        if self.params.get("build_isolate_index", False):
+            write_fasta_dict_to_file(os.path.join(self.params["index_path"], "isolates.fa"), isolate_fasta_dict)
+
+            isolate_lengths = {sequence_id: len(sequence) for sequence_id, sequence in isolate_fasta_dict.items()}
+
+            with open(os.path.join(self.params["index_path"], "isolate_lengths.json"), "w") as f:
+                json.dump(isolate_lengths, f)
+
+        self.intermediate["sequences"] = [
+            (sequence_id, sequence_otu_map[sequence_id], sequence)
+            for sequence_id, sequence in isolate_fasta_dict.items()
+        ]
+
         index_id = self.params["index_id"]
 
         self.db.indexes.update_one({"_id": index_id}, {
@@ -103,6 +124,30 @@ class Job(virtool.jobs.job.Job):
 
         self.dispatch("indexes", "update", [index_id])
 
+    def build_similarity_index(self):
+        """
+        Build a local similarity index of every isolate sequence in the reference (see
+        :mod:`virtool.indexes.similarity`). Sketches of sequences that are unchanged since the current index of the
+        reference are reused.
+
+        """
+        previous = self.db.indexes.find_one(
+            {"reference.id": self.params["ref_id"], "ready": True},
+            sort=[("version", pymongo.DESCENDING)],
+            projection=["_id"]
+        )
+
+        previous_path = None
+
+        if previous:
+            previous_path = os.path.join(self.params["reference_path"], previous["_id"], "similarity")
+
+        virtool.indexes.similarity.build(
+            os.path.join(self.params["index_path"], "similarity"),
+            self.intermediate.pop("sequences"),
+            previous_path
+        )
+
     def bowtie_build(self):
         """
         Run a standard bowtie-build process using the previously generated FASTA reference.
@@ -119,6 +164,49 @@ class Job(virtool.jobs.job.Job):
 
         self.run_subprocess(command)
 
+    def build_isolate_index(self):
+        """
+        Build a Bowtie2 index of every isolate sequence in the reference if the reference is configured to do so. The
+        root name for the index is 'isolates'.
+
+        Pathoscope analyses that use this index can skip mapping to the default isolates and building an isolate index
+        for each sample. The disk space used by the index is recorded in the index document.
+
+        """
+        if not self.params.get("build_isolate_index", False):
+            return
+
+        fasta_path = os.path.join(self.params["index_path"], "isolates.fa")
+
+        command = [
+            "bowtie2-build",
+            "-f",
+            "--threads", str(self.proc),
+            fasta_path,
+            os.path.join(self.params["index_path"], "isolates")
+        ]
+
+        self.run_subprocess(command)
+
+        # The FASTA file is not needed once the index is built.
+        os.remove(fasta_path)
+
+        with open(os.path.join(self.params["index_path"], "isolate_lengths.json"), "r") as f:
+            sequence_count = len(json.load(f))
+
+        index_id = self.params["index_id"]
+
+        self.db.indexes.update_one({"_id": index_id}, {
+            "$set": {
+                "isolate_index": {
+                    "sequence_count": sequence_count,
+                    "size": get_isolate_index_size(self.params["index_path"])
+                }
+            }
+        })
+
+        self.dispatch("indexes", "update", [index_id])
+
     def replace_old(self):
         """
         Replaces the old index with the newly generated one.
@@ -239,6 +327,20 @@ def remove_unused_index_files(base_path, retained):
                 pass
 
 
+def get_isolate_index_size(index_path: str) -> int:
+    """
+    Get the total size in bytes of the all-isolates index files in ``index_path``.
+
+    """
+    size = 0
+
+    for filename in os.listdir(index_path):
+        if filename.startswith("isolate"):
+            size += os.path.getsize(os.path.join(index_path, filename))
+
+    return size
+
+
 def write_fasta_dict_to_file(path, fasta_dict):
     with open(path, "w") as handle:
         for sequence_id, sequence in fasta_dict.items():
@@ -14,3 +14,7 @@ TASK_CLASSES = {
     "pathoscope_bowtie": virtool.jobs.pathoscope.Job,
     "update_sample": virtool.jobs.update_sample.Job
 }
+
+#: The names of tasks whose jobs can be resumed after they are interrupted. See
+#: :attr:`virtool.jobs.job.Job.checkpoints`.
+RESUMABLE_TASKS = [task_name for task_name, cls in TASK_CLASSES.items() if cls.checkpoints]
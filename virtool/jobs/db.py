@@ -93,8 +93,23 @@ async def create(db, settings, task_name, task_args, user_id, job_id=None):
     return await db.jobs.insert_one(document)
 
 
-async def delete_zombies(db):
-    await db.jobs.delete_many({
+async def delete_zombies(db, resumable_tasks=None, external=False):
+    """
+    Delete jobs that were waiting or running when the server stopped.
+
+    Jobs for ``resumable_tasks`` are kept so that they can be resumed (see :func:`requeue_zombies`). Jobs leased by
+    standalone job runners are still running and are not deleted. When jobs are run by standalone job runners,
+    waiting jobs are also kept because runners claim them from the database.
+
+    :param db: the application database client
+    :param resumable_tasks: the names of tasks whose jobs can be resumed
+    :param external: jobs are run by standalone job runners
+
+    """
+    query = {
+        "_id": {
+            "$nin": await db.job_leases.distinct("_id")
+        },
         "status.state": {
             "$nin": [
                 "complete",
@@ -102,7 +117,109 @@ async def delete_zombies(db):
                 "error"
             ]
         }
-    })
+    }
+
+    if resumable_tasks:
+        query["task"] = {
+            "$nin": resumable_tasks
+        }
+
+    if external:
+        cursor = db.jobs.find(query, ["status"])
+
+        query = {
+            "_id": {
+                "$in": [d["_id"] async for d in cursor if d["status"][-1]["state"] != "waiting"]
+            }
+        }
+
+    await db.jobs.delete_many(query)
+
+
+async def requeue_zombies(db, resumable_tasks: list) -> list:
+    """
+    Put jobs for ``resumable_tasks`` that were running when the server stopped back into the waiting state. They are
+    resumed from their checkpoints when they are started again. Jobs leased by standalone job runners are still
+    running and are left alone.
+
+    :param db: the application database client
+    :param resumable_tasks: the names of tasks whose jobs can be resumed
+    :return: the IDs of the requeued jobs
+
+    """
+    cursor = db.jobs.find({
+        "_id": {
+            "$nin": await db.job_leases.distinct("_id")
+        },
+        "task": {
+            "$in": resumable_tasks
+        },
+        "status.state": {
+            "$nin": [
+                "complete",
+                "cancelled",
+                "error"
+            ]
+        }
+    }, ["status"])
+
+    requeued = list()
+
+    async for document in cursor:
+        latest = document["status"][-1]
+
+        if latest["state"] != "running":
+            continue
+
+        await db.jobs.update_one({"_id": document["_id"]}, {
+            "$push": {
+                "status": {
+                    "state": "waiting",
+                    "stage": latest["stage"],
+                    "error": None,
+                    "progress": latest["progress"],
+                    "timestamp": virtool.utils.timestamp()
+                }
+            }
+        })
+
+        requeued.append(document["_id"])
+
+    return requeued
+
+
+async def get_waiting_ids(db) -> list:
+    """
+    Get the IDs of jobs that are waiting to be started in the order they were created.
+
+    :param db: the application database interface
+    :return: a list of job IDs
+
+    """
+    cursor = db.jobs.aggregate([
+        {"$project": {
+            "created_at": {
+                "$arrayElemAt": ["$status.timestamp", 0]
+            },
+            "status": {
+                "$arrayElemAt": ["$status", -1]
+            }
+        }},
+
+        {"$match": {
+            "status.state": "waiting"
+        }},
+
+        {"$sort": {
+            "created_at": 1
+        }},
+
+        {"$project": {
+            "_id": True
+        }}
+    ])
+
+    return [a["_id"] async for a in cursor]
 
 
 async def get_waiting_and_running_ids(db):
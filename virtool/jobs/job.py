@@ -5,11 +5,12 @@ Classes, exceptions, and utilities for creating Virtool jobs.
 import io
 import multiprocessing
 import os
-import queue
+import pickle
+import selectors
 import signal
 import subprocess
 import sys
-import threading
+import time
 import traceback
 from typing import Optional
 
@@ -18,6 +19,12 @@ import pymongo
 import virtool.jobs.db
 import virtool.utils
 
+#: The maximum number of bytes read from a subprocess pipe at once.
+PIPE_BLOCK_SIZE = 1024 * 1024
+
+#: The number of seconds to wait for pipe output before checking if a subprocess has exited.
+PIPE_POLL_INTERVAL = 1.0
+
 
 class Job(multiprocessing.Process):
     """
@@ -31,6 +38,14 @@ class Job(multiprocessing.Process):
 
     """
 
+    #: Stages that do not have to be run again when an interrupted job is resumed, keyed by stage method name. Each
+    #: value is a list of paths to the files and directories the stage produces. Paths are formatted with
+    #: :attr:`params`, so ``"{analysis_path}/assembly.fa"`` is a valid path.
+    #:
+    #: Stages that are not declared here are always run again. Jobs that declare no stages are cancelled when they are
+    #: interrupted instead of being resumed.
+    checkpoints = dict()
+
     def __init__(self, db_connection_string: str, db_name: str, settings: dict, job_id: str, q):
         super().__init__()
 
@@ -97,6 +112,9 @@ class Job(multiprocessing.Process):
         self._stage_list = None
         self._log_path = os.path.join(self.settings["data_path"], "logs", "jobs", self.id)
         self._log_buffer = list()
+        self._checkpoint_path = os.path.join(self.settings["data_path"], "jobs", f"{self.id}.checkpoint")
+        self._checkpoint = list()
+        self._initial_params = None
 
     def init_db(self):
         """
@@ -134,9 +152,15 @@ class Job(multiprocessing.Process):
         """
         The main job execution method. Methods in :attr:`.Job.stage_list` are executed sequentially.
 
+        A checkpoint is saved after each stage (see :meth:`.save_checkpoint`). If the job was interrupted before, stages
+        that were completed and declared in :attr:`.checkpoints` are skipped (see :meth:`.load_checkpoint`).
+
         If ``SIGTERM`` is received, execution of stage methods is stopped and the job is put into the `cancelled` state
         by calling :meth:`.add_status`.
 
+        If ``SIGUSR1`` is received, execution of stage methods is stopped, :meth:`.cleanup_interrupted` is called, and
+        the job is put back into the `waiting` state so it can be resumed from its checkpoint.
+
         If an error is encountered in a stage method or a subprocess, execution of stage methods is stopped. The error
         is recorded in :attr:`.Job._error` and the job is put into the `error` state by calling :meth:`.add_status`.
 
@@ -153,20 +177,41 @@ class Job(multiprocessing.Process):
         # When the manager terminates jobs, run the handle_sigterm method.
         signal.signal(signal.SIGTERM, handle_sigterm)
 
+        # When the manager interrupts jobs on shutdown, stop them so they can be resumed. Jobs that cannot be resumed
+        # are cancelled.
+        signal.signal(signal.SIGUSR1, handle_sigusr1 if self.checkpoints else handle_sigterm)
+
         self.init_db()
         self.check_db()
 
+        skipped = self.load_checkpoint()
+
         try:
             for method in self._stage_list:
                 name = method.__name__
 
+                if name in skipped:
+                    self.restore_checkpoint(skipped[name])
+                    self.add_log(f"Stage: {name} (completed before interruption)")
+                    continue
+
                 self.add_status(stage=name, state="running")
                 self.add_log(f"Stage: {name}")
 
                 method()
 
+                self.save_checkpoint(name)
+
             self._progress = 1
             self.add_status(state="complete")
+            self.remove_checkpoint()
+
+        except InterruptionError:
+            if self._process:
+                self._process.kill()
+
+            self.cleanup_interrupted()
+            self.add_status(state="waiting")
 
         except TerminationError:
             self.add_status(state="cancelled")
@@ -175,6 +220,7 @@ class Job(multiprocessing.Process):
                 self._process.kill()
 
             self.cleanup()
+            self.remove_checkpoint()
 
         except:
             self._error = handle_exception()
@@ -184,24 +230,161 @@ class Job(multiprocessing.Process):
                 self._process.kill()
 
             self.cleanup()
+            self.remove_checkpoint()
 
         self.flush_log()
 
-    def run_subprocess(self, command: list, stdout_handler=None, stderr_handler=None, env: Optional[dict] = None):
+    def interrupt(self):
+        """
+        Stop the job so that it can be resumed later by sending ``SIGUSR1`` to the job process. Jobs that declare no
+        :attr:`.checkpoints` are cancelled.
+
+        """
+        try:
+            os.kill(self.pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+
+    def save_checkpoint(self, stage: str):
+        """
+        Record that ``stage`` is complete in the job's checkpoint file.
+
+        For stages declared in :attr:`.checkpoints`, the size and modification time of each artifact and a copy of
+        the :attr:`.params` changed since :meth:`.check_db`, :attr:`.intermediate`, and :attr:`.results` are saved.
+        Artifacts that do not exist when the stage completes are not recorded. The file is replaced atomically, so an
+        interruption while saving leaves the previous checkpoint intact.
+
+        :param stage: the name of the completed stage
+
+        """
+        if not self.checkpoints:
+            return
+
+        record = {
+            "stage": stage,
+            "artifacts": None,
+            "state": None
+        }
+
+        if stage in self.checkpoints:
+            paths = [template.format(**self.params) for template in self.checkpoints[stage]]
+
+            record["artifacts"] = get_fingerprints([path for path in paths if os.path.exists(path)])
+
+            initial = self._initial_params
+
+            changed = {key: value for key, value in self.params.items() if key not in initial or initial[key] != value}
+
+            record["state"] = pickle.dumps({
+                "params": changed,
+                "intermediate": self.intermediate,
+                "results": self.results
+            })
+
+        self._checkpoint.append(record)
+
+        os.makedirs(os.path.dirname(self._checkpoint_path), exist_ok=True)
+
+        tmp_path = f"{self._checkpoint_path}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self._checkpoint, f)
+
+        os.replace(tmp_path, self._checkpoint_path)
+
+    def load_checkpoint(self) -> dict:
+        """
+        Read the job's checkpoint file and find the stages that do not have to be run again.
+
+        Completed stages are walked in order. A stage declared in :attr:`.checkpoints` is skipped if its artifacts are
+        unchanged. Other completed stages are run again. The job continues from the first stage that was not completed
+        or whose artifacts have changed.
+
+        :return: the checkpoint records of the stages to skip keyed by stage name
+
+        """
+        if not self.checkpoints:
+            return dict()
+
+        self._initial_params = dict(self.params)
+
+        try:
+            with open(self._checkpoint_path, "rb") as f:
+                records = pickle.load(f)
+        except FileNotFoundError:
+            return dict()
+        except Exception:
+            self.add_log("Could not read checkpoint. Starting from first stage.")
+            return dict()
+
+        skipped = dict()
+
+        for method, record in zip(self._stage_list, records):
+            name = method.__name__
+
+            if record["stage"] != name:
+                break
+
+            if name in self.checkpoints:
+                if not check_fingerprints(record["artifacts"]):
+                    break
+
+                skipped[name] = record
+
+        if skipped:
+            self.add_log(f"Resuming job. Skipping stages: {', '.join(skipped)}")
+
+        return skipped
+
+    def restore_checkpoint(self, record: dict):
+        """
+        Restore the state saved in ``record`` when its stage was completed and record the stage as complete again.
+
+        :param record: a checkpoint record returned in :meth:`.load_checkpoint`
+
+        """
+        state = pickle.loads(record["state"])
+
+        self.params.update(state["params"])
+        self.intermediate = state["intermediate"]
+        self.results = state["results"]
+
+        self._checkpoint.append(record)
+
+    def remove_checkpoint(self):
+        try:
+            os.remove(self._checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    def run_subprocess(self, command: list, stdout_handler=None, stderr_handler=None, env: Optional[dict] = None,
+                       stdout_filter=None):
         """
         A utility method for running a the passed `subprocess` command.
 
-        It takes care of running a command and handling STDOUT and STDERR.
+        It takes care of running a command and handling STDOUT and STDERR. Output is read from both pipes as it becomes
+        available using :func:`watch_pipes`, so waiting on the subprocess does not use any CPU time. Handlers are called
+        with one line at a time as :class:`bytes`, including the trailing newline.
+
+        Alternatively, a ``stdout_filter`` can be passed to consume all of STDOUT in a separate process. This is useful
+        when a command produces output faster than it can be handled line-by-line in the job process. The filter is
+        called with the STDOUT pipe as a binary file object and its return value is returned by this method. See
+        :mod:`virtool.sam` for filters.
 
         :param command: the command to run in a subprocess
         :param stdout_handler: a function for handling STDOUT lines
         :param stderr_handler: a function for handling STDERR lines
         :param env: environmental variables to
-        :return:
+        :param stdout_filter: a function that consumes STDOUT in a separate process
+        :return: the return value of ``stdout_filter`` if one was passed
+
         """
+        if stdout_handler and stdout_filter:
+            raise ValueError("Cannot use stdout_handler and stdout_filter together")
+
         self.add_log(f"Command: {' '.join(command)}")
 
-        if stdout_handler:
+        if stdout_handler or stdout_filter:
             stdout = subprocess.PIPE
         else:
             stdout = subprocess.DEVNULL
@@ -216,51 +399,80 @@ class Job(multiprocessing.Process):
 
         self._process = subprocess.Popen(command, stdout=stdout, stderr=subprocess.PIPE, env=env)
 
-        stdout_queue = None
-        stdout_thread = None
+        handlers = {
+            self._process.stderr: _stderr_handler
+        }
 
         if stdout_handler:
-            stdout_queue = queue.Queue()
+            handlers[self._process.stdout] = stdout_handler
 
-            stdout_thread = threading.Thread(
-                target=watch_pipe,
-                args=(self._process.stdout, stdout_queue),
-                daemon=True
-            )
+        output_filter = None
 
-            stdout_thread.start()
+        if stdout_filter:
+            output_filter = OutputFilter(stdout_filter, self._process.stdout)
+            output_filter.start()
 
-        stderr_queue = queue.Queue()
+            # Only the filter process should read from the pipe.
+            self._process.stdout.close()
 
-        stderr_thread = threading.Thread(
-            target=watch_pipe,
-            args=(self._process.stderr, stderr_queue),
-            daemon=True
-        )
+        try:
+            watch_pipes(self._process, handlers)
 
-        stderr_thread.start()
+            self._process.wait()
 
-        while True:
-            if stdout_queue:
-                while not stdout_queue.empty():
-                    out = stdout_queue.get()
-                    stdout_handler(out)
+            result = output_filter.result() if output_filter else None
+        except BaseException:
+            if output_filter:
+                output_filter.kill()
+            raise
+        finally:
+            for pipe in handlers:
+                pipe.close()
 
-            while not stderr_queue.empty():
-                err = stderr_queue.get()
-                _stderr_handler(err)
+        if self._process.returncode != 0:
+            raise SubprocessError(f"Command failed: {' '.join(command)}. Check job log.")
 
-            alive = (stdout_thread and stdout_thread.is_alive()) or stderr_thread.is_alive()
+        self._process = None
 
-            stdout_empty = not stdout_queue or stdout_queue.empty()
+        return result
 
-            if not alive and stderr_queue.empty() and stdout_empty and self._process.poll() is not None:
-                break
+    def run_subprocesses(self, commands: list):
+        """
+        Run several commands at the same time and wait for all of them to finish. STDOUT is discarded and STDERR is
+        written to the job log.
 
-        if self._process.returncode != 0:
-            raise SubprocessError(f"Command failed: {' '.join(command)}. Check job log.")
+        All of the commands are killed if an exception, including a :class:`TerminationError`, is raised while waiting
+        on them.
 
-        self._process = None
+        :param commands: the commands to run in subprocesses
+
+        """
+        processes = list()
+
+        try:
+            for command in commands:
+                self.add_log(f"Command: {' '.join(command)}")
+                processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE))
+
+            handlers = {process.stderr: lambda line: self.add_log(line, indent=1) for process in processes}
+
+            watch_pipes(processes, handlers)
+
+            for process in processes:
+                process.wait()
+        except BaseException:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            raise
+        finally:
+            for process in processes:
+                process.stderr.close()
+
+        for command, process in zip(commands, processes):
+            if process.returncode != 0:
+                raise SubprocessError(f"Command failed: {' '.join(command)}. Check job log.")
 
     def add_status(self, state=None, stage=None):
         """
@@ -317,6 +529,8 @@ class Job(multiprocessing.Process):
         on the database document representing the index. Sending a real-time update to the clients would allow the index
         UI component to change from a pending to active style.
 
+        The time the message is sent is included so the server can measure dispatch latency.
+
         :param interface: the interface (ie. database collection) the message applies to
         :param operation: the operation to perform on the interface
         :param id_list: a list of ids whose documents should be dispatched
@@ -325,7 +539,8 @@ class Job(multiprocessing.Process):
         message = (
             interface,
             operation,
-            id_list
+            id_list,
+            time.time()
         )
 
         self.q.put(message)
@@ -355,6 +570,17 @@ class Job(multiprocessing.Process):
         """
         pass
 
+    def cleanup_interrupted(self):
+        """
+        Called when the job is interrupted so that it can be resumed later. It should clean up any partial output of
+        the interrupted stage that would prevent the stage from being run again. Output of completed stages must be
+        kept.
+
+        By default, this method does nothing. It is intended to be replaced in a subclass.
+
+        """
+        pass
+
 
 class SubprocessError(Exception):
     """
@@ -376,6 +602,95 @@ class TerminationError(Exception):
     pass
 
 
+class InterruptionError(Exception):
+    """
+    This exception is raised when ``SIGUSR1`` is handled in the job process. ``SIGUSR1`` is sent by
+    :meth:`.Job.interrupt` when the job manager or runner is stopping.
+
+    The exception is handled in the :meth:`.run` method and stops execution and puts the job back into the waiting
+    state so it can be resumed.
+
+    """
+    pass
+
+
+class OutputFilter:
+    """
+    Runs a function that consumes the output of a subprocess in a separate process and makes its return value
+    available in the calling process.
+
+    The filter process is forked so that it inherits the open pipe. Its return value, or any exception it raises, is
+    sent back to the calling process through a :func:`multiprocessing.Pipe`.
+
+    :param func: a function that takes a binary file object and returns a picklable result
+    :param handle: the binary file object to pass to ``func``
+
+    """
+
+    def __init__(self, func, handle):
+        self._receiver, sender = multiprocessing.Pipe(duplex=False)
+
+        self._process = multiprocessing.get_context("fork").Process(
+            target=run_output_filter,
+            args=(func, handle, sender),
+            daemon=True
+        )
+
+        self._sender = sender
+
+    def start(self):
+        self._process.start()
+        self._sender.close()
+
+    def result(self):
+        """
+        Wait for the filter to finish and return its result. Exceptions raised in the filter are raised again here.
+
+        """
+        try:
+            succeeded, value = self._receiver.recv()
+        except EOFError:
+            succeeded, value = False, SubprocessError("Output filter exited without a result")
+        finally:
+            self._receiver.close()
+            self._process.join()
+
+        if not succeeded:
+            raise value
+
+        return value
+
+    def kill(self):
+        if self._process.is_alive():
+            self._process.terminate()
+
+        self._process.join()
+        self._receiver.close()
+
+
+def run_output_filter(func, handle, sender):
+    """
+    The target of an :class:`OutputFilter` process. Calls ``func`` on ``handle`` and sends a ``(succeeded, value)``
+    tuple back to the calling process.
+
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    try:
+        message = (True, func(handle))
+    except Exception as err:
+        message = (False, err)
+    finally:
+        handle.close()
+
+    try:
+        sender.send(message)
+    except Exception as err:
+        sender.send((False, SubprocessError(f"Could not send output filter result: {err}")))
+
+    sender.close()
+
+
 def handle_exception(max_tb: Optional[int] = 50) -> dict:
     """
     Transforms an exception into a :class:`dict` describing the error. The dict can be stored in MongoDB and used to
@@ -414,21 +729,118 @@ def handle_sigterm(*args):
     raise TerminationError
 
 
-def watch_pipe(stream: io.TextIOWrapper, q: queue.Queue):
+def handle_sigusr1(*args):
     """
-    A function for watching stdout and stderr pipes on subprocesses. Lines are read and pushed into the `q`. Queued
-    lines are handled in :meth:`.Job.run`.
+    A handler for SIGUSR1 signals. Raises an InterruptionError in :meth:`.Job.run` that stops the job without
+    discarding its completed stages.
 
-    This function is intended to be run in a separate thread.
+    """
+    raise InterruptionError
 
-    :param stream: a stdout or stderr file object
-    :param q: a queue to push lines into
 
+def get_fingerprints(paths: list) -> dict:
     """
-    while True:
-        line = stream.readline()
+    Get the size and modification time of each file in ``paths``. Directories are recorded as ``None``.
 
-        if not line:
-            return
+    :param paths: the paths to fingerprint
+    :return: fingerprints keyed by path
+
+    """
+    fingerprints = dict()
+
+    for path in paths:
+        if os.path.isdir(path):
+            fingerprints[path] = None
+        else:
+            stat = os.stat(path)
+            fingerprints[path] = (stat.st_size, stat.st_mtime_ns)
+
+    return fingerprints
+
+
+def check_fingerprints(fingerprints: dict) -> bool:
+    """
+    Check that the files and directories fingerprinted by :func:`get_fingerprints` still exist and are unchanged.
+
+    :param fingerprints: fingerprints keyed by path
+    :return: ``True`` if all of the paths are unchanged
+
+    """
+    for path, fingerprint in fingerprints.items():
+        if fingerprint is None:
+            if not os.path.isdir(path):
+                return False
+
+            continue
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+
+        if (stat.st_size, stat.st_mtime_ns) != fingerprint:
+            return False
+
+    return True
+
+
+def watch_pipes(process, handlers: dict, block_size: int = PIPE_BLOCK_SIZE):
+    """
+    Watch the stdout and stderr pipes of a subprocess and pass each line of output to the handler for its pipe.
+
+    Pipes are multiplexed using :mod:`selectors`, so this function blocks without using CPU time until output is
+    available. Output is read in blocks of up to ``block_size`` bytes, and all of the complete lines in a block are
+    handled before the next read. A final line without a trailing newline is handled when its pipe is closed.
+
+    Returns when all pipes are closed or when every process has exited and no more output is available. The latter
+    prevents waiting on pipes that are held open by orphaned child processes of ``process``.
+
+    :param process: the subprocess that is writing to the pipes or a list of subprocesses
+    :param handlers: functions that take a single line keyed by the pipe they handle
+    :param block_size: the maximum number of bytes to read from a pipe at once
+
+    """
+    processes = process if isinstance(process, list) else [process]
+
+    with selectors.DefaultSelector() as selector:
+        for pipe, handler in handlers.items():
+            selector.register(pipe, selectors.EVENT_READ, [handler, b""])
+
+        while selector.get_map():
+            events = selector.select(PIPE_POLL_INTERVAL)
+
+            if not events and all(p.poll() is not None for p in processes):
+                # Handle final lines without trailing newlines from pipes that are still held open.
+                for key in list(selector.get_map().values()):
+                    handler, remainder = key.data
+
+                    if remainder:
+                        handler(remainder)
+
+                    selector.unregister(key.fileobj)
+
+                return
+
+            for key, _ in events:
+                handler, remainder = key.data
+
+                block = os.read(key.fd, block_size)
+
+                if not block:
+                    selector.unregister(key.fileobj)
+
+                    if remainder:
+                        handler(remainder)
+
+                    continue
+
+                end = block.rfind(b"\n") + 1
+
+                if not end:
+                    key.data[1] = remainder + block
+                    continue
+
+                key.data[1] = block[end:]
 
-        q.put(line)
+                for line in io.BytesIO(remainder + block[:end]):
+                    handler(line)
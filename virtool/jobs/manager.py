@@ -1,6 +1,10 @@
 import asyncio
+import collections
+import itertools
 import logging
 import multiprocessing
+import queue
+import time
 
 import virtool.db.core
 import virtool.indexes.db
@@ -11,6 +15,7 @@ import virtool.db.utils
 import virtool.dispatcher
 import virtool.errors
 import virtool.jobs.classes
+import virtool.jobs.runner
 import virtool.utils
 
 TASK_LG = "lg"
@@ -25,8 +30,144 @@ TASK_SIZES = {
     "update_sample": TASK_SM
 }
 
+#: The scheduling priority of each task. Waiting jobs with a higher priority are always considered first. Short jobs
+#: that users wait on interactively are preferred over analyses.
+TASK_PRIORITIES = {
+    "build_index": 2,
+    "create_sample": 2,
+    "create_subtraction": 1,
+    "nuvs": 0,
+    "pathoscope_bowtie": 0,
+    "update_sample": 2
+}
+
+#: The number of seconds a job can wait before it reserves resources. Smaller jobs can not be backfilled into
+#: resources reserved for a job, so large jobs are not starved by a stream of small ones.
+RESERVE_AFTER = 300
+
+#: The maximum number of messages read from job processes before they are dispatched.
+MAX_BATCH_SIZE = 1000
+
+#: The number of recent messages latency metrics are calculated from.
+LATENCY_WINDOW = 1000
+
+#: The number of seconds between checks for messages sent by job runners through the database.
+MESSAGE_POLL_INTERVAL = 0.5
+
+
+class Manager:
+    """
+    The base class for job managers. Dispatches the documents referred to by messages from jobs to clients and keeps
+    metrics describing the flow of messages.
+
+    """
+
+    def __init__(self, app):
+        #: A reference to the application dispatcher's :meth:`.dispatch` method.
+        self._dispatch = app["dispatcher"].dispatch
+
+        #: The application database interface.
+        self.dbi = app["db"]
+
+        #: The settings dict.
+        self.settings = app["settings"]
+
+        #: The number of seconds between each recent message being sent by a job process and dispatched to clients.
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+        self._message_counts = {
+            "received": 0,
+            "dispatched": 0,
+            "batches": 0,
+            "last_batch": 0
+        }
+
+    async def dispatch_messages(self, messages):
+        """
+        Dispatch the documents referred to by a batch of messages from job processes.
+
+        Messages with the same interface and operation are merged. The documents for all inserts and updates on an
+        interface are fetched with a single query.
+
+        :param messages: a list of ``(interface, operation, id_list, sent_at)`` messages
+
+        """
+        groups = coalesce(messages)
+
+        documents = dict()
+
+        for interface, id_list in get_queried_ids(groups).items():
+            collection = getattr(self.dbi, interface)
+
+            projection = virtool.dispatcher.get_projection(interface)
+            processor = virtool.dispatcher.get_processor(interface)
+
+            documents[interface] = dict()
+
+            async for document in collection.find({"_id": {"$in": id_list}}, projection=projection):
+                document_id = document["_id"]
+                documents[interface][document_id] = processor(document)
+
+        dispatched = 0
+
+        for (interface, operation), id_list in groups.items():
+            if operation == "delete":
+                await self._dispatch(interface, operation, id_list)
+                dispatched += 1
+                continue
+
+            for document_id in id_list:
+                document = documents[interface].get(document_id)
+
+                if document:
+                    await self._dispatch(interface, operation, document)
+                    dispatched += 1
+
+        now = time.time()
+
+        self._latencies.extend(now - message[3] for message in messages)
+
+        self._message_counts["received"] += len(messages)
+        self._message_counts["dispatched"] += dispatched
+        self._message_counts["batches"] += 1
+        self._message_counts["last_batch"] = len(messages)
 
-class IntegratedManager:
+    @property
+    def metrics(self) -> dict:
+        """
+        Metrics describing the flow of messages from job processes to clients.
+
+        ``latency`` is the time in seconds from messages being sent by job processes to their documents being
+        dispatched, calculated from the last :data:`LATENCY_WINDOW` messages.
+
+        """
+        latencies = sorted(self._latencies)
+
+        latency = None
+
+        if latencies:
+            latency = {
+                "mean": sum(latencies) / len(latencies),
+                "median": latencies[len(latencies) // 2],
+                "p95": latencies[int(len(latencies) * 0.95)],
+                "max": latencies[-1]
+            }
+
+        return {
+            "queue_depth": self.get_queue_depth(),
+            "messages": dict(self._message_counts),
+            "latency": latency
+        }
+
+    def get_queue_depth(self):
+        """
+        Get the number of messages waiting to be dispatched. Returns ``None`` if the depth is not known.
+
+        """
+        return None
+
+
+class IntegratedManager(Manager):
     """
     A job manager that can be integrated into a monolithic Virtool process.
 
@@ -35,80 +176,98 @@ class IntegratedManager:
     """
 
     def __init__(self, app, capture_exception):
-        #: A reference to the application dispatcher's :meth:`.dispatch` method.
-        self._dispatch = app["dispatcher"].dispatch
+        super().__init__(app)
 
         #: A :class:`multiprocess.Queue` used to receive dispatch information from job processes.
         self.queue = multiprocessing.Queue()
 
-        #: The application database interface.
-        self.dbi = app["db"]
-
         self.db_connection_string = app["settings"]["db_connection_string"]
 
         self.db_name = app["settings"]["db_name"]
 
         self.process_executor = app["process_executor"]
 
-        #: The settings dict.
-        self.settings = app["settings"]
-
         #: A reference to Sentry client's `captureException` method.
         self.capture_exception = capture_exception
 
         #: A dict to store all the tracked job objects in.
         self._jobs = dict()
 
+        #: Set to wake the manager when a job is enqueued or cancelled, a job process exits, or a message is received
+        #: from a job process.
+        self._wakeup = asyncio.Event()
+
+        #: Used to order jobs that are enqueued at the same time.
+        self._counter = itertools.count()
+
     async def run(self):
         logging.debug("Started job manager")
 
+        loop = asyncio.get_event_loop()
+
+        # The queue's pipe becomes readable whenever a job process sends a message.
+        loop.add_reader(self.queue._reader.fileno(), self._wakeup.set)
+
         try:
             while True:
-                to_delete = list()
+                self._wakeup.clear()
 
-                if len(self._jobs):
-                    available = get_available_resources(self.settings, self._jobs)
+                self._remove_exited()
 
-                    for job_id, job in self._jobs.items():
-                        if not job["process"]:
-                            if job["proc"] <= available["proc"] and job["mem"] <= available["mem"]:
-                                job["process"] = job["class"](
-                                    self.db_connection_string,
-                                    self.db_name,
-                                    self.settings,
-                                    job_id,
-                                    self.queue
-                                )
+                for job_id in schedule(self.settings, self._jobs, loop.time()):
+                    self._start(job_id)
 
-                                job["process"].start()
+                messages = self._read_messages()
 
-                                break
+                if messages:
+                    await self.dispatch_messages(messages)
 
-                        elif not job["process"].is_alive():
-                            to_delete.append(job_id)
+                await self._wakeup.wait()
 
-                for job_id in to_delete:
-                    del self._jobs[job_id]
-
-                if not self.queue.empty():
-                    msg = self.queue.get()
-                    await self.dispatch(*msg)
+        except asyncio.CancelledError:
+            logging.debug("Interrupting running jobs")
 
-                await asyncio.sleep(0.1)
+            loop.remove_reader(self.queue._reader.fileno())
 
-        except asyncio.CancelledError:
-            logging.debug("Cancelling running jobs")
+            for job in self._jobs.values():
+                job_process = job["process"]
 
-            for job_id in self._jobs:
-                job_process = self._jobs[job_id]["process"]
+                if job_process:
+                    loop.remove_reader(job_process.sentinel)
 
-                if job_process.is_alive():
-                    job_process.terminate()
+                    # Interrupted jobs are resumed from their checkpoints when the server starts again.
+                    if job_process.is_alive():
+                        job_process.interrupt()
 
         logging.debug("Closed job manager")
 
+    def _start(self, job_id):
+        job = self._jobs[job_id]
+
+        job["process"] = job["class"](
+            self.db_connection_string,
+            self.db_name,
+            self.settings,
+            job_id,
+            self.queue
+        )
+
+        job["process"].start()
+
+        # The process sentinel becomes readable when the process exits.
+        asyncio.get_event_loop().add_reader(job["process"].sentinel, self._wakeup.set)
+
+        logging.debug(f"Started job {job_id} ({job['task_name']})")
+
+    def _remove_exited(self):
+        exited = [job_id for job_id, job in self._jobs.items() if job["process"] and not job["process"].is_alive()]
+
+        for job_id in exited:
+            asyncio.get_event_loop().remove_reader(self._jobs[job_id]["process"].sentinel)
+            del self._jobs[job_id]
+
     async def enqueue(self, job_id):
-        document = await self.dbi.jobs.find_one(job_id, ["task", "args", "proc", "mem"])
+        document = await self.dbi.jobs.find_one(job_id, ["task", "args", "proc", "mem", "user"])
 
         task_name = document["task"]
 
@@ -118,21 +277,36 @@ class IntegratedManager:
             "task_name": task_name,
             "task_args": document["args"],
             "proc": document["proc"],
-            "mem": document["mem"]
+            "mem": document["mem"],
+            "user_id": document["user"]["id"],
+            "priority": TASK_PRIORITIES[task_name],
+            "enqueued_at": asyncio.get_event_loop().time(),
+            "order": next(self._counter)
         }
 
-    async def dispatch(self, interface, operation, id_list):
+        self._wakeup.set()
+
+    def _read_messages(self):
+        """
+        Read all messages waiting in the queue, up to :data:`MAX_BATCH_SIZE`. Any remaining messages keep the queue
+        readable, so they are read on the next pass.
 
-        if operation == "delete":
-            await self._dispatch(interface, operation, id_list)
+        """
+        messages = list()
 
-        collection = getattr(self.dbi, interface)
+        while len(messages) < MAX_BATCH_SIZE:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
 
-        projection = virtool.dispatcher.get_projection(interface)
-        processor = virtool.dispatcher.get_processor(interface)
+        return messages
 
-        async for document in collection.find({"_id": {"$in": id_list}}, projection=projection):
-            await self._dispatch(interface, operation, processor(document))
+    def get_queue_depth(self):
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return None
 
     async def cancel(self, job_id):
         """
@@ -151,6 +325,121 @@ class IntegratedManager:
                 await virtool.jobs.db.cancel(self.dbi, job_id)
                 del self._jobs[job_id]
 
+            self._wakeup.set()
+
+
+class ExternalManager(Manager):
+    """
+    A job manager for servers whose jobs are run by standalone job runners (:mod:`virtool.jobs.runner`).
+
+    Runners find waiting jobs in the database, so enqueuing a job does nothing. The manager dispatches the messages
+    sent by job processes through the ``job_messages`` collection and passes cancellation requests to runners through
+    job leases.
+
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+
+        self._queue_depth = 0
+
+    async def run(self):
+        logging.debug("Started external job manager")
+
+        try:
+            while True:
+                documents = await self.dbi.job_messages.find(
+                    {},
+                    sort=[("_id", 1)],
+                    limit=MAX_BATCH_SIZE
+                ).to_list(None)
+
+                if documents:
+                    await self.dbi.job_messages.delete_many({"_id": {"$in": [d["_id"] for d in documents]}})
+
+                    await self.dispatch_messages(
+                        [(d["interface"], d["operation"], d["id_list"], d["sent_at"]) for d in documents]
+                    )
+
+                # Keep reading without waiting if the batch was full.
+                if len(documents) == MAX_BATCH_SIZE:
+                    self._queue_depth = await self.dbi.job_messages.count()
+                    continue
+
+                self._queue_depth = 0
+
+                await asyncio.sleep(MESSAGE_POLL_INTERVAL)
+
+        except asyncio.CancelledError:
+            pass
+
+        logging.debug("Closed external job manager")
+
+    def get_queue_depth(self):
+        return self._queue_depth
+
+    async def enqueue(self, job_id):
+        pass
+
+    async def cancel(self, job_id):
+        """
+        Cancel the job with the given `job_id`. A running job is stopped by the runner holding its lease at the runner's
+        next heartbeat.
+
+        A waiting job is given a placeholder lease so that it can not be claimed and is then cancelled immediately.
+
+        :param job_id: the id of the job to cancel
+        :type job_id: str
+
+        """
+        lease = await self.dbi.job_leases.find_one_and_update({"_id": job_id}, {
+            "$set": {
+                "cancel": True
+            },
+            "$setOnInsert": {
+                "runner": None,
+                "expires_at": virtool.jobs.runner.get_expiry()
+            }
+        }, upsert=True)
+
+        if lease["runner"] is None:
+            await virtool.jobs.db.cancel(self.dbi, job_id)
+
+
+def coalesce(messages):
+    """
+    Merge messages with the same interface and operation. Document IDs are kept in the order they were first seen and
+    each ID only appears once for each interface and operation.
+
+    :param messages: a list of ``(interface, operation, id_list, sent_at)`` messages
+    :return: lists of document IDs keyed by ``(interface, operation)`` in the order they were first seen
+
+    """
+    groups = collections.OrderedDict()
+
+    for interface, operation, id_list, _ in messages:
+        groups.setdefault((interface, operation), collections.OrderedDict()).update((i, None) for i in id_list)
+
+    return collections.OrderedDict((key, list(id_dict)) for key, id_dict in groups.items())
+
+
+def get_queried_ids(groups):
+    """
+    Get the IDs of the documents that need to be fetched for each interface in a coalesced batch of messages. Deleted
+    documents are not fetched.
+
+    :param groups: lists of document IDs keyed by ``(interface, operation)``
+    :return: lists of document IDs keyed by interface
+
+    """
+    queried = collections.OrderedDict()
+
+    for (interface, operation), id_list in groups.items():
+        if operation != "delete":
+            queried.setdefault(interface, collections.OrderedDict()).update((i, None) for i in id_list)
+
+    return {interface: list(id_dict) for interface, id_dict in queried.items()}
+
 
 def get_available_resources(settings, jobs):
     used = get_used_resources(jobs)
@@ -166,6 +455,86 @@ def get_used_resources(jobs):
     }
 
 
+def get_share(settings, job):
+    """
+    Get the dominant share of the host resources used by a job: the larger of its share of the processors and its
+    share of the memory.
+
+    """
+    return max(job["proc"] / settings["proc"], job["mem"] / settings["mem"])
+
+
+def get_user_shares(settings, jobs):
+    """
+    Get the total share of the host resources used by the running jobs of each user.
+
+    """
+    shares = dict()
+
+    for job in jobs.values():
+        if job["process"]:
+            shares[job["user_id"]] = shares.get(job["user_id"], 0) + get_share(settings, job)
+
+    return shares
+
+
+def schedule(settings, jobs, now):
+    """
+    Choose the waiting jobs to start given the resources used by running jobs.
+
+    Waiting jobs are considered in order of task priority, then the share of resources already used by the running
+    jobs of the user that started them, then the order they were enqueued in. Every job that fits in the available
+    resources is started, so smaller jobs are backfilled around larger jobs that do not fit yet. User shares are
+    updated as jobs are chosen so that no one user can take all of the freed resources.
+
+    The first job that does not fit and has been waiting for :data:`RESERVE_AFTER` seconds reserves the available
+    resources it needs. Resources reserved for the job are not used to backfill other jobs.
+
+    :param settings: the application settings
+    :param jobs: the tracked jobs keyed by job ID
+    :param now: the current event loop time
+    :return: the IDs of the jobs to start in the order they should be started
+
+    """
+    available = get_available_resources(settings, jobs)
+    shares = get_user_shares(settings, jobs)
+
+    # Jobs that need more resources than the host has can never start.
+    waiting = [
+        (job_id, job) for job_id, job in jobs.items()
+        if not job["process"] and job["proc"] <= settings["proc"] and job["mem"] <= settings["mem"]
+    ]
+
+    reserved = {"proc": 0, "mem": 0}
+    reserved_id = None
+
+    to_start = list()
+
+    while waiting:
+        waiting.sort(key=lambda item: (-item[1]["priority"], shares.get(item[1]["user_id"], 0), item[1]["order"]))
+
+        for index, (job_id, job) in enumerate(waiting):
+            if all(job[key] <= available[key] - reserved[key] for key in reserved):
+                break
+
+            if reserved_id is None and now - job["enqueued_at"] >= RESERVE_AFTER:
+                reserved = {key: min(job[key], available[key]) for key in reserved}
+                reserved_id = job_id
+        else:
+            break
+
+        del waiting[index]
+
+        to_start.append(job_id)
+
+        for key in available:
+            available[key] -= job[key]
+
+        shares[job["user_id"]] = shares.get(job["user_id"], 0) + get_share(settings, job)
+
+    return to_start
+
+
 def get_task_limits(settings, task_name):
     size = TASK_SIZES[task_name]
 
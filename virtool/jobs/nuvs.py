@@ -3,6 +3,8 @@ Job class and functions for NuVs.
 
 """
 import collections
+import heapq
+import multiprocessing
 import os
 import shlex
 import shutil
@@ -10,9 +12,18 @@ import tempfile
 
 import virtool.bio
 import virtool.db.sync
+import virtool.fastq
+import virtool.hmm.utils
 import virtool.jobs.analysis
 
 
+#: The minimum number of contigs to send to an ORF-finding worker process at once.
+MIN_ORF_CHUNK_SIZE = 20
+
+#: The minimum number of ORFs to search in each ``hmmscan`` process.
+MIN_SHARD_SIZE = 50
+
+
 class SubprocessError(Exception):
     pass
 
@@ -30,8 +41,21 @@ class Job(virtool.jobs.analysis.Job):
     4. Extract all significant open reading frames (ORF) from the assembled contigs.
     5. Using HMMER/vFAM, identify possible viral domains in the ORFs.
 
+    An interrupted job is resumed after the last of these steps that was completed. :meth:`.prepare_hmm` is always run
+    again because it checks data shared with other jobs.
+
     """
 
+    checkpoints = {
+        **virtool.jobs.analysis.Job.checkpoints,
+        "eliminate_otus": ["{analysis_path}/unmapped_otus.fq"],
+        "eliminate_subtraction": ["{analysis_path}/unmapped_hosts.fq"],
+        "reunite_pairs": ["{analysis_path}/unmapped_1.fq", "{analysis_path}/unmapped_2.fq"],
+        "assemble": ["{analysis_path}/assembly.fa"],
+        "process_fasta": ["{analysis_path}/orfs.fa"],
+        "vfam": ["{analysis_path}/hmm.tsv"]
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -90,21 +114,22 @@ class Job(virtool.jobs.analysis.Job):
         self.run_subprocess(command)
 
     def reunite_pairs(self):
-        if self.params["paired"]:
-            unmapped_path = os.path.join(self.params["analysis_path"], "unmapped_hosts.fq")
-            headers = virtool.bio.read_fastq_headers(unmapped_path)
-
-            unmapped_roots = {h.split(" ")[0] for h in headers}
+        """
+        Restore the pairing of reads that were mapped as single reads by :meth:`.eliminate_otus` and
+        :meth:`.eliminate_subtraction`. For paired samples, the mates of all reads in ``unmapped_hosts.fq`` are
+        written from the original read files to ``unmapped_1.fq`` and ``unmapped_2.fq``. See
+        :func:`virtool.fastq.reunite_pairs`.
 
-            with open(os.path.join(self.params["analysis_path"], "unmapped_1.fq"), "w") as f:
-                for header, seq, quality in virtool.bio.read_fastq_from_path(self.params["read_paths"][0]):
-                    if header.split(" ")[0] in unmapped_roots:
-                        f.write("\n".join([header, seq, "+", quality]) + "\n")
+        """
+        if self.params["paired"]:
+            analysis_path = self.params["analysis_path"]
 
-            with open(os.path.join(self.params["analysis_path"], "unmapped_2.fq"), "w") as f:
-                for header, seq, quality in virtool.bio.read_fastq_from_path(self.params["read_paths"][1]):
-                    if header.split(" ")[0] in unmapped_roots:
-                        f.write("\n".join([header, seq, "+", quality]) + "\n")
+            virtool.fastq.reunite_pairs(
+                os.path.join(analysis_path, "unmapped_hosts.fq"),
+                self.params["read_paths"],
+                [os.path.join(analysis_path, "unmapped_1.fq"), os.path.join(analysis_path, "unmapped_2.fq")],
+                proc=self.proc
+            )
 
     def assemble(self):
         """
@@ -174,16 +199,10 @@ class Job(virtool.jobs.analysis.Job):
 
         assembly = virtool.bio.read_fasta(assembly_path)
 
-        for _, sequence in assembly:
-
-            sequence_length = len(sequence)
-
-            # Don't consider the sequence if it is shorter than 300 bp.
-            if sequence_length < 300:
-                continue
-
-            orfs = virtool.bio.find_orfs(sequence)
+        # Don't consider sequences shorter than 300 bp.
+        sequences = [sequence for _, sequence in assembly if len(sequence) >= 300]
 
+        for sequence, orfs in zip(sequences, find_all_orfs(sequences, self.proc)):
             # Don't consider the sequence if it has no ORFs.
             if len(orfs) == 0:
                 continue
@@ -210,24 +229,28 @@ class Job(virtool.jobs.analysis.Job):
                     f.write(f">sequence_{entry['index']}.{orf['index']}\n{orf['pro']}\n")
 
     def prepare_hmm(self):
+        """
+        Make sure the profile HMMs in ``data_path/hmm`` have been pressed with ``hmmpress``.
 
-        shutil.copy(os.path.join(self.settings["data_path"], "hmm", "profiles.hmm"), self.params["analysis_path"])
-
-        hmm_path = os.path.join(self.params["analysis_path"], "profiles.hmm")
+        The profiles are pressed once when they are installed and shared by all NuVs jobs. They are only pressed here if
+        the pressed files are missing or were generated from a different version of ``profiles.hmm``.
 
-        command = [
-            "hmmpress",
-            hmm_path
-        ]
+        """
+        hmm_path = os.path.join(self.settings["data_path"], "hmm")
 
-        self.run_subprocess(command)
+        with virtool.hmm.utils.lock_profiles(hmm_path):
+            if virtool.hmm.utils.check_pressed(hmm_path):
+                return
 
-        os.remove(hmm_path)
+        with virtool.hmm.utils.lock_profiles(hmm_path, exclusive=True):
+            # Another job may have pressed the profiles while waiting for the lock.
+            if not virtool.hmm.utils.check_pressed(hmm_path):
+                virtool.hmm.utils.press_profiles(hmm_path, self.run_subprocess)
 
     def vfam(self):
         """
         Searches for viral motifs in ORF translations generated by :meth:`.process_fasta`. Calls ``hmmscan`` and
-        searches against ``candidates.fa`` using the profile HMMs in ``data_path/hmm/vFam.hmm``.
+        searches against ``orfs.fa`` using the shared pressed profile HMMs in ``data_path/hmm/profiles.hmm``.
 
         Saves two files:
 
@@ -239,40 +262,75 @@ class Job(virtool.jobs.analysis.Job):
         # The path to output the hmmer results to.
         tsv_path = os.path.join(self.params["analysis_path"], "hmm.tsv")
 
-        command = [
-            "hmmscan",
-            "--tblout", tsv_path,
-            "--noali",
-            "--cpu", str(self.proc - 1),
-            os.path.join(self.params["analysis_path"], "profiles.hmm"),
-            os.path.join(self.params["analysis_path"], "orfs.fa")
-        ]
+        hmm_path = os.path.join(self.settings["data_path"], "hmm")
 
-        self.run_subprocess(command)
+        orfs = virtool.bio.read_fasta(os.path.join(self.params["analysis_path"], "orfs.fa"))
 
-        hits = collections.defaultdict(lambda: collections.defaultdict(list))
+        shard_count = get_shard_count(len(orfs), self.proc)
+
+        shards = shard_fasta(orfs, shard_count)
+
+        shard_paths = list()
+        commands = list()
+
+        for i, shard in enumerate(shards):
+            shard_path = os.path.join(self.params["analysis_path"], f"orfs_{i}.fa")
+
+            with open(shard_path, "w") as f:
+                for header, sequence in shard:
+                    f.write(f">{header}\n{sequence}\n")
+
+            shard_paths.append(shard_path)
+
+            commands.append([
+                "hmmscan",
+                "--tblout", f"{shard_path}.tsv",
+                "--noali",
+                "--cpu", str(max(self.proc // shard_count - 1, 0)),
+                os.path.join(hmm_path, virtool.hmm.utils.PROFILES_FILENAME),
+                shard_path
+            ])
+
+        # Prevent the profiles from being replaced while they are being read.
+        with virtool.hmm.utils.lock_profiles(hmm_path):
+            if len(commands) == 1:
+                self.run_subprocess(commands[0])
+            else:
+                self.run_subprocesses(commands)
+
+        merge_tblout([f"{path}.tsv" for path in shard_paths], [header for header, _ in orfs], tsv_path)
+
+        for path in shard_paths:
+            os.remove(path)
+            os.remove(f"{path}.tsv")
 
-        # Go through the raw HMMER results and annotate the HMM hits with data from the database.
+        rows = list()
+
+        # Parse the raw HMMER results before annotating them so the annotations can be fetched in a single query.
         with open(tsv_path, "r") as hmm_file:
             for line in hmm_file:
                 if line.startswith("vFam"):
-                    line = line.split()
+                    rows.append(line.split())
+
+        cluster_ids = {int(row[0].split("_")[1]) for row in rows}
 
-                    cluster_id = int(line[0].split("_")[1])
-                    annotation_id = (self.db.hmm.find_one({"cluster": int(cluster_id)}, {"_id": True}))["_id"]
+        annotation_ids = get_annotation_ids(self.db, cluster_ids)
 
-                    # Expecting sequence_0.0
-                    sequence_index, orf_index = (int(x) for x in line[2].split("_")[1].split("."))
+        hits = collections.defaultdict(lambda: collections.defaultdict(list))
 
-                    hits[sequence_index][orf_index].append({
-                        "hit": annotation_id,
-                        "full_e": float(line[4]),
-                        "full_score": float(line[5]),
-                        "full_bias": float(line[6]),
-                        "best_e": float(line[7]),
-                        "best_bias": float(line[8]),
-                        "best_score": float(line[9])
-                    })
+        for row in rows:
+            # Expecting sequence_0.0
+            sequence_index, orf_index = (int(x) for x in row[2].split("_")[1].split("."))
+
+            hits[sequence_index][orf_index].append({
+                "hit": annotation_ids[int(row[0].split("_")[1])],
+                "full_e": float(row[4]),
+                "full_score": float(row[5]),
+                "full_bias": float(row[6]),
+                "best_e": float(row[7]),
+                "best_bias": float(row[8]),
+                "best_score": float(row[9])
+            })
 
         for sequence_index in hits:
             for orf_index in hits[sequence_index]:
@@ -313,3 +371,138 @@ class Job(virtool.jobs.analysis.Job):
             self.temp_dir.cleanup()
         except AttributeError:
             pass
+
+
+def get_annotation_ids(db, cluster_ids) -> dict:
+    """
+    Get the IDs of the HMM annotations for the vFam clusters with the given ``cluster_ids`` using a single query.
+
+    :param db: the job database client
+    :param cluster_ids: the cluster IDs to find annotations for
+    :return: annotation IDs keyed by cluster ID
+
+    """
+    if not cluster_ids:
+        return dict()
+
+    cursor = db.hmm.find({"cluster": {"$in": sorted(cluster_ids)}}, ["_id", "cluster"])
+
+    annotation_ids = {document["cluster"]: document["_id"] for document in cursor}
+
+    missing = set(cluster_ids) - set(annotation_ids)
+
+    if missing:
+        raise ValueError(f"No HMM annotations found for clusters: {sorted(missing)}")
+
+    return annotation_ids
+
+
+def find_all_orfs(sequences: list, proc: int) -> list:
+    """
+    Find the ORFs in each of the passed nucleotide sequences using :func:`virtool.bio.find_orfs`. The sequences are
+    distributed across ``proc`` worker processes when there are enough of them to make it worthwhile.
+
+    :param sequences: the nucleotide sequences
+    :param proc: the number of processes to use
+    :return: a list of ORF lists in the same order as ``sequences``
+
+    """
+    worker_count = min(proc, len(sequences) // MIN_ORF_CHUNK_SIZE)
+
+    if worker_count < 2:
+        return [virtool.bio.find_orfs(sequence) for sequence in sequences]
+
+    chunk_size = max(MIN_ORF_CHUNK_SIZE, len(sequences) // (worker_count * 4))
+
+    pool = multiprocessing.Pool(worker_count)
+
+    try:
+        orfs = pool.map(virtool.bio.find_orfs, sequences, chunk_size)
+    except BaseException:
+        pool.terminate()
+        raise
+
+    pool.close()
+    pool.join()
+
+    return orfs
+
+
+def get_shard_count(orf_count: int, proc: int) -> int:
+    """
+    Get the number of shards to split ORFs into for searching with parallel ``hmmscan`` processes. Each shard gets at
+    least :data:`MIN_SHARD_SIZE` ORFs and there is never more than one shard per core.
+
+    :param orf_count: the number of ORFs to search
+    :param proc: the number of cores available to the job
+    :return: the number of shards
+
+    """
+    return max(1, min(proc, orf_count // MIN_SHARD_SIZE))
+
+
+def shard_fasta(records: list, shard_count: int) -> list:
+    """
+    Split FASTA records into ``shard_count`` shards with similar total sequence lengths. The longest records are
+    assigned first, each to the shard with the smallest total length so far. Records keep their original order within
+    each shard.
+
+    :param records: a list of ``(header, sequence)`` tuples
+    :param shard_count: the number of shards
+    :return: a list of lists of records
+
+    """
+    heap = [(0, i) for i in range(shard_count)]
+
+    assignments = [list() for _ in range(shard_count)]
+
+    for index in sorted(range(len(records)), key=lambda i: len(records[i][1]), reverse=True):
+        length, shard = heapq.heappop(heap)
+        assignments[shard].append(index)
+        heapq.heappush(heap, (length + len(records[index][1]), shard))
+
+    return [[records[i] for i in sorted(indexes)] for indexes in assignments]
+
+
+def merge_tblout(paths: list, query_names: list, output_path: str):
+    """
+    Merge ``hmmscan --tblout`` files produced from shards of the same query FASTA file. Hits are written in the
+    original query order and keep the order ``hmmscan`` wrote them in for each query, so the hits are the same as those
+    from a single ``hmmscan`` run over all of the queries.
+
+    The comment lines are taken from the first file. Comments before its hit rows are written before the merged hits
+    and comments after them are written after the merged hits. If the first file has no hits, its column header ends
+    at the first ``#-`` separator line and the remaining comments are written after the merged hits.
+
+    :param paths: the paths to the tables to merge
+    :param query_names: the names of the queries in their original order
+    :param output_path: the path to write the merged table to
+
+    """
+    order = {name: i for i, name in enumerate(query_names)}
+
+    head = list()
+    tail = list()
+    rows = list()
+
+    for i, path in enumerate(paths):
+        with open(path, "r") as f:
+            for line in f:
+                if line.startswith("#"):
+                    if i == 0:
+                        (tail if rows else head).append(line)
+                    continue
+
+                rows.append(line)
+
+        if i == 0 and not rows:
+            end = next((j + 1 for j, line in enumerate(head) if line.startswith("#-")), len(head))
+            head, tail = head[:end], head[end:]
+
+    # Python's sort is stable, so hits for the same query stay in the order they were found in.
+    rows.sort(key=lambda line: order[line.split(None, 3)[2]])
+
+    with open(output_path, "w") as f:
+        f.writelines(head)
+        f.writelines(rows)
+        f.writelines(tail)
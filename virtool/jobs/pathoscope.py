@@ -2,9 +2,13 @@
 Functions and job classes for sample analysis.
 
 """
+import functools
+import json
 import os
 import shlex
+import time
 
+import virtool.artifacts
 import virtool.caches.db
 import virtool.db.sync
 import virtool.jobs.analysis
@@ -12,8 +16,10 @@ import virtool.jobs.job
 import virtool.jobs.utils
 import virtool.otus.utils
 import virtool.pathoscope
+import virtool.sam
 import virtool.samples.db
 import virtool.samples.utils
+import virtool.vta
 
 TRIMMING_PROGRAM = "skewer-0.2.2"
 
@@ -28,8 +34,18 @@ class Job(virtool.jobs.analysis.Job):
     - calculating the sample read count
     - constructing paths used by all subclasses
 
+    An interrupted job is resumed after :meth:`.map_default_isolates` and :meth:`.generate_isolate_fasta` if they were
+    completed. The isolate index is always built or acquired from the index cache again, so a cached index is held by
+    the resumed job.
+
     """
 
+    checkpoints = {
+        **virtool.jobs.analysis.Job.checkpoints,
+        "map_default_isolates": [],
+        "generate_isolate_fasta": ["{analysis_path}/isolate_index.fa"]
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -42,12 +58,52 @@ class Job(virtool.jobs.analysis.Job):
             self.build_isolate_index,
             self.map_isolates,
             self.map_subtraction,
-            self.subtract_mapping,
             self.pathoscope,
             self.import_results,
             self.cleanup_indexes
         ]
 
+    def check_db(self):
+        """
+        Get information from the database as in :meth:`virtool.jobs.analysis.Job.check_db` and decide which isolate
+        index to map to.
+
+        If the index was built with an all-isolates index (see :meth:`virtool.jobs.build_index.Job.build_isolate_index`)
+        and its files are available, reads are mapped to it directly. The stages that find candidate OTUs and build an
+        isolate index for the sample are replaced with :meth:`load_isolate_index`.
+
+        """
+        super().check_db()
+
+        index_dir = os.path.dirname(self.params["index_path"])
+
+        prebuilt = bool(self.params["isolate_index"]) and os.path.isfile(
+            os.path.join(index_dir, "isolate_lengths.json")
+        )
+
+        if prebuilt:
+            self.params["isolate_index_path"] = os.path.join(index_dir, "isolates")
+
+            skipped = (self.map_default_isolates, self.generate_isolate_fasta, self.build_isolate_index)
+
+            stage_list = [stage for stage in self._stage_list if stage not in skipped]
+            stage_list.insert(stage_list.index(self.map_isolates), self.load_isolate_index)
+
+            self._stage_list = stage_list
+        else:
+            self.params["isolate_index_path"] = os.path.join(self.params["analysis_path"], "isolates")
+
+    def load_isolate_index(self):
+        """
+        Load the sequence lengths for the prebuilt all-isolates index. These are used in place of the lengths found in
+        :meth:`generate_isolate_fasta`.
+
+        """
+        index_dir = os.path.dirname(self.params["isolate_index_path"])
+
+        with open(os.path.join(index_dir, "isolate_lengths.json"), "r") as f:
+            self.intermediate["ref_lengths"] = json.load(f)
+
     def map_default_isolates(self):
         """
         Using ``bowtie2``, maps reads to the main otu reference. This mapping is used to identify candidate otus.
@@ -65,32 +121,10 @@ class Job(virtool.jobs.analysis.Job):
             "-U", ",".join(self.params["read_paths"])
         ]
 
-        to_otus = set()
-
-        def stdout_handler(line):
-            line = line.decode()
-
-            if line[0] == "#" or line[0] == "@":
-                return
-
-            fields = line.split("\t")
-
-            # Bitwise FLAG - 0x4: segment unmapped
-            if int(fields[1]) & 0x4 == 4:
-                return
-
-            ref_id = fields[2]
-
-            if ref_id == "*":
-                return
-
-            # Skip if the p_score does not meet the minimum cutoff.
-            if virtool.pathoscope.find_sam_align_score(fields) < 0.01:
-                return
-
-            to_otus.add(ref_id)
-
-        self.run_subprocess(command, stdout_handler=stdout_handler)
+        to_otus = self.run_subprocess(
+            command,
+            stdout_filter=functools.partial(virtool.sam.filter_refs, p_score_cutoff=0.01)
+        )
 
         self.intermediate["to_otus"] = to_otus
 
@@ -110,8 +144,9 @@ class Job(virtool.jobs.analysis.Job):
 
         # Get the database documents for the sequences
         with open(fasta_path, "w") as handle:
-            # Iterate through each otu id referenced by the hit sequence ids.
-            for otu_id in otu_ids:
+            # Iterate through each otu id referenced by the hit sequence ids. The order is fixed so that the same OTUs
+            # always produce the same file and the index built from it can be reused (see :meth:`build_isolate_index`).
+            for otu_id in sorted(otu_ids):
                 otu_version = self.params["manifest"][otu_id]
                 _, patched, _ = virtool.db.sync.patch_otu_to_version(self.db, otu_id, otu_version)
                 for isolate in patched["isolates"]:
@@ -128,19 +163,42 @@ class Job(virtool.jobs.analysis.Job):
         Build an index with ``bowtie2-build`` from the FASTA file generated by
         :meth:`Pathoscope.generate_isolate_fasta`.
 
+        If the ``pathoscope_index_cache_size`` setting is greater than zero, indexes are kept in a shared
+        :class:`virtool.artifacts.ArtifactStore` keyed by the hash of the FASTA file. An index that was already built
+        for the same set of OTUs is reused instead of being rebuilt. The setting is the size of the store in megabytes.
+
         """
-        command = [
-            "bowtie2-build",
-            "--threads", str(self.proc),
-            os.path.join(self.params["analysis_path"], "isolate_index.fa"),
-            os.path.join(self.params["analysis_path"], "isolates")
-        ]
+        fasta_path = os.path.join(self.params["analysis_path"], "isolate_index.fa")
+
+        def build(path):
+            command = [
+                "bowtie2-build",
+                "--threads", str(self.proc),
+                fasta_path,
+                os.path.join(path, "isolates")
+            ]
+
+            self.run_subprocess(command)
+
+        cache_size = self.settings.get("pathoscope_index_cache_size", 0)
+
+        if not cache_size:
+            build(self.params["analysis_path"])
+            return
+
+        store = get_isolate_index_store(self.settings)
+
+        key = virtool.artifacts.hash_file(fasta_path)
 
-        self.run_subprocess(command)
+        entry_path = store.acquire(key, build)
+
+        self.intermediate["isolate_index_key"] = key
+        self.params["isolate_index_path"] = os.path.join(entry_path, "isolates")
 
     def map_isolates(self):
         """
-        Using ``bowtie2``, map the sample reads to the index built using :meth:`.build_isolate_index`.
+        Using ``bowtie2``, map the sample reads to the index built using :meth:`.build_isolate_index` or to the
+        prebuilt all-isolates index for the reference.
 
         """
         command = [
@@ -153,43 +211,16 @@ class Job(virtool.jobs.analysis.Job):
             "-L", "15",
             "-k", "100",
             "--al", os.path.join(self.params["analysis_path"], "mapped.fastq"),
-            "-x", os.path.join(self.params["analysis_path"], "isolates"),
+            "-x", self.params["isolate_index_path"],
             "-U", ",".join(self.params["read_paths"])
         ]
 
-        with open(os.path.join(self.params["analysis_path"], "to_isolates.vta"), "w") as f:
-            def stdout_handler(line, p_score_cutoff=0.01):
-                line = line.decode()
-
-                if line[0] == "@" or line == "#":
-                    return
-
-                fields = line.split("\t")
-
-                # Bitwise FLAG - 0x4 : segment unmapped
-                if int(fields[1]) & 0x4 == 4:
-                    return
-
-                ref_id = fields[2]
-
-                if ref_id == "*":
-                    return
-
-                p_score = virtool.pathoscope.find_sam_align_score(fields)
-
-                # Skip if the p_score does not meet the minimum cutoff.
-                if p_score < p_score_cutoff:
-                    return
-
-                f.write(",".join([
-                    fields[0],  # read_id
-                    ref_id,
-                    fields[3],  # pos
-                    str(len(fields[9])),  # length
-                    str(p_score)
-                ]) + "\n")
+        vta_path = os.path.join(self.params["analysis_path"], "to_isolates.vta")
 
-            self.run_subprocess(command, stdout_handler=stdout_handler)
+        self.run_subprocess(
+            command,
+            stdout_filter=functools.partial(virtool.sam.filter_alignments, vta_path=vta_path, p_score_cutoff=0.01)
+        )
 
     def map_subtraction(self):
         """
@@ -206,44 +237,14 @@ class Job(virtool.jobs.analysis.Job):
             "-U", os.path.join(self.params["analysis_path"], "mapped.fastq")
         ]
 
-        to_subtraction = dict()
-
-        def stdout_handler(line):
-            line = line.decode()
-
-            if line[0] == "@" or line == "#":
-                return
-
-            fields = line.split("\t")
-
-            # Bitwise FLAG - 0x4 : segment unmapped
-            if int(fields[1]) & 0x4 == 4:
-                return
-
-            # No ref_id assigned.
-            if fields[2] == "*":
-                return
-
-            to_subtraction[fields[0]] = virtool.pathoscope.find_sam_align_score(fields)
-
-        self.run_subprocess(command, stdout_handler=stdout_handler)
+        to_subtraction = self.run_subprocess(command, stdout_filter=virtool.sam.filter_scores)
 
         self.intermediate["to_subtraction"] = to_subtraction
 
-    def subtract_mapping(self):
-        subtracted_count = virtool.pathoscope.subtract(
-            self.params["analysis_path"],
-            self.intermediate["to_subtraction"]
-        )
-
-        del self.intermediate["to_subtraction"]
-
-        self.results["subtracted_count"] = subtracted_count
-
     def pathoscope(self):
         """
-        Run the Pathoscope reassignment algorithm. Tab-separated output is written to ``pathoscope.tsv``. Results are
-        also parsed and saved to :attr:`intermediate`.
+        Subtract host alignments and run the Pathoscope reassignment algorithm. Tab-separated output is written to
+        ``report.tsv``. Results are also parsed and saved to :attr:`intermediate`.
 
         """
         vta_path = os.path.join(self.params["analysis_path"], "to_isolates.vta")
@@ -261,10 +262,24 @@ class Job(virtool.jobs.analysis.Job):
             init_pi,
             pi,
             refs,
-            reads
-        ) = run_patho(vta_path, reassigned_path)
+            read_count,
+            subtracted_count,
+            coverage,
+            em_stats
+        ) = run_patho(
+            vta_path,
+            reassigned_path,
+            self.intermediate.pop("to_subtraction"),
+            self.intermediate["ref_lengths"],
+            self.settings.get("pathoscope_em_engine", "python"),
+            self.settings.get("pathoscope_collapse_reads", False),
+            self.proc
+        )
+
+        self.results["subtracted_count"] = subtracted_count
 
-        read_count = len(reads)
+        # Record how the EM algorithm converged.
+        self.results["em"] = em_stats
 
         report = virtool.pathoscope.write_report(
             os.path.join(self.params["analysis_path"], "report.tsv"),
@@ -282,10 +297,7 @@ class Job(virtool.jobs.analysis.Job):
             level_2_final
         )
 
-        self.intermediate["coverage"] = virtool.pathoscope.calculate_coverage(
-            reassigned_path,
-            self.intermediate["ref_lengths"]
-        )
+        self.intermediate["coverage"] = coverage
 
         self.results.update({
             "ready": True,
@@ -306,17 +318,8 @@ class Job(virtool.jobs.analysis.Job):
                 "id": otu_id
             }
 
-            # Get the coverage for the sequence.
-            hit_coverage = self.intermediate["coverage"][ref_id]
-
-            # Attach coverage list to hit dict.
-            hit["align"] = hit_coverage
-
-            # Calculate coverage and attach to hit.
-            hit["coverage"] = round(1 - hit_coverage.count(0) / len(hit_coverage), 3)
-
-            # Calculate depth and attach to hit.
-            hit["depth"] = round(sum(hit_coverage) / len(hit_coverage))
+            # Attach the coverage, mean and median depths, and run-length encoded coverage for the sequence.
+            hit.update(virtool.pathoscope.summarize_coverage(self.intermediate["coverage"][ref_id]))
 
             self.results["results"].append(hit)
 
@@ -354,29 +357,101 @@ class Job(virtool.jobs.analysis.Job):
         self.dispatch("samples", "update", [sample_id])
 
     def cleanup_indexes(self):
-        pass
+        """
+        Release the cached isolate index used by the analysis, if any.
+
+        """
+        self.release_isolate_index()
+
+    def cleanup(self):
+        self.release_isolate_index()
+        super().cleanup()
 
+    def cleanup_interrupted(self):
+        self.release_isolate_index()
+        super().cleanup_interrupted()
 
-def run_patho(vta_path, reassigned_path):
-    u, nu, refs, reads = virtool.pathoscope.build_matrix(vta_path)
+    def release_isolate_index(self):
+        key = self.intermediate.pop("isolate_index_key", None)
+
+        if key:
+            get_isolate_index_store(self.settings).release(key)
+
+
+def get_isolate_index_store(settings: dict) -> virtool.artifacts.ArtifactStore:
+    """
+    Get the store used to cache isolate indexes between Pathoscope analyses.
+
+    :param settings: the application settings
+    :return: the isolate index store
+
+    """
+    return virtool.artifacts.ArtifactStore(
+        os.path.join(settings["data_path"], "artifacts", "isolate_indexes"),
+        settings.get("pathoscope_index_cache_size", 0) * 1024 * 1024
+    )
+
+
+def run_patho(vta_path, reassigned_path, host_scores, ref_lengths, em_engine="python", collapse=False, proc=1,
+              p_score_cutoff=0.01):
+    """
+    Run host subtraction and the Pathoscope reassignment algorithm on the alignments in the VTA file at
+    ``vta_path``.
+
+    The alignments are only loaded once. Host subtraction and the p-score cutoff are applied while building the
+    alignment matrix, the reassignment filter reuses the matrix's record-to-entry map, and coverage is calculated from
+    the reassigned records before they are written to ``reassigned_path``.
+
+    :param vta_path: the path to the VTA file to reassign
+    :param reassigned_path: the path to write the reassigned VTA file to
+    :param host_scores: the highest subtraction host alignment score for each read keyed by read ID
+    :param ref_lengths: the length of each reference sequence keyed by sequence ID
+    :param em_engine: the name of the EM implementation to use (see :data:`virtool.pathoscope.EM_ENGINES`)
+    :param collapse: run the EM algorithm over read equivalence classes instead of individual reads
+    :param proc: the number of processes the EM engine can use
+    :param p_score_cutoff: the minimum p-score for an alignment to be included
+    :return: the data required to write the Pathoscope report, the subtracted alignment count, the coverage, and the
+             EM engine, iteration count, final change in pi, and wall time
+
+
+    """
+    em = virtool.pathoscope.EM_ENGINES[em_engine]
+
+    alignments = virtool.vta.load(vta_path)
+
+    subtraction_mask = virtool.pathoscope.subtraction_mask(alignments, host_scores)
+
+    subtracted_count = int(len(subtraction_mask) - subtraction_mask.sum())
+
+    matrix = virtool.pathoscope.matrix_from_alignments(
+        alignments,
+        subtraction_mask & (alignments.records["score"] >= p_score_cutoff),
+        collapse
+    )
 
     best_hit_initial_reads, best_hit_initial, level_1_initial, level_2_initial = virtool.pathoscope.compute_best_hit(
-        u,
-        nu,
-        refs,
-        reads
+        matrix
     )
 
-    init_pi, pi, _, nu = virtool.pathoscope.em(u, nu, refs, 50, 1e-7, 0, 0)
+    start = time.perf_counter()
+
+    init_pi, pi, _, em_stats = em(matrix, 50, 1e-7, 0, 0, proc=proc)
+
+    em_stats = {
+        "engine": em_engine,
+        **em_stats,
+        "time": time.perf_counter() - start
+    }
 
     best_hit_final_reads, best_hit_final, level_1_final, level_2_final = virtool.pathoscope.compute_best_hit(
-        u,
-        nu,
-        refs,
-        reads
+        matrix
     )
 
-    virtool.pathoscope.rewrite_align(u, nu, vta_path, 0.01, reassigned_path)
+    reassigned = alignments.records[virtool.pathoscope.reassigned_mask(matrix, p_score_cutoff)]
+
+    virtool.vta.write(reassigned_path, reassigned, alignments.read_table, alignments.refs)
+
+    coverage = virtool.pathoscope.count_coverage(reassigned, alignments.refs, ref_lengths)
 
     return (
         best_hit_initial_reads,
@@ -389,6 +464,9 @@ def run_patho(vta_path, reassigned_path):
         level_2_final,
         init_pi,
         pi,
-        refs,
-        reads
+        matrix.refs,
+        matrix.read_count,
+        subtracted_count,
+        coverage,
+        em_stats
     )
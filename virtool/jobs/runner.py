@@ -0,0 +1,439 @@
+"""
+A standalone job runner that takes work from the application database.
+
+Runners let jobs run on hosts other than the one the API server is running on. Any number of runners can share one
+database. Each runner host must have the application data path mounted at the same location as the server.
+
+The ``jobs`` collection is used as the queue. A runner claims a waiting job by inserting a lease document with the
+job's ID into the ``job_leases`` collection. Only one insert can succeed for each ID, so a job is never claimed by more
+than one runner. Runners renew the leases on their running jobs every :data:`HEARTBEAT_INTERVAL` seconds. A lease that
+has not been renewed for :data:`LEASE_DURATION` seconds has expired. Expired leases are removed by whichever runner
+finds them first. If the job was already running, it is marked as failed rather than being run a second time.
+
+A runner that is stopped interrupts its running jobs (see :meth:`virtool.jobs.job.Job.interrupt`). Jobs that can be
+resumed are put back into the waiting state and are continued from their checkpoints by the next runner to claim them.
+
+Runners start the same job classes as the integrated job manager (:data:`virtool.jobs.classes.TASK_CLASSES`) and
+choose the jobs to claim with :func:`virtool.jobs.manager.schedule` using their own ``proc`` and ``mem`` limits.
+
+Dispatch messages sent by job processes are written to the ``job_messages`` collection. The API server reads and
+dispatches them to clients using :class:`virtool.jobs.manager.ExternalManager`.
+
+"""
+import asyncio
+import datetime
+import logging
+import multiprocessing
+import queue
+import signal
+import socket
+import time
+
+import pymongo
+import pymongo.errors
+from motor import motor_asyncio
+
+import virtool.config
+import virtool.jobs.classes
+import virtool.jobs.manager
+import virtool.logs
+import virtool.settings.db
+import virtool.utils
+
+logger = logging.getLogger(__name__)
+
+#: The number of seconds a lease is valid for after it is acquired or renewed.
+LEASE_DURATION = 60
+
+#: The number of seconds between renewals of the leases held by a runner.
+HEARTBEAT_INTERVAL = 10
+
+#: The number of seconds between checks for waiting jobs.
+POLL_INTERVAL = 5
+
+
+def get_expiry() -> datetime.datetime:
+    return virtool.utils.timestamp() + datetime.timedelta(seconds=LEASE_DURATION)
+
+
+async def acquire_lease(db, job_id: str, runner_id: str) -> bool:
+    """
+    Try to claim the job identified by ``job_id`` for the runner identified by ``runner_id``.
+
+    :param db: the application database
+    :param job_id: the ID of the job to claim
+    :param runner_id: the ID of the claiming runner
+    :return: ``True`` if the lease was acquired
+
+    """
+    now = virtool.utils.timestamp()
+
+    try:
+        await db.job_leases.insert_one({
+            "_id": job_id,
+            "runner": runner_id,
+            "host": socket.gethostname(),
+            "acquired_at": now,
+            "expires_at": get_expiry(),
+            "cancel": False
+        })
+    except pymongo.errors.DuplicateKeyError:
+        return False
+
+    return True
+
+
+async def release_lease(db, job_id: str, runner_id: str):
+    await db.job_leases.delete_one({"_id": job_id, "runner": runner_id})
+
+
+async def renew_leases(db, runner_id: str, job_ids: list) -> list:
+    """
+    Renew the leases held by a runner on the jobs identified by ``job_ids``.
+
+    :param db: the application database
+    :param runner_id: the ID of the runner
+    :param job_ids: the IDs of the jobs running on the runner
+    :return: the IDs of jobs that have been cancelled or whose leases are no longer held by the runner
+
+    """
+    if not job_ids:
+        return list()
+
+    await db.job_leases.update_many({"_id": {"$in": job_ids}, "runner": runner_id}, {
+        "$set": {
+            "expires_at": get_expiry()
+        }
+    })
+
+    held = dict()
+
+    async for lease in db.job_leases.find({"_id": {"$in": job_ids}}, ["runner", "cancel"]):
+        held[lease["_id"]] = lease["runner"] == runner_id and not lease["cancel"]
+
+    return [job_id for job_id in job_ids if not held.get(job_id)]
+
+
+async def expire_leases(db) -> list:
+    """
+    Remove expired leases. Jobs that were running under an expired lease are marked as failed.
+
+    :param db: the application database
+    :return: the IDs of jobs that were marked as failed
+
+    """
+    failed = list()
+
+    async for lease in db.job_leases.find({"expires_at": {"$lt": virtool.utils.timestamp()}}, ["expires_at"]):
+        # Only one runner can remove the lease, even if several found it at the same time.
+        lease = await db.job_leases.find_one_and_delete({"_id": lease["_id"], "expires_at": lease["expires_at"]})
+
+        # Leases without a runner are placeholders for jobs that were cancelled before they were claimed.
+        if lease is None or lease["runner"] is None:
+            continue
+
+        document = await db.jobs.find_one(lease["_id"], ["status"])
+
+        if document is None:
+            continue
+
+        latest = document["status"][-1]
+
+        if latest["state"] != "running":
+            continue
+
+        logger.warning(f"Lease expired for job {lease['_id']} on {lease['host']}")
+
+        await db.jobs.update_one({"_id": lease["_id"]}, {
+            "$push": {
+                "status": {
+                    "state": "error",
+                    "stage": latest["stage"],
+                    "error": {
+                        "type": "LeaseExpired",
+                        "traceback": [],
+                        "details": [f"Job runner on {lease['host']} stopped responding"]
+                    },
+                    "progress": latest["progress"],
+                    "timestamp": virtool.utils.timestamp()
+                }
+            }
+        })
+
+        failed.append(lease["_id"])
+
+    return failed
+
+
+async def find_waiting_jobs(db) -> list:
+    """
+    Find jobs that are waiting and have not been claimed by a runner. Jobs that were interrupted and put back into the
+    waiting state are included.
+
+    :param db: the application database
+    :return: the job documents ordered by creation
+
+    """
+    leased = await db.job_leases.distinct("_id")
+
+    cursor = db.jobs.aggregate([
+        {"$match": {
+            "_id": {"$nin": leased}
+        }},
+
+        {"$project": {
+            "task": True,
+            "proc": True,
+            "mem": True,
+            "user": True,
+            "created_at": {
+                "$arrayElemAt": ["$status.timestamp", 0]
+            },
+            "latest": {
+                "$arrayElemAt": ["$status", -1]
+            }
+        }},
+
+        {"$match": {
+            "latest.state": "waiting"
+        }},
+
+        {"$sort": {
+            "created_at": 1
+        }}
+    ])
+
+    return [d async for d in cursor]
+
+
+async def send_messages(db, messages: list):
+    """
+    Write dispatch messages from job processes to the database so they can be dispatched by the API server.
+
+    :param db: the application database
+    :param messages: a list of ``(interface, operation, id_list, sent_at)`` messages
+
+    """
+    if messages:
+        await db.job_messages.insert_many([{
+            "interface": interface,
+            "operation": operation,
+            "id_list": id_list,
+            "sent_at": sent_at
+        } for interface, operation, id_list, sent_at in messages], ordered=True)
+
+
+class Runner:
+    """
+    Claims waiting jobs from the database and runs them until cancelled.
+
+    :param db: the application database
+    :param settings: the application settings with the ``proc`` and ``mem`` limits for this runner
+    :param runner_id: a unique ID for the runner
+
+    """
+
+    def __init__(self, db, settings: dict, runner_id: str = None):
+        self.db = db
+        self.settings = settings
+        self.id = runner_id or f"{socket.gethostname()}-{virtool.utils.random_alphanumeric(6)}"
+
+        #: A :class:`multiprocess.Queue` used to receive dispatch information from job processes.
+        self.queue = multiprocessing.Queue()
+
+        #: The running jobs keyed by job ID.
+        self._jobs = dict()
+
+        #: Set when a job process exits or sends a message.
+        self._wakeup = asyncio.Event()
+
+        self._heartbeat_due = 0
+        self._claim_due = 0
+
+    async def run(self):
+        logger.info(f"Started job runner {self.id}")
+
+        loop = asyncio.get_event_loop()
+
+        loop.add_reader(self.queue._reader.fileno(), self._wakeup.set)
+
+        try:
+            while True:
+                self._wakeup.clear()
+
+                if await self._remove_exited():
+                    self._claim_due = 0
+
+                now = loop.time()
+
+                if now >= self._heartbeat_due:
+                    self._heartbeat_due = now + HEARTBEAT_INTERVAL
+                    await self._heartbeat()
+
+                if now >= self._claim_due:
+                    self._claim_due = now + POLL_INTERVAL
+                    await self._claim()
+
+                await self._send_messages()
+
+                timeout = min(self._heartbeat_due, self._claim_due) - loop.time()
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    pass
+
+        except asyncio.CancelledError:
+            logger.info("Interrupting running jobs")
+
+            loop.remove_reader(self.queue._reader.fileno())
+
+            for job in self._jobs.values():
+                loop.remove_reader(job["process"].sentinel)
+
+                if job["process"].is_alive():
+                    job["process"].interrupt()
+
+            for job in self._jobs.values():
+                await loop.run_in_executor(None, job["process"].join)
+
+            await self._remove_exited()
+            await self._send_messages()
+
+        logger.info(f"Stopped job runner {self.id}")
+
+    async def _heartbeat(self):
+        for job_id in await renew_leases(self.db, self.id, list(self._jobs)):
+            logger.info(f"Stopping cancelled job {job_id}")
+            self._jobs[job_id]["process"].terminate()
+
+        failed = await expire_leases(self.db)
+
+        if failed:
+            await send_messages(self.db, [("jobs", "update", failed, time.time())])
+
+    async def _claim(self):
+        """
+        Claim and start the waiting jobs that fit in the resources left on the runner.
+
+        """
+        documents = await find_waiting_jobs(self.db)
+
+        if not documents:
+            return
+
+        jobs = dict(self._jobs)
+
+        for order, document in enumerate(documents):
+            task_name = document["task"]
+
+            if task_name not in virtool.jobs.classes.TASK_CLASSES:
+                continue
+
+            jobs[document["_id"]] = {
+                "process": None,
+                "task_name": task_name,
+                "proc": document["proc"],
+                "mem": document["mem"],
+                "user_id": document["user"]["id"],
+                "priority": virtool.jobs.manager.TASK_PRIORITIES[task_name],
+                "enqueued_at": document["created_at"].timestamp(),
+                "order": order
+            }
+
+        now = virtool.utils.timestamp().timestamp()
+
+        for job_id in virtool.jobs.manager.schedule(self.settings, jobs, now):
+            if not await acquire_lease(self.db, job_id, self.id):
+                # Another runner claimed the job first. Check for other jobs on the next pass.
+                self._claim_due = 0
+                continue
+
+            # The job may have been cancelled after it was found.
+            document = await self.db.jobs.find_one(job_id, ["status"])
+
+            if document is None or document["status"][-1]["state"] != "waiting":
+                await release_lease(self.db, job_id, self.id)
+                continue
+
+            self._start(job_id, jobs[job_id])
+
+    def _start(self, job_id: str, job: dict):
+        job["process"] = virtool.jobs.classes.TASK_CLASSES[job["task_name"]](
+            self.settings["db_connection_string"],
+            self.settings["db_name"],
+            self.settings,
+            job_id,
+            self.queue
+        )
+
+        job["process"].start()
+
+        asyncio.get_event_loop().add_reader(job["process"].sentinel, self._wakeup.set)
+
+        self._jobs[job_id] = job
+
+        logger.info(f"Started job {job_id} ({job['task_name']})")
+
+    async def _remove_exited(self) -> bool:
+        exited = [job_id for job_id, job in self._jobs.items() if not job["process"].is_alive()]
+
+        for job_id in exited:
+            asyncio.get_event_loop().remove_reader(self._jobs[job_id]["process"].sentinel)
+            del self._jobs[job_id]
+
+            # Send any messages from the job before its lease is released.
+            await self._send_messages()
+            await release_lease(self.db, job_id, self.id)
+
+        return bool(exited)
+
+    async def _send_messages(self):
+        messages = list()
+
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        await send_messages(self.db, messages)
+
+
+async def run():
+    """
+    Run a job runner configured the same way as the API server. The ``proc`` and ``mem`` limits for the runner are
+    always taken from the local configuration rather than the settings stored in the database.
+
+    """
+    config = virtool.config.resolve()
+
+    virtool.logs.configure(config["dev"])
+
+    db_client = motor_asyncio.AsyncIOMotorClient(config["db_connection_string"], serverSelectionTimeoutMS=6000)
+
+    try:
+        await db_client.list_database_names()
+    except pymongo.errors.ServerSelectionTimeoutError:
+        logger.critical("Could not connect to MongoDB server")
+        return
+
+    db = db_client[config["db_name"]]
+
+    from_db = await virtool.settings.db.get(db)
+
+    settings = {
+        **config,
+        **from_db,
+        "proc": config["proc"],
+        "mem": config["mem"]
+    }
+
+    task = asyncio.ensure_future(Runner(db, settings).run())
+
+    loop = asyncio.get_event_loop()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, task.cancel)
+
+    await task
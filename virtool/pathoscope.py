@@ -1,37 +1,124 @@
-import collections
-import copy
+import contextlib
 import csv
 import math
-import os
-import shutil
+import multiprocessing
 
+import numpy as np
 
-def rescale_samscore(u, nu, max_score, min_score):
-    if min_score < 0:
-        scaling_factor = 100.0 / max_score - min_score
-    else:
-        scaling_factor = 100.0 / max_score
+import virtool.vta
+
+
+class Matrix:
+    """
+    A compact read-to-reference alignment matrix used as the input to the Pathoscope reassignment algorithm.
+
+    Alignments are stored as a compressed sparse row (CSR) matrix with one row per read. The reference indexes and
+    scores for read ``i`` are found at ``ref_indexes[offsets[i]:offsets[i + 1]]`` and
+    ``scores[offsets[i]:offsets[i + 1]]``. Reads with a single row entry are uniquely mapped.
+
+    Read IDs are not retained. Instead, :attr:`line_entries` maps each record in the source VTA file to its matrix
+    entry, allowing the file to be filtered in :func:`rewrite_align` without rebuilding any ID dictionaries.
+
+    A row can also represent an equivalence class of reads that align to exactly the same references with the same
+    scores. The number of reads in each row is given by :attr:`multiplicities`. See :func:`collapse_reads`.
+
+    """
+
+    __slots__ = (
+        "refs",
+        "row_count",
+        "read_count",
+        "multiplicities",
+        "offsets",
+        "ref_indexes",
+        "scores",
+        "weights",
+        "x",
+        "line_entries",
+        "first_lines"
+    )
+
+    def __init__(self, refs, offsets, ref_indexes, scores, line_entries, first_lines, multiplicities=None):
+        #: The reference IDs. A reference's index in this list is used to refer to it in :attr:`ref_indexes`.
+        self.refs = refs
+
+        #: The number of rows in the matrix.
+        self.row_count = len(offsets) - 1
+
+        #: The number of reads represented by each row.
+        self.multiplicities = np.ones(self.row_count, dtype=np.int64) if multiplicities is None else multiplicities
+
+        #: The number of reads with at least one alignment passing the p-score cutoff.
+        self.read_count = int(self.multiplicities.sum())
 
-    for read_index in u:
-        if min_score < 0:
-            u[read_index][1][0] = u[read_index][1][0] - min_score
+        #: The start offset of each row's entries. The last element is the total number of entries.
+        self.offsets = offsets
 
-        u[read_index][1][0] = math.exp(u[read_index][1][0] * scaling_factor)
-        u[read_index][3] = u[read_index][1][0]
+        #: The reference index for each entry.
+        self.ref_indexes = ref_indexes
 
-    for read_index in nu:
-        nu[read_index][3] = 0.0
+        #: The rescaled alignment score for each entry.
+        self.scores = scores
 
-        for i in range(0, len(nu[read_index][1])):
-            if min_score < 0:
-                nu[read_index][1][i] = nu[read_index][1][i] - min_score
+        #: The maximum rescaled score for each row.
+        self.weights = np.maximum.reduceat(scores, offsets[:-1]) if len(scores) else np.zeros(0)
 
-            nu[read_index][1][i] = math.exp(nu[read_index][1][i] * scaling_factor)
+        #: The proportion of each read assigned to each of its references. Initially the normalized scores. Updated in
+        #: place by the EM algorithm.
+        self.x = scores / self.score_sums()[self.rows]
 
-            if nu[read_index][1][i] > nu[read_index][3]:
-                nu[read_index][3] = nu[read_index][1][i]
+        #: The entry index for each record in the source VTA file. Records that did not pass the p-score cutoff are
+        #: ``-1``.
+        self.line_entries = line_entries
+
+        #: A boolean array selecting the first record for each distinct read and reference pair in the source VTA file.
+        self.first_lines = first_lines
+
+    @property
+    def lengths(self):
+        """
+        The number of entries for each row.
+
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def rows(self):
+        """
+        The row index for each entry.
+
+        """
+        return np.repeat(np.arange(self.row_count), self.lengths)
+
+    def score_sums(self):
+        """
+        Return the sum of the scores for each row.
+
+        """
+        if not self.row_count:
+            return np.zeros(0)
+
+        return np.add.reduceat(self.scores, self.offsets[:-1])
+
+
+def rescale_samscore(scores, max_score, min_score):
+    """
+    Rescale the raw alignment ``scores`` to the exponential weights used by Pathoscope.
+
+    :param scores: an array of raw alignment scores
+    :param max_score: the maximum raw alignment score
+    :param min_score: the minimum raw alignment score or ``0`` if all scores are positive
+    :return: the rescaled scores
+
+    """
+    if min_score < 0:
+        scaling_factor = 100.0 / max_score - min_score
+        scores = scores - min_score
+    else:
+        scaling_factor = 100.0 / max_score
 
-    return u, nu
+    # Use :func:`math.exp` rather than :func:`numpy.exp` so results are identical across platforms.
+    return np.fromiter(map(math.exp, (scores * scaling_factor).tolist()), dtype=np.float64, count=len(scores))
 
 
 def find_sam_align_score(fields):
@@ -58,138 +145,276 @@ def find_sam_align_score(fields):
     raise ValueError("Could not find alignment score")
 
 
-def build_matrix(vta_path, p_score_cutoff=0.01):
-    u = dict()
-    nu = dict()
+def build_matrix(vta_path, p_score_cutoff=0.01, collapse=False):
+    """
+    Build a :class:`Matrix` from the alignments in the VTA file at ``vta_path``. Alignments with p-scores below
+    ``p_score_cutoff`` are ignored.
 
-    h_read_id = {}
-    h_ref_id = {}
+    Only the first alignment of a read to a given reference is used.
 
-    refs = []
-    reads = []
+    :param vta_path: the path to the VTA file
+    :param p_score_cutoff: the minimum p-score for an alignment to be included
+    :param collapse: collapse reads with identical alignment profiles into single rows
+    :return: the alignment matrix
 
-    ref_count = 0
-    read_count = 0
+    """
+    alignments = virtool.vta.load(vta_path)
 
-    max_score = 0
-    min_score = 0
+    return matrix_from_alignments(alignments, alignments.records["score"] >= p_score_cutoff, collapse)
 
-    with open(vta_path, "r") as handle:
-        for line in handle:
-            read_id, ref_id, _, _, p_score = line.rstrip().split(",")
 
-            p_score = float(p_score)
+def matrix_from_alignments(alignments, mask, collapse=False):
+    """
+    Build a :class:`Matrix` from the loaded ``alignments``. Only records selected by the boolean ``mask`` are
+    included. Only references with at least one selected record are included in the matrix. They are ordered by their
+    first selected record.
 
-            if p_score < p_score_cutoff:
-                continue
+    :param alignments: the alignments loaded from a VTA file
+    :param mask: a boolean array selecting the records to include
+    :param collapse: collapse reads with identical alignment profiles into single rows
+    :return: the alignment matrix
 
-            min_score = min(min_score, p_score)
-            max_score = max(max_score, p_score)
+    """
+    records = alignments.records
 
-            ref_index = h_ref_id.get(ref_id, -1)
+    kept_lines = np.flatnonzero(mask)
 
-            if ref_index == -1:
-                ref_index = ref_count
-                h_ref_id[ref_id] = ref_index
-                refs.append(ref_id)
-                ref_count += 1
+    # Assign read indexes in the order the reads first appear in the file.
+    _, first, inverse = np.unique(records["read"][kept_lines], return_index=True, return_inverse=True)
 
-            read_index = h_read_id.get(read_id, -1)
+    read_count = len(first)
 
-            if read_index == -1:
-                # hold on this new read. first, wrap previous read profile and see if any previous read has a same
-                # profile with that!
-                read_index = read_count
-                h_read_id[read_id] = read_index
-                reads.append(read_id)
-                read_count += 1
-                u[read_index] = [[ref_index], [p_score], [float(p_score)], p_score]
-            else:
-                if read_index in u:
-                    if ref_index in u[read_index][0]:
-                        continue
-                    nu[read_index] = u[read_index]
-                    del u[read_index]
+    read_ranks = np.empty(read_count, dtype=np.int64)
+    read_ranks[np.argsort(first)] = np.arange(read_count)
+
+    reads = read_ranks[inverse.ravel()]
+
+    # Assign reference indexes in the order the references first appear in the selected records.
+    ref_ids, first, inverse = np.unique(records["ref"][kept_lines], return_index=True, return_inverse=True)
+
+    ref_order = np.argsort(first)
+
+    ref_ranks = np.empty(len(ref_ids), dtype=np.int64)
+    ref_ranks[ref_order] = np.arange(len(ref_ids))
+
+    refs = [alignments.refs[ref_index] for ref_index in ref_ids[ref_order].tolist()]
+
+    ref_indexes = ref_ranks[inverse.ravel()]
+    scores = records["score"][kept_lines]
+
+    # Find the first line for each distinct (read, ref) pair.
+    _, first, inverse = np.unique(reads * max(len(refs), 1) + ref_indexes, return_index=True, return_inverse=True)
+
+    # Order the entries by read and then by the order they appear in the file.
+    order = np.lexsort((first, reads[first]))
+
+    entry_indexes = np.empty(len(order), dtype=np.int64)
+    entry_indexes[order] = np.arange(len(order))
+
+    line_entries = np.full(len(records), -1, dtype=np.int64)
+    line_entries[kept_lines] = entry_indexes[inverse.ravel()]
+
+    entries = first[order]
+
+    first_lines = np.zeros(len(records), dtype=bool)
+    first_lines[kept_lines[entries]] = True
+
+    offsets = np.zeros(read_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(reads[entries], minlength=read_count), out=offsets[1:])
+
+    max_score = max(0, scores.max()) if len(scores) else 0
+    min_score = min(0, scores.min()) if len(scores) else 0
+
+    ref_indexes = ref_indexes[entries].astype(np.int32)
+    scores = rescale_samscore(scores[entries], max_score, min_score)
+
+    if not collapse:
+        return Matrix(refs, offsets, ref_indexes, scores, line_entries, first_lines)
+
+    offsets, ref_indexes, scores, class_entries, multiplicities = collapse_reads(offsets, ref_indexes, scores)
+
+    line_entries[kept_lines] = class_entries[line_entries[kept_lines]]
+
+    return Matrix(refs, offsets, ref_indexes, scores, line_entries, first_lines, multiplicities)
+
+
+def collapse_reads(offsets, ref_indexes, scores):
+    """
+    Collapse the reads in a CSR alignment matrix into equivalence classes. Reads belong to the same class when they
+    align to the same set of references with exactly the same scores.
+
+    Alignment scores are integers before rescaling, so reads are only grouped when the EM algorithm would treat them
+    identically. Each class row takes its entries, in order, from the first read in the class. Classes are ordered by
+    their first read.
+
+    :param offsets: the start offset of each read's entries
+    :param ref_indexes: the reference index for each entry
+    :param scores: the rescaled alignment score for each entry
+    :return: the class offsets, reference indexes, and scores, the class entry for each read entry, and the number of
+             reads in each class
+
+    """
+    read_count = len(offsets) - 1
+    lengths = np.diff(offsets)
+    rows = np.repeat(np.arange(read_count), lengths)
+
+    # Sort each read's entries by reference so reads with the same profile have identical rows.
+    canonical = np.lexsort((ref_indexes, rows))
+    canonical_refs = ref_indexes[canonical].astype(np.int64)
+    canonical_scores = scores[canonical].view(np.int64)
+
+    read_classes = np.empty(read_count, dtype=np.int64)
+    class_count = 0
+
+    # Rows of equal length are compared as the rows of a 2D array.
+    by_length = np.argsort(lengths, kind="stable")
+    sorted_lengths = lengths[by_length]
+
+    for length in np.unique(sorted_lengths).tolist():
+        group = by_length[np.searchsorted(sorted_lengths, length):np.searchsorted(sorted_lengths, length, "right")]
 
-                if ref_index in nu[read_index][0]:
-                    continue
+        group_entries = offsets[group][:, None] + np.arange(length)
 
-                nu[read_index][0].append(ref_index)
-                nu[read_index][1].append(p_score)
+        _, inverse = np.unique(
+            np.hstack((canonical_refs[group_entries], canonical_scores[group_entries])),
+            axis=0,
+            return_inverse=True
+        )
 
-                if p_score > nu[read_index][3]:
-                    nu[read_index][3] = p_score
+        inverse = inverse.ravel()
 
-    u, nu = rescale_samscore(u, nu, max_score, min_score)
+        read_classes[group] = class_count + inverse
+        class_count += int(inverse.max()) + 1
 
-    for read_index in u:
-        # keep ref_index and score only
-        u[read_index] = [u[read_index][0][0], u[read_index][1][0]]
+    # Order the classes by their first read.
+    _, representatives, inverse = np.unique(read_classes, return_index=True, return_inverse=True)
 
-    for read_index in nu:
-        p_score_sum = sum(nu[read_index][1])
-        # Normalize p_score.
-        nu[read_index][2] = [k / p_score_sum for k in nu[read_index][1]]
+    order = np.argsort(representatives)
 
-    return u, nu, refs, reads
+    class_ranks = np.empty(class_count, dtype=np.int64)
+    class_ranks[order] = np.arange(class_count)
 
+    read_classes = class_ranks[inverse.ravel()]
+    representatives = representatives[order]
 
-def em(u, nu, genomes, max_iter, epsilon, pi_prior, theta_prior):
-    genome_count = len(genomes)
+    class_lengths = lengths[representatives]
+
+    class_offsets = np.zeros(class_count + 1, dtype=np.int64)
+    np.cumsum(class_lengths, out=class_offsets[1:])
+
+    representative_entries = (
+        np.repeat(offsets[representatives] - class_offsets[:-1], class_lengths) + np.arange(class_offsets[-1])
+    )
+
+    class_ref_indexes = ref_indexes[representative_entries]
+
+    # Map each read entry to the entry for the same reference in its class.
+    ref_count = int(ref_indexes.max()) + 1 if len(ref_indexes) else 1
+
+    class_keys = np.repeat(np.arange(class_count), class_lengths) * ref_count + class_ref_indexes
+    read_keys = read_classes[rows] * ref_count + ref_indexes
+
+    sorter = np.argsort(class_keys)
+    class_entries = sorter[np.searchsorted(class_keys, read_keys, sorter=sorter)]
+
+    return (
+        class_offsets,
+        class_ref_indexes,
+        scores[representative_entries],
+        class_entries,
+        np.bincount(read_classes, minlength=class_count)
+    )
+
+
+def em(matrix, max_iter, epsilon, pi_prior, theta_prior, proc=1):
+    """
+    The reference, pure-Python implementation of the Pathoscope EM algorithm. It always runs in a single process and
+    ignores ``proc``, which is accepted for compatibility with the other :data:`EM_ENGINES`.
+
+    The proportions of each non-unique read assigned to its references are updated in place in :attr:`Matrix.x`.
+
+    :param matrix: the alignment matrix
+    :param max_iter: the maximum number of EM iterations
+    :param epsilon: the convergence cutoff for the change in pi
+    :param pi_prior: the prior for pi
+    :param theta_prior: the prior for theta
+    :return: the initial pi, final pi, final theta, and the number of iterations run and final change in pi
+
+    """
+    genome_count = len(matrix.refs)
 
     pi = [1. / genome_count] * genome_count
-    init_pi = copy.copy(pi)
-    theta = copy.copy(pi)
+    init_pi = list(pi)
+    theta = list(pi)
 
     pi_sum_0 = [0] * genome_count
 
-    u_weights = [u[i][1] for i in u]
+    offsets = matrix.offsets.tolist()
+    ref_indexes = matrix.ref_indexes.tolist()
+    scores = matrix.scores.tolist()
+
+    # Weight each row by the number of reads it represents.
+    weights = (matrix.weights * matrix.multiplicities).tolist()
+    max_weights = matrix.weights.tolist()
+
+    u = list()
+    nu = list()
+
+    for i in range(matrix.row_count):
+        if offsets[i + 1] - offsets[i] == 1:
+            u.append(i)
+        else:
+            nu.append(i)
+
+    u_weights = [weights[i] for i in u]
 
     max_u_weights = 0
     u_total = 0
 
     if u_weights:
-        max_u_weights = max(u_weights)
+        max_u_weights = max(max_weights[i] for i in u)
         u_total = sum(u_weights)
 
     for i in u:
-        pi_sum_0[u[i][0]] += u[i][1]
+        pi_sum_0[ref_indexes[offsets[i]]] += weights[i]
 
-    nu_weights = [nu[i][3] for i in nu]
+    nu_weights = [weights[i] for i in nu]
 
     max_nu_weights = 0
     nu_total = 0
 
     if nu_weights:
-        max_nu_weights = max(nu_weights)
+        max_nu_weights = max(max_weights[i] for i in nu)
         nu_total = sum(nu_weights)
 
     prior_weight = max(max_u_weights, max_nu_weights)
-    nu_length = len(nu)
+    nu_length = int(matrix.multiplicities[nu].sum())
 
     if nu_length == 0:
         nu_length = 1
 
+    x = matrix.x.tolist()
+
+    iterations = 0
+    cutoff = None
+
     # EM iterations
     for i in range(max_iter):
+        iterations += 1
+
         pi_old = pi
-        theta_sum = [0 for _ in genomes]
+        theta_sum = [0 for _ in matrix.refs]
 
         # E Step
         for j in nu:
-            z = nu[j]
+            start = offsets[j]
+            end = offsets[j + 1]
 
             # A set of any genome mapping with j
-            ind = z[0]
-
-            # Get relevant pis for the read
-            pi_tmp = [pi[k] for k in ind]
-
-            # Get relevant thetas for the read.
-            theta_tmp = [theta[k] for k in ind]
+            ind = ref_indexes[start:end]
 
             # Calculate non-normalized xs
-            x_tmp = [1. * pi_tmp[k] * theta_tmp[k] * z[1][k] for k in range(len(ind))]
+            x_tmp = [1. * pi[k] * theta[k] * score for k, score in zip(ind, scores[start:end])]
 
             x_sum = sum(x_tmp)
 
@@ -200,12 +425,12 @@ def em(u, nu, genomes, max_iter, epsilon, pi_prior, theta_prior):
                 # Normalize new xs.
                 x_norm = [1. * k / x_sum for k in x_tmp]
 
-            # Update x in nu.
-            nu[j][2] = x_norm
+            # Update x for the read.
+            x[start:end] = x_norm
 
             for k, _ in enumerate(ind):
                 # Keep weighted running tally for theta
-                theta_sum[ind[k]] += x_norm[k] * nu[j][3]
+                theta_sum[ind[k]] += x_norm[k] * weights[j]
 
         # M step
         pi_sum = [theta_sum[k] + pi_sum_0[k] for k in range(len(theta_sum))]
@@ -234,66 +459,427 @@ def em(u, nu, genomes, max_iter, epsilon, pi_prior, theta_prior):
         if cutoff <= epsilon or nu_length == 1:
             break
 
-    return init_pi, pi, theta, nu
+    matrix.x[:] = x
+
+    return init_pi, pi, theta, {"iterations": iterations, "delta": cutoff}
+
+
+#: The number of non-unique rows in each block of the E-step. The blocks are the same no matter how many processes are
+#: used, so the summation order, and therefore the result, does not depend on the process count.
+E_STEP_BLOCK_ROWS = 65536
+
+# The shared E-step arrays in a worker process. Set by :func:`init_e_step_worker`.
+_worker_arrays = None
+
+
+def e_step(pi, theta, offsets, ref_indexes, scores, entry_weights, genome_count):
+    """
+    Perform the E-step for a block of non-unique rows.
+
+    :param pi: the current pi
+    :param theta: the current theta
+    :param offsets: the start offset of each row's entries relative to the start of the block
+    :param ref_indexes: the reference index for each entry in the block
+    :param scores: the rescaled alignment score for each entry in the block
+    :param entry_weights: the row weight for each entry in the block
+    :param genome_count: the number of references
+    :return: the normalized proportions for the entries in the block and the block's weighted tally for theta
+
+    """
+    x = pi[ref_indexes] * theta[ref_indexes] * scores
+
+    if len(offsets) > 1:
+        x_sum = np.repeat(np.add.reduceat(x, offsets[:-1]), np.diff(offsets))
+    else:
+        x_sum = x
+
+    # Avoid dividing by 0 at all times.
+    x_norm = np.divide(x, x_sum, out=np.zeros_like(x), where=x_sum != 0)
+
+    # Keep weighted running tally for theta
+    theta_sum = np.bincount(ref_indexes, weights=x_norm * entry_weights, minlength=genome_count)
+
+    return x_norm, theta_sum
+
+
+def run_e_step_blocks(pi, theta, blocks, arrays):
+    """
+    Run the E-step for the given ``blocks`` of rows. The proportions and the partial theta tally for each block are
+    written to the ``x_norm`` and ``partials`` output arrays.
+
+    :param pi: the current pi
+    :param theta: the current theta
+    :param blocks: the indexes of the blocks to process
+    :param arrays: the E-step input and output arrays keyed by name
+
+    """
+    offsets = arrays["offsets"]
+    genome_count = len(pi)
+
+    for block in blocks:
+        start = offsets[block * E_STEP_BLOCK_ROWS]
+        end = offsets[min((block + 1) * E_STEP_BLOCK_ROWS, len(offsets) - 1)]
+
+        block_offsets = offsets[block * E_STEP_BLOCK_ROWS:(block + 1) * E_STEP_BLOCK_ROWS + 1] - start
+
+        x_norm, theta_sum = e_step(
+            pi,
+            theta,
+            block_offsets,
+            arrays["ref_indexes"][start:end],
+            arrays["scores"][start:end],
+            arrays["entry_weights"][start:end],
+            genome_count
+        )
+
+        arrays["x_norm"][start:end] = x_norm
+        arrays["partials"][block * genome_count:(block + 1) * genome_count] = theta_sum
+
+
+def init_e_step_worker(shared):
+    """
+    Initialize an E-step worker process by wrapping the shared memory arrays in NumPy arrays.
+
+    :param shared: tuples of name, :func:`multiprocessing.RawArray`, and NumPy dtype for each shared array
+
+    """
+    global _worker_arrays
+    _worker_arrays = {name: np.frombuffer(raw, dtype=dtype) for name, raw, dtype in shared}
+
+
+def e_step_worker(args):
+    pi, theta, blocks = args
+    run_e_step_blocks(pi, theta, blocks, _worker_arrays)
+
+
+def share_array(array):
+    """
+    Copy ``array`` into shared memory that can be passed to a worker process.
+
+    :param array: a one-dimensional NumPy array
+    :return: the shared :func:`multiprocessing.RawArray` and a NumPy array backed by it
+
+    """
+    raw = multiprocessing.RawArray("b", max(array.nbytes, 1))
+    shared = np.frombuffer(raw, dtype=array.dtype, count=len(array))
+    shared[:] = array
+
+    return raw, shared
+
+
+@contextlib.contextmanager
+def prepare_em_step(matrix, pi_prior, theta_prior, proc=1):
+    """
+    Prepare a function that performs a single EM iteration using batched NumPy operations on the CSR arrays of the
+    ``matrix``. Use as a context manager.
+
+    The returned function takes the current pi and theta and returns the updated pi and theta along with the new
+    proportions for the non-unique entries.
 
+    The non-unique rows are split into blocks of :data:`E_STEP_BLOCK_ROWS` rows. If ``proc`` is greater than one, the
+    blocks are divided between a pool of worker processes that read the matrix from shared memory. The partial theta
+    tallies for the blocks are always reduced in block order, so the result is identical for any value of ``proc``.
+
+    :param matrix: the alignment matrix
+    :param pi_prior: the prior for pi
+    :param theta_prior: the prior for theta
+    :param proc: the number of processes to use for the E-step
+    :return: the step function, a boolean array selecting the non-unique entries, and the number of non-unique reads
+
+    """
+    genome_count = len(matrix.refs)
+
+    lengths = matrix.lengths
+    rows = matrix.rows
+
+    unique = lengths == 1
+    unique_entries = unique[rows]
+
+    # Weight each row by the number of reads it represents.
+    weights = matrix.weights * matrix.multiplicities
+
+    u_weights = weights[unique]
+
+    pi_sum_0 = np.bincount(matrix.ref_indexes[unique_entries], weights=u_weights, minlength=genome_count)
+
+    max_u_weights = 0
+    u_total = 0
+
+    if len(u_weights):
+        max_u_weights = matrix.weights[unique].max()
+        u_total = u_weights.sum()
+
+    # Extract a CSR matrix containing only the non-unique rows.
+    nu_entries = ~unique_entries
+    nu_weights = weights[~unique]
+
+    offsets = np.zeros(len(nu_weights) + 1, dtype=np.int64)
+    np.cumsum(lengths[~unique], out=offsets[1:])
+
+    max_nu_weights = 0
+    nu_total = 0
+
+    if len(nu_weights):
+        max_nu_weights = matrix.weights[~unique].max()
+        nu_total = nu_weights.sum()
+
+    prior_weight = max(max_u_weights, max_nu_weights)
+    nu_length = int(matrix.multiplicities[~unique].sum())
+
+    if nu_length == 0:
+        nu_length = 1
+
+    pip = pi_prior * prior_weight
+    theta_p = theta_prior * prior_weight
+
+    nu_total_div = nu_total
+
+    if nu_total_div == 0:
+        nu_total_div = 1
+
+    block_count = max(1, -(-len(nu_weights) // E_STEP_BLOCK_ROWS))
+
+    arrays = {
+        "offsets": offsets,
+        "ref_indexes": matrix.ref_indexes[nu_entries],
+        "scores": matrix.scores[nu_entries],
+        # The read weight for every entry in the non-unique matrix.
+        "entry_weights": np.repeat(nu_weights, np.diff(offsets)),
+        "x_norm": np.zeros(offsets[-1]),
+        "partials": np.zeros(block_count * genome_count)
+    }
+
+    worker_count = min(proc, block_count)
+
+    pool = None
+
+    if worker_count > 1:
+        shared = list()
+
+        for name, array in arrays.items():
+            raw, arrays[name] = share_array(array)
+            shared.append((name, raw, array.dtype.str))
+
+        pool = multiprocessing.Pool(worker_count, init_e_step_worker, (shared,))
+
+    # Assign contiguous runs of blocks to each worker.
+    assignments = [list(blocks) for blocks in np.array_split(np.arange(block_count), max(worker_count, 1))]
+
+    def step(pi, theta):
+        # E Step
+        if pool is None:
+            run_e_step_blocks(pi, theta, range(block_count), arrays)
+        else:
+            pool.map(e_step_worker, [(pi, theta, blocks) for blocks in assignments])
+
+        partials = arrays["partials"].reshape(block_count, genome_count)
+
+        theta_sum = partials[0].copy()
+
+        for partial in partials[1:]:
+            theta_sum += partial
+
+        # M step
+        pi_sum = theta_sum + pi_sum_0
+
+        # Update pi.
+        pi = (pi_sum + pip) / (u_total + nu_total + pip * genome_count)
+
+        theta = (theta_sum + theta_p) / (nu_total_div + theta_p * genome_count)
+
+        return pi, theta, arrays["x_norm"]
 
-def find_updated_score(nu, read_index, ref_index):
     try:
-        index = nu[read_index][0].index(ref_index)
-    except ValueError:
-        return 0.0, 0.0
+        yield step, nu_entries, nu_length
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-    p_score_sum = 0.0
 
-    for p_score in nu[read_index][1]:
-        p_score_sum += p_score
+def em_vectorized(matrix, max_iter, epsilon, pi_prior, theta_prior, proc=1):
+    """
+    A drop-in replacement for :func:`em` that performs the E and M steps using batched NumPy operations on the CSR
+    arrays of the ``matrix`` instead of per-read Python loops. The E-step can be run in ``proc`` processes (see
+    :func:`prepare_em_step`).
 
-    updated_pscore = nu[read_index][2][index]
+    The returned values are equal to those returned by :func:`em` within floating point tolerance.
 
-    return updated_pscore
+    """
+    with prepare_em_step(matrix, pi_prior, theta_prior, proc) as (step, nu_entries, nu_length):
+        genome_count = len(matrix.refs)
 
+        pi = np.full(genome_count, 1. / genome_count)
+        init_pi = pi.copy()
+        theta = pi.copy()
 
-def compute_best_hit(u, nu, refs, reads):
-    ref_count = len(refs)
+        x_norm = None
 
-    best_hit_reads = [0.0] * ref_count
-    level_1_reads = [0.0] * ref_count
-    level_2_reads = [0.0] * ref_count
+        iterations = 0
+        cutoff = None
 
-    for i in u:
-        best_hit_reads[u[i][0]] += 1
-        level_1_reads[u[i][0]] += 1
+        # EM iterations
+        for i in range(max_iter):
+            iterations += 1
+
+            pi_old = pi
+
+            pi, theta, x_norm = step(pi, theta)
+
+            if i == 0:
+                init_pi = pi
+
+            cutoff = float(np.abs(pi_old - pi).sum())
+
+            if cutoff <= epsilon or nu_length == 1:
+                break
+
+        if x_norm is not None:
+            matrix.x[nu_entries] = x_norm
+
+        return init_pi.tolist(), pi.tolist(), theta.tolist(), {"iterations": iterations, "delta": cutoff}
+
+
+def em_squarem(matrix, max_iter, epsilon, pi_prior, theta_prior, proc=1):
+    """
+    A drop-in replacement for :func:`em` that accelerates convergence using the SQUAREM extrapolation scheme (Varadhan
+    and Roland, 2008). The E-step can be run in ``proc`` processes (see :func:`prepare_em_step`).
+
+    Each cycle takes two EM steps from the current pi and theta, extrapolates along the change between them, and then
+    takes a stabilizing EM step from the extrapolated point. The extrapolation is abandoned in favour of the second
+    plain EM step if it would make any proportion negative.
+
+    ``max_iter`` limits the total number of EM steps, so iteration counts are directly comparable with :func:`em`.
+    The results converge to the same fixed point as :func:`em`, but are not identical to it for a given number of
+    iterations.
+
+    """
+    with prepare_em_step(matrix, pi_prior, theta_prior, proc) as (step, nu_entries, nu_length):
+        genome_count = len(matrix.refs)
+
+        pi = np.full(genome_count, 1. / genome_count)
+        init_pi = pi
+        theta = pi.copy()
+
+        x_norm = None
+
+        iterations = 0
+        cutoff = None
+
+        def converged():
+            return iterations == max_iter or cutoff <= epsilon or nu_length == 1
+
+        while iterations < max_iter:
+            pi_0, theta_0 = pi, theta
+
+            pi, theta, x_norm = step(pi_0, theta_0)
+            iterations += 1
+
+            if iterations == 1:
+                init_pi = pi
+
+            cutoff = float(np.abs(pi_0 - pi).sum())
 
-    for j in nu:
-        z = nu[j]
-        ind = z[0]
-        x_norm = z[2]
-        best_ref = max(x_norm)
-        num_best_ref = 0
+            if converged():
+                break
 
-        for i, _ in enumerate(x_norm):
-            if x_norm[i] == best_ref:
-                num_best_ref += 1
+            pi_1, theta_1 = pi, theta
 
-        num_best_ref = num_best_ref or 1
+            pi, theta, x_norm = step(pi_1, theta_1)
+            iterations += 1
 
-        for i, _ in enumerate(x_norm):
-            if x_norm[i] == best_ref:
-                best_hit_reads[ind[i]] += 1.0 / num_best_ref
+            cutoff = float(np.abs(pi_1 - pi).sum())
 
-                if x_norm[i] >= 0.5:
-                    level_1_reads[ind[i]] += 1
-                elif x_norm[i] >= 0.01:
-                    level_2_reads[ind[i]] += 1
+            if converged():
+                break
 
-    ref_count = len(refs)
-    read_count = len(reads)
+            r = np.concatenate((pi_1 - pi_0, theta_1 - theta_0))
+            v = np.concatenate((pi - pi_1, theta - theta_1)) - r
 
-    best_hit = [best_hit_reads[k] / read_count for k in range(ref_count)]
-    level_1 = [level_1_reads[k] / read_count for k in range(ref_count)]
-    level_2 = [level_2_reads[k] / read_count for k in range(ref_count)]
+            v_norm = np.linalg.norm(v)
 
-    return best_hit_reads, best_hit, level_1, level_2
+            # A step length of -1 reproduces the second plain EM step.
+            alpha = min(-np.linalg.norm(r) / v_norm, -1.0) if v_norm > 0 else -1.0
+
+            extrapolated = np.concatenate((pi_0, theta_0)) - 2 * alpha * r + alpha ** 2 * v
+
+            if (extrapolated < 0).any():
+                extrapolated = np.concatenate((pi, theta))
+
+            pi_x = extrapolated[:genome_count]
+            theta_x = extrapolated[genome_count:]
+
+            pi, theta, x_norm = step(pi_x, theta_x)
+            iterations += 1
+
+            cutoff = float(np.abs(pi_x - pi).sum())
+
+            if converged():
+                break
+
+        if x_norm is not None:
+            matrix.x[nu_entries] = x_norm
+
+        return init_pi.tolist(), pi.tolist(), theta.tolist(), {"iterations": iterations, "delta": cutoff}
+
+
+#: The available implementations of the Pathoscope EM algorithm keyed by the names used to select them in settings.
+EM_ENGINES = {
+    "python": em,
+    "numpy": em_vectorized,
+    "squarem": em_squarem
+}
+
+
+def compute_best_hit(matrix):
+    """
+    Calculate the best hit read counts and proportions and the high and low confidence hit proportions for each
+    reference using the current read assignments in :attr:`Matrix.x`.
+
+    :param matrix: the alignment matrix
+    :return: the best hit read counts, best hit proportions, high confidence and low confidence hit proportions
+
+    """
+    ref_count = len(matrix.refs)
+    read_count = matrix.read_count
+
+    x_norm = matrix.x
+    rows = matrix.rows
+
+    if matrix.row_count:
+        best_ref = np.maximum.reduceat(x_norm, matrix.offsets[:-1])[rows]
+    else:
+        best_ref = x_norm
+
+    is_best = x_norm == best_ref
+
+    num_best_ref = np.bincount(rows[is_best], minlength=matrix.row_count)
+
+    # Tally uniquely mapped reads before non-unique reads. This matches the summation order of the original
+    # implementation.
+    best_entries = np.flatnonzero(is_best)
+    best_entries = best_entries[np.argsort(matrix.lengths[rows[best_entries]] > 1, kind="stable")]
+    best_refs = matrix.ref_indexes[best_entries]
+    best_x = x_norm[best_entries]
+    best_multiplicities = matrix.multiplicities[rows[best_entries]]
+
+    best_hit_reads = np.bincount(
+        best_refs,
+        weights=best_multiplicities / num_best_ref[rows[best_entries]],
+        minlength=ref_count
+    )
+
+    level_1 = best_x >= 0.5
+    level_2 = (best_x < 0.5) & (best_x >= 0.01)
+
+    level_1_reads = np.bincount(best_refs[level_1], weights=best_multiplicities[level_1], minlength=ref_count)
+    level_2_reads = np.bincount(best_refs[level_2], weights=best_multiplicities[level_2], minlength=ref_count)
+
+    best_hit = (best_hit_reads / read_count).tolist()
+    level_1 = (level_1_reads / read_count).tolist()
+    level_2 = (level_2_reads / read_count).tolist()
+
+    return best_hit_reads.tolist(), best_hit, level_1, level_2
 
 
 def write_report(path, pi, refs, read_count, init_pi, best_hit_initial, best_hit_initial_reads, best_hit_final,
@@ -389,108 +975,176 @@ def write_report(path, pi, refs, read_count, init_pi, best_hit_initial, best_hit
     return results
 
 
-def rewrite_align(u, nu, vta_path, p_score_cutoff, path):
-    with open(path, 'w') as of:
-        with open(vta_path, 'r') as in1:
-            read_id_dict = {}
-            ref_id_dict = {}
-            genomes = []
-            read = []
-            ref_count = 0
-            read_count = 0
+def reassigned_mask(matrix, p_score_cutoff):
+    """
+    Return a boolean array selecting the records in the matrix's source VTA file that remain after reassignment.
+
+    The first alignment of each uniquely mapped read is retained. Alignments of non-unique reads are retained if the
+    proportion of the read assigned to the reference is at least ``p_score_cutoff``.
+
+    If the matrix rows are read equivalence classes, the assignments for each class are applied to all of its reads.
+
+    :param matrix: the alignment matrix updated by the EM algorithm
+    :param p_score_cutoff: the minimum assigned proportion for a non-unique alignment to be retained
+    :return: a boolean array with one element per record
+
+    """
+    unique_entries = (matrix.lengths == 1)[matrix.rows]
+
+    lines = np.flatnonzero(matrix.line_entries != -1)
+    entries = matrix.line_entries[lines]
+
+    unique_lines = unique_entries[entries]
 
-            for line in in1:
-                read_id, ref_id, _, _, p_score = line.split(",")
+    mask = np.zeros(len(matrix.line_entries), dtype=bool)
 
-                p_score = float(p_score)
+    # Only keep the first line for each uniquely mapped read.
+    mask[lines[unique_lines & matrix.first_lines[lines]]] = True
+    mask[lines[~unique_lines & (matrix.x[entries] >= p_score_cutoff)]] = True
 
-                if p_score < p_score_cutoff:
-                    continue
+    return mask
 
-                ref_index = ref_id_dict.get(ref_id, -1)
 
-                if ref_index == -1:
-                    ref_index = ref_count
-                    ref_id_dict[ref_id] = ref_index
-                    genomes.append(ref_id)
-                    ref_count += 1
+def rewrite_align(matrix, vta_path, p_score_cutoff, path):
+    """
+    Write the alignments from the VTA file at ``vta_path`` that remain after reassignment to a new VTA file at
+    ``path``. See :func:`reassigned_mask`.
 
-                read_index = read_id_dict.get(read_id, -1)
+    :param matrix: the alignment matrix built from ``vta_path`` and updated by the EM algorithm
+    :param vta_path: the path to the VTA file used to build the matrix
+    :param p_score_cutoff: the minimum assigned proportion for a non-unique alignment to be retained
+    :param path: the path to write the new VTA file to
 
-                if read_index == -1:
-                    # hold on this new read
-                    # first, wrap previous read profile and see if any previous read has a same profile with that!
-                    read_index = read_count
-                    read_id_dict[read_id] = read_index
-                    read.append(read_id)
-                    read_count += 1
-                    if read_index in u:
-                        of.write(line)
-                        continue
+    """
+    alignments = virtool.vta.load(vta_path)
 
-                if read_index in nu:
-                    if find_updated_score(nu, read_index, ref_index) < p_score_cutoff:
-                        continue
+    mask = reassigned_mask(matrix, p_score_cutoff)
 
-                    of.write(line)
+    virtool.vta.write(path, alignments.records[mask], alignments.read_table, alignments.refs)
 
 
 def calculate_coverage(vta_path, ref_lengths):
-    coverage_dict = dict()
-    pos_length_list = list()
+    alignments = virtool.vta.load(vta_path)
+    return count_coverage(alignments.records, alignments.refs, ref_lengths)
+
+
+def count_coverage(records, refs, ref_lengths):
+    """
+    Calculate the per-base coverage for each reference that appears in ``records``.
+
+    Each alignment adds one to a difference array at its first base and subtracts one after its last base. A cumulative
+    sum over the difference array gives the depth at every base. All references share one buffer, with one spare slot
+    after each reference so the differences for one reference never leak into the next.
+
+    :param records: an array of VTA records
+    :param refs: the reference IDs indexed by the ``ref`` field of the records
+    :param ref_lengths: the length of each reference keyed by reference ID
+    :return: an int32 array of per-base depths keyed by reference ID
+
+    """
+    ref_indexes = np.unique(records["ref"])
+
+    lengths = np.array([ref_lengths[refs[ref_index]] for ref_index in ref_indexes.tolist()], dtype=np.int64)
 
-    with open(vta_path, "r") as old_handle:
-        for line in old_handle:
-            _, ref_id, pos, length, _ = line.split(",")
+    bases = np.zeros(len(ref_indexes) + 1, dtype=np.int64)
+    np.cumsum(lengths + 1, out=bases[1:])
 
-            coverage_dict[ref_id] = None
-            pos_length_list.append((ref_id, int(pos), int(length)))
+    segments = np.searchsorted(ref_indexes, records["ref"])
 
-    for key in coverage_dict:
-        coverage_dict[key] = [0] * ref_lengths[key]
+    record_lengths = lengths[segments]
 
-    for ref_id, pos, length in pos_length_list:
-        start_index = pos - 1
+    starts = np.clip(records["pos"].astype(np.int64) - 1, 0, record_lengths)
+    ends = np.clip(starts + records["length"], starts, record_lengths)
 
-        for i in range(start_index, start_index + length):
-            try:
-                coverage_dict[ref_id][i] += 1
-            except IndexError:
-                pass
+    differences = np.bincount(bases[segments] + starts, minlength=bases[-1])
+    differences -= np.bincount(bases[segments] + ends, minlength=bases[-1])
 
-    return coverage_dict
+    depths = np.cumsum(differences).astype(np.int32)
 
+    return {
+        refs[ref_index]: depths[bases[i]:bases[i] + lengths[i]] for i, ref_index in enumerate(ref_indexes.tolist())
+    }
 
-def subtract(analysis_path, host_scores):
-    subtracted_count = 0
 
-    vta_path = os.path.join(analysis_path, "to_isolates.vta")
+def run_length_encode(depths) -> dict:
+    """
+    Run-length encode an array of per-base depths.
 
-    isolates_high_scores = collections.defaultdict(int)
+    :param depths: an array of per-base depths
+    :return: the depth of each run and the length of each run
+
+    """
+    depths = np.asarray(depths)
 
-    with open(vta_path, "r") as handle:
-        for line in handle:
-            fields = line.rstrip().split(",")
-            read_id = fields[0]
-            isolates_high_scores[read_id] = max(isolates_high_scores[read_id], float(fields[4]))
+    if len(depths) == 0:
+        return {"values": [], "lengths": []}
 
-    out_path = os.path.join(analysis_path, "subtracted.vta")
+    starts = np.flatnonzero(np.diff(depths)) + 1
+    starts = np.concatenate(([0], starts))
+
+    return {
+        "values": depths[starts].tolist(),
+        "lengths": np.diff(np.append(starts, len(depths))).tolist()
+    }
+
+
+def median_depth(depths):
+    """
+    Calculate the median of an array of per-base depths. The return value is the same as that of
+    :func:`statistics.median`: an ``int`` for odd-length arrays and a ``float`` for even-length arrays.
 
-    total_count = 0
+    :param depths: an array of per-base depths
+    :return: the median depth
 
-    with open(vta_path, "r") as vta_handle:
-        with open(out_path, "w") as out_handle:
-            for line in vta_handle:
-                total_count += 1
-                fields = line.rstrip().split(",")
-                read_id = fields[0]
-                if isolates_high_scores[read_id] > host_scores.get(read_id, 0):
-                    out_handle.write(line)
-                else:
-                    subtracted_count += 1
+    """
+    count = len(depths)
+    middle = count // 2
+
+    if count % 2:
+        return int(np.partition(depths, middle)[middle])
+
+    partitioned = np.partition(depths, [middle - 1, middle])
+
+    return (int(partitioned[middle - 1]) + int(partitioned[middle])) / 2
+
+
+def summarize_coverage(depths) -> dict:
+    """
+    Calculate the coverage statistics for a single reference and run-length encode its per-base depths for storage in
+    an analysis document.
+
+    :param depths: an array of per-base depths
+    :return: the coverage fraction, mean depth, median depth, and encoded depths
+
+    """
+    length = len(depths)
+
+    return {
+        "coverage": round(1 - (length - np.count_nonzero(depths)) / length, 3),
+        "depth": round(int(np.sum(depths, dtype=np.int64)) / length),
+        "median_depth": median_depth(depths),
+        "align_rle": run_length_encode(depths)
+    }
+
+
+def subtraction_mask(alignments, host_scores):
+    """
+    Return a boolean array selecting the records for reads that align better to the isolates than to the subtraction
+    host.
+
+    :param alignments: the alignments loaded from a VTA file
+    :param host_scores: the highest host alignment score for each read keyed by read ID
+    :return: a boolean array with one element per record
+
+    """
+    records = alignments.records
 
-    os.remove(vta_path)
+    isolates_high_scores = np.zeros(int(records["read"].max()) + 1 if len(records) else 0)
+    np.maximum.at(isolates_high_scores, records["read"], records["score"])
 
-    shutil.move(out_path, vta_path)
+    read_host_scores = np.fromiter(
+        (host_scores.get(read_id, 0) for read_id in alignments.iter_read_ids()),
+        dtype=np.float64
+    )[:len(isolates_high_scores)]
 
-    return subtracted_count
+    return (isolates_high_scores > read_host_scores)[records["read"]]
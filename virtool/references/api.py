@@ -491,6 +491,9 @@ async def create(req):
     "internal_control": {
         "type": "string"
     },
+    "build_isolate_index": {
+        "type": "boolean"
+    },
     "restrict_source_types": {
         "type": "boolean"
     },
@@ -925,6 +925,7 @@ async def create_document(db, settings, name, organism, description, data_type,
         "name": name,
         "organism": organism,
         "internal_control": None,
+        "build_isolate_index": False,
         "restrict_source_types": False,
         "source_types": settings["default_source_types"],
         "groups": list(),
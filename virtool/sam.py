@@ -0,0 +1,333 @@
+"""
+Fast filters for SAM output from Bowtie2.
+
+The filters read SAM data in large blocks of complete lines and only parse the fields Virtool needs: QNAME, FLAG,
+RNAME, POS, the length of SEQ, and the Bowtie2 ``AS:i`` alignment score. Lines are never decoded or split. Instead,
+the offsets of newlines and tabs in each block are found with NumPy and the fields are located and parsed for all lines
+in the block at once. Only the read and reference IDs that are kept are sliced out of the block.
+
+Each filter takes a binary file object and consumes it until EOF. They are intended to be passed as the
+``stdout_filter`` argument of :meth:`virtool.jobs.job.Job.run_subprocess`, which runs them in a separate process so
+that filtering can keep up with ``bowtie2`` running on many threads.
+
+"""
+import numpy as np
+
+import virtool.vta
+
+#: The maximum number of bytes read from a SAM file at once.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+#: The number of mandatory fields in a SAM line.
+MANDATORY_FIELD_COUNT = 11
+
+AS_TAG = b"\tAS:i:"
+
+NEWLINE = ord("\n")
+
+
+class Block:
+    """
+    The mapped alignments parsed from a block of SAM lines by :func:`parse_block`.
+
+    Read and reference IDs are stored as offsets in the original block and are only sliced out when requested.
+
+    """
+
+    __slots__ = ("data", "qname_spans", "rname_spans", "flags", "pos", "lengths", "scores")
+
+    def __init__(self, data, qname_spans, rname_spans, flags, pos, lengths, scores):
+        #: The block of SAM lines.
+        self.data = data
+
+        #: The start and end offsets of the QNAME field of each alignment.
+        self.qname_spans = qname_spans
+
+        #: The start and end offsets of the RNAME field of each alignment.
+        self.rname_spans = rname_spans
+
+        self.flags = flags
+        self.pos = pos
+        self.lengths = lengths
+
+        #: The Bowtie2 ``AS:i`` alignment score plus the read length. This is the same value returned by
+        #: :func:`virtool.pathoscope.find_sam_align_score`.
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, mask):
+        """
+        Return a new :class:`Block` containing only the alignments selected by ``mask``.
+
+        """
+        return Block(
+            self.data,
+            self.qname_spans[mask],
+            self.rname_spans[mask],
+            self.flags[mask],
+            self.pos[mask],
+            self.lengths[mask],
+            self.scores[mask]
+        )
+
+    def qnames(self) -> list:
+        return slice_spans(self.data, self.qname_spans)
+
+    def rnames(self) -> list:
+        return slice_spans(self.data, self.rname_spans)
+
+
+def slice_spans(data: bytes, spans) -> list:
+    return [data[start:end] for start, end in spans.tolist()]
+
+
+def read_blocks(handle, block_size: int = BLOCK_SIZE):
+    """
+    Read blocks of complete lines from a binary file object. A final line without a trailing newline is included in
+    the last block.
+
+    :param handle: a binary file object
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of blocks
+
+    """
+    read = getattr(handle, "read1", handle.read)
+
+    remainder = b""
+
+    while True:
+        block = read(block_size)
+
+        if not block:
+            break
+
+        end = block.rfind(b"\n") + 1
+
+        if not end:
+            remainder += block
+            continue
+
+        yield b"".join((remainder, memoryview(block)[:end]))
+
+        remainder = block[end:]
+
+    if remainder:
+        yield remainder
+
+
+def parse_ints(array, starts, ends):
+    """
+    Parse the decimal integers found between each pair of ``starts`` and ``ends`` offsets in a ``uint8`` array.
+
+    :param array: the array to parse integers from
+    :param starts: the start offset of each integer
+    :param ends: the end offset of each integer
+    :return: an ``int64`` array of parsed integers
+
+    """
+    if not len(starts):
+        return np.zeros(0, dtype=np.int64)
+
+    negative = array[starts] == ord("-")
+
+    starts = starts + negative
+    lengths = ends - starts
+
+    if lengths.min() < 1:
+        raise ValueError("Could not parse integer field")
+
+    values = np.zeros(len(starts), dtype=np.int64)
+
+    # Parse one digit position at a time for all integers. The integers in SAM fields are short, so this only loops a
+    # few times.
+    for i in range(lengths.max()):
+        active = lengths > i
+
+        digits = array[np.minimum(starts + i, len(array) - 1)].astype(np.int64) - ord("0")
+
+        if (active & ((digits < 0) | (digits > 9))).any():
+            raise ValueError("Could not parse integer field")
+
+        values = np.where(active, values * 10 + digits, values)
+
+    return np.where(negative, -values, values)
+
+
+def parse_block(block: bytes) -> Block:
+    """
+    Parse the mapped alignments in a block of complete SAM lines. Header lines, unmapped segments, and alignments
+    without a reference are skipped.
+
+    :param block: a block of complete SAM lines
+    :return: the parsed alignments
+
+    """
+    if not block.endswith(b"\n"):
+        block += b"\n"
+
+    array = np.frombuffer(block, dtype=np.uint8)
+
+    # Tabs and newlines are the only characters in SAM text with values of 10 or less, so the offsets of all field
+    # separators can be found in one pass.
+    separators = np.flatnonzero(array <= NEWLINE)
+
+    # The indexes in ``separators`` of the newline at the end of each line.
+    newlines = np.flatnonzero(array[separators] == NEWLINE)
+
+    # The index in ``separators`` of the separator following the first field of each line. The separator following
+    # field ``i`` is ``separators[first + i]``.
+    first = np.concatenate(([0], newlines[:-1] + 1))
+    line_starts = np.concatenate(([0], separators[newlines[:-1]] + 1))
+
+    # Skip empty lines and header or comment lines.
+    keep = line_starts < separators[newlines]
+    keep[keep] = (array[line_starts[keep]] != ord("@")) & (array[line_starts[keep]] != ord("#"))
+
+    first = first[keep]
+    newlines = newlines[keep]
+    line_starts = line_starts[keep]
+
+    if (newlines - first < MANDATORY_FIELD_COUNT - 1).any():
+        raise ValueError("SAM line has too few fields")
+
+    flags = parse_ints(array, separators[first] + 1, separators[first + 1])
+
+    rname_starts = separators[first + 1] + 1
+    rname_ends = separators[first + 2]
+
+    # Bitwise FLAG - 0x4: segment unmapped. An RNAME of "*" means no reference was assigned.
+    no_ref = (rname_ends - rname_starts == 1) & (array[rname_starts] == ord("*"))
+    mapped = (flags & 0x4 == 0) & ~no_ref
+
+    first = first[mapped]
+    newlines = newlines[mapped]
+
+    seq_ends = separators[first + MANDATORY_FIELD_COUNT - 2]
+    lengths = seq_ends - separators[first + MANDATORY_FIELD_COUNT - 3] - 1
+
+    # Bowtie2 writes the AS:i: tag as the first optional field. Check for it there in all lines at once and only search
+    # the rest of the line when it is not found.
+    score_separators = first + MANDATORY_FIELD_COUNT - 1
+
+    found = score_separators < newlines
+
+    for i, char in enumerate(AS_TAG[1:], 1):
+        offsets = np.minimum(separators[score_separators[found]] + i, len(array) - 1)
+        found[found] = array[offsets] == char
+
+    for i in np.flatnonzero(~found).tolist():
+        offset = block.find(AS_TAG, seq_ends[i], separators[newlines[i]])
+
+        if offset == -1:
+            raise ValueError("Could not find alignment score")
+
+        score_separators[i] = np.searchsorted(separators, offset)
+
+    # The score ends at the next separator, which is either a tab or the end of the line.
+    score_starts = separators[score_separators] + len(AS_TAG)
+    score_ends = separators[score_separators + 1]
+
+    scores = parse_ints(array, score_starts, score_ends) + lengths.astype(np.float64)
+
+    return Block(
+        block,
+        np.column_stack((line_starts[mapped], separators[first])),
+        np.column_stack((rname_starts[mapped], rname_ends[mapped])),
+        flags[mapped],
+        parse_ints(array, separators[first + 2] + 1, separators[first + 3]),
+        lengths,
+        scores
+    )
+
+
+def iter_blocks(handle, block_size: int = BLOCK_SIZE):
+    """
+    Iterate through parsed blocks of alignments from a binary SAM file object. See :func:`parse_block`.
+
+    """
+    for block in read_blocks(handle, block_size):
+        yield parse_block(block)
+
+
+def iter_alignments(handle, block_size: int = BLOCK_SIZE):
+    """
+    Iterate through the mapped alignments in a binary SAM file object.
+
+    :param handle: a binary SAM file object
+    :param block_size: the maximum number of bytes to read at once
+    :return: a generator of ``(qname, flag, rname, pos, length, score)`` tuples with ``qname`` and ``rname`` as bytes
+
+    """
+    for block in iter_blocks(handle, block_size):
+        yield from zip(
+            block.qnames(),
+            block.flags.tolist(),
+            block.rnames(),
+            block.pos.tolist(),
+            block.lengths.tolist(),
+            block.scores.tolist()
+        )
+
+
+def filter_alignments(handle, vta_path: str, p_score_cutoff: float = 0.01) -> int:
+    """
+    Write the alignments in ``handle`` with a score of at least ``p_score_cutoff`` to a VTA file.
+
+    :param handle: a binary SAM file object
+    :param vta_path: the path to write the VTA file to
+    :param p_score_cutoff: the minimum alignment score
+    :return: the number of alignments written
+
+    """
+    count = 0
+
+    with virtool.vta.Writer(vta_path) as writer:
+        for block in iter_blocks(handle):
+            block = block.select(block.scores >= p_score_cutoff)
+
+            writer.write_many(
+                [qname.decode() for qname in block.qnames()],
+                [rname.decode() for rname in block.rnames()],
+                block.pos,
+                block.lengths,
+                block.scores
+            )
+
+            count += len(block)
+
+    return count
+
+
+def filter_refs(handle, p_score_cutoff: float = 0.01) -> set:
+    """
+    Find the IDs of all references with at least one alignment in ``handle`` scoring at least ``p_score_cutoff``.
+
+    :param handle: a binary SAM file object
+    :param p_score_cutoff: the minimum alignment score
+    :return: the reference IDs
+
+    """
+    refs = set()
+
+    for block in iter_blocks(handle):
+        refs.update(block.select(block.scores >= p_score_cutoff).rnames())
+
+    return {ref_id.decode() for ref_id in refs}
+
+
+def filter_scores(handle) -> dict:
+    """
+    Find the alignment score for each read in ``handle``. The last alignment of a read takes precedence.
+
+    :param handle: a binary SAM file object
+    :return: alignment scores keyed by read ID
+
+    """
+    scores = dict()
+
+    for block in iter_blocks(handle):
+        scores.update(zip(block.qnames(), block.scores.tolist()))
+
+    return {read_id.decode(): score for read_id, score in scores.items()}
@@ -72,6 +72,26 @@ SCHEMA = {
             "isolate",
             "strain"
         ]
+    },
+
+    # Pathoscope
+    "pathoscope_em_engine": {
+        "type": "string",
+        "default": "python",
+        "allowed": [
+            "python",
+            "numpy",
+            "squarem"
+        ]
+    },
+    "pathoscope_collapse_reads": {
+        "type": "boolean",
+        "default": False
+    },
+    "pathoscope_index_cache_size": {
+        "type": "integer",
+        "min": 0,
+        "default": 0
     }
 }
 
@@ -1,30 +1,33 @@
 import logging
 import os
 
+import numpy as np
+
+import virtool.fasta
+
 logger = logging.getLogger(__name__)
 
 
 def calculate_fasta_gc(path):
-    nucleotides = {
-        "a": 0,
-        "t": 0,
-        "g": 0,
-        "c": 0,
-        "n": 0
-    }
+    """
+    Calculate the proportion of each nucleotide in the plain or gzip-compressed FASTA file at ``path`` and count its
+    sequences. Bases are counted in whole blocks with :func:`numpy.bincount`, so long sequences are never assembled.
+
+    :param path: the path to the FASTA file
+    :return: the rounded proportion of each nucleotide and the number of sequences
+
+    """
+    counts = np.zeros(256, dtype=np.int64)
 
     count = 0
 
-    # Go through the fasta file getting the nucleotide counts, lengths, and number of sequences
-    with open(path, "r") as handle:
-        for line in handle:
-            if line[0] == ">":
-                count += 1
-                continue
+    # Go through the fasta file getting the nucleotide counts and number of sequences
+    for headers, data, _ in virtool.fasta.read_chunks(path):
+        count += len(headers)
+        counts += np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
 
-            for i in ["a", "t", "g", "c", "n"]:
-                # Find lowercase and uppercase nucleotide characters
-                nucleotides[i] += line.lower().count(i)
+    # Count lowercase and uppercase nucleotide characters together.
+    nucleotides = {i: int(counts[ord(i)] + counts[ord(i.upper())]) for i in ["a", "t", "g", "c", "n"]}
 
     nucleotides_sum = sum(nucleotides.values())
 
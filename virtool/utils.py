@@ -15,6 +15,9 @@ import arrow
 
 RE_STATIC_HASH = re.compile("^main.([a-z0-9]+).css$")
 
+#: The magic bytes at the start of a gzip file.
+GZIP_MAGIC = b"\x1f\x8b"
+
 
 def base_processor(document: Union[dict, None]) -> Union[dict, None]:
     """
@@ -271,5 +274,23 @@ def is_gzipped(path):
     return True
 
 
+def open_binary(path: str):
+    """
+    Open the plain or gzip-compressed file at ``path`` for reading bytes. Compression is detected from the magic bytes
+    at the start of the file rather than its name.
+
+    :param path: the path to the file
+    :return: a binary file object
+
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(GZIP_MAGIC))
+
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, "rb")
+
+    return open(path, "rb")
+
+
 def should_use_pigz(processes: 1):
     return processes > 1 and shutil.which("pigz")
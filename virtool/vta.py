@@ -0,0 +1,309 @@
+"""
+Read and write Virtool alignment (VTA) files.
+
+VTA files store the alignments of sample reads to reference sequences that are used as input for Pathoscope. They are
+binary files with the following layout:
+
+- a fixed-size header (see :data:`HEADER`)
+- one fixed-width record per alignment (see :data:`RECORD_DTYPE`)
+- a newline-separated table of read IDs, indexed by the ``read`` field of each record
+- a newline-separated table of reference IDs, indexed by the ``ref`` field of each record
+
+Records are memory-mapped as a NumPy structured array when a file is loaded, so they never have to be parsed again.
+
+Legacy VTA files are comma-separated text with one ``read_id,ref_id,pos,length,score`` line per alignment. They are
+detected when loaded and converted in memory. Use :func:`convert` to rewrite them in the binary format.
+
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b"VTAB"
+
+VERSION = 1
+
+#: The file header: magic bytes, format version, record count, and the offset and size of the read and reference ID
+#: tables.
+HEADER = struct.Struct("<4sH2xqqqqq")
+
+#: The layout of a single alignment record.
+RECORD = struct.Struct("<iiiid")
+
+#: The layout of a single alignment record as a NumPy dtype. Equivalent to :data:`RECORD`.
+RECORD_DTYPE = np.dtype([
+    ("read", "<i4"),
+    ("ref", "<i4"),
+    ("pos", "<i4"),
+    ("length", "<i4"),
+    ("score", "<f8")
+])
+
+
+class Alignments:
+    """
+    The alignments loaded from a VTA file.
+
+    Read IDs are only decoded on request because they can use a lot of memory for large samples.
+
+    """
+
+    __slots__ = ("records", "refs", "_reads")
+
+    def __init__(self, records, refs, reads):
+        #: A NumPy structured array of alignment records with the dtype :data:`RECORD_DTYPE`.
+        self.records = records
+
+        #: The reference IDs. The ``ref`` field of each record is an index in this list.
+        self.refs = refs
+
+        # Either a list of read IDs or the path, offset, and size of the read ID table in a VTA file.
+        self._reads = reads
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def read_table(self):
+        """
+        The encoded read ID table.
+
+        """
+        if isinstance(self._reads, list):
+            return encode_table(self._reads)
+
+        path, offset, size = self._reads
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def iter_read_ids(self):
+        """
+        Iterate through the read IDs in index order without decoding the entire table at once.
+
+        """
+        if isinstance(self._reads, list):
+            yield from self._reads
+            return
+
+        path, offset, size = self._reads
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+
+            for line in f:
+                if size <= 0:
+                    break
+
+                size -= len(line)
+
+                yield line[:-1].decode()
+
+    def read_ids(self):
+        """
+        Return a list of all read IDs in index order.
+
+        """
+        return list(self.iter_read_ids())
+
+
+class Writer:
+    """
+    Write alignments to a VTA file one at a time. This is intended for use in subprocess output handlers.
+
+    Read and reference IDs are assigned indexes in the order they are first written.
+
+    Use as a context manager:
+
+    .. code-block:: python
+
+        with virtool.vta.Writer(path) as writer:
+            writer.write("read_1", "NC_001836", 12, 50, 45.0)
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self._handle = None
+        self._count = 0
+        self._reads = dict()
+        self._refs = dict()
+
+    def __enter__(self):
+        self._handle = open(self.path, "wb")
+        self._handle.write(b"\0" * HEADER.size)
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, read_id: str, ref_id: str, pos: int, length: int, score: float):
+        read_index = self._reads.get(read_id)
+
+        if read_index is None:
+            read_index = self._reads[read_id] = len(self._reads)
+
+        ref_index = self._refs.get(ref_id)
+
+        if ref_index is None:
+            ref_index = self._refs[ref_id] = len(self._refs)
+
+        self._handle.write(RECORD.pack(read_index, ref_index, pos, length, score))
+
+        self._count += 1
+
+    def write_many(self, read_ids: list, ref_ids: list, pos, lengths, scores):
+        """
+        Write many alignments at once. The result is the same as calling :meth:`write` for each alignment in order.
+
+        """
+        records = np.empty(len(read_ids), dtype=RECORD_DTYPE)
+
+        reads = self._reads
+        refs = self._refs
+
+        records["read"] = [reads.setdefault(read_id, len(reads)) for read_id in read_ids]
+        records["ref"] = [refs.setdefault(ref_id, len(refs)) for ref_id in ref_ids]
+        records["pos"] = pos
+        records["length"] = lengths
+        records["score"] = scores
+
+        self._handle.write(records.tobytes())
+
+        self._count += len(records)
+
+    def close(self):
+        if self._handle is None:
+            return
+
+        write_tables(self._handle, self._count, encode_table(self._reads), encode_table(self._refs))
+
+        self._handle.close()
+        self._handle = None
+
+
+def encode_table(ids) -> bytes:
+    """
+    Encode an ordered collection of IDs as a newline-separated table.
+
+    """
+    return "".join(f"{i}\n" for i in ids).encode()
+
+
+def decode_table(table: bytes) -> list:
+    return table.decode().splitlines()
+
+
+def write_tables(handle, record_count: int, read_table: bytes, ref_table: bytes):
+    """
+    Write the read and reference ID tables to the end of an open VTA file and fill in its header.
+
+    """
+    reads_offset = HEADER.size + record_count * RECORD_DTYPE.itemsize
+    refs_offset = reads_offset + len(read_table)
+
+    handle.seek(reads_offset)
+    handle.write(read_table)
+    handle.write(ref_table)
+
+    handle.seek(0)
+    handle.write(HEADER.pack(MAGIC, VERSION, record_count, reads_offset, len(read_table), refs_offset, len(ref_table)))
+
+
+def write(path: str, records, read_table: bytes, refs: list):
+    """
+    Write a complete VTA file from a record array and ID tables.
+
+    :param path: the path to write to
+    :param records: an array of records with the dtype :data:`RECORD_DTYPE`
+    :param read_table: the encoded read ID table
+    :param refs: the reference IDs
+
+    """
+    with open(path, "wb") as handle:
+        handle.write(b"\0" * HEADER.size)
+        handle.write(np.ascontiguousarray(records, dtype=RECORD_DTYPE).tobytes())
+        write_tables(handle, len(records), read_table, encode_table(refs))
+
+
+def is_legacy(path: str) -> bool:
+    """
+    Check if the VTA file at ``path`` is in the legacy comma-separated text format.
+
+    """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) != MAGIC
+
+
+def load(path: str) -> Alignments:
+    """
+    Load the VTA file at ``path``. Binary records are memory-mapped. Legacy text files are converted in memory.
+
+    :param path: the path to the VTA file
+    :return: the loaded alignments
+
+    """
+    if is_legacy(path):
+        return load_legacy(path)
+
+    with open(path, "rb") as f:
+        magic, version, count, reads_offset, reads_size, refs_offset, refs_size = HEADER.unpack(f.read(HEADER.size))
+
+        if version != VERSION:
+            raise ValueError(f"Unsupported VTA version: {version}")
+
+        f.seek(refs_offset)
+        refs = decode_table(f.read(refs_size))
+
+    if count:
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+    else:
+        records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    return Alignments(records, refs, (path, reads_offset, reads_size))
+
+
+def load_legacy(path: str) -> Alignments:
+    """
+    Load a legacy comma-separated VTA file into memory.
+
+    """
+    read_indexes = dict()
+    ref_indexes = dict()
+
+    records = list()
+
+    with open(path, "r") as f:
+        for line in f:
+            read_id, ref_id, pos, length, score = line.rstrip().split(",")
+
+            read_index = read_indexes.setdefault(read_id, len(read_indexes))
+            ref_index = ref_indexes.setdefault(ref_id, len(ref_indexes))
+
+            records.append((read_index, ref_index, int(pos), int(length), float(score)))
+
+    return Alignments(np.array(records, dtype=RECORD_DTYPE), list(ref_indexes), list(read_indexes))
+
+
+def convert(vta_path: str, path: str):
+    """
+    Convert the legacy comma-separated VTA file at ``vta_path`` to a binary VTA file at ``path``.
+
+    """
+    alignments = load_legacy(vta_path)
+    write(path, alignments.records, alignments.read_table, alignments.refs)
+
+
+def iter_lines(path: str):
+    """
+    Iterate through the alignments in the VTA file at ``path`` as legacy comma-separated lines.
+
+    """
+    alignments = load(path)
+
+    read_ids = alignments.read_ids()
+
+    for read_index, ref_index, pos, length, score in alignments.records.tolist():
+        yield f"{read_ids[read_index]},{alignments.refs[ref_index]},{pos},{length},{score}\n"